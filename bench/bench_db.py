@@ -0,0 +1,118 @@
+"""
+Storage layer benchmark: many concurrent uploads writing to and reading from SQLite.
+
+Compares the storage layer (WAL, one writer thread, reused connections) with
+the previous approach (a new default-journal connection per call). Every upload
+saves its rows and then reads the catalog back, as handle_document does.
+
+    python -m bench.bench_db --uploads 50 --rows 200 --json bench_db.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+from db import database
+
+
+def legacy_save(websites_data):
+    conn = sqlite3.connect(database.DATABASE_NAME)  # New connection per call, default journal mode
+    conn.executemany("INSERT INTO websites (title, url, xpath) VALUES (?, ?, ?)",
+                     [(data['title'], data['url'], data['xpath']) for data in websites_data])
+    conn.commit()
+    conn.close()
+
+
+def legacy_read():
+    conn = sqlite3.connect(database.DATABASE_NAME)
+    cursor = conn.execute("SELECT id, title, url, xpath FROM websites")
+    columns = [col[0] for col in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    conn.close()
+    return rows
+
+
+def make_rows(upload, count):
+    return [{'title': f"Upload {upload} site {i}", 'url': f"https://shop{i % 50}.example/{upload}/{i}",
+             'xpath': "//span[@class='price']"} for i in range(count)]
+
+
+async def timed(timings, key, coro):
+    start = time.perf_counter()
+    await coro
+    timings[key].append(time.perf_counter() - start)
+
+
+async def run_legacy(uploads, rows, timings):
+    async def upload(n):
+        await timed(timings, 'write', asyncio.to_thread(legacy_save, make_rows(n, rows)))
+        await timed(timings, 'read', asyncio.to_thread(legacy_read))
+    await asyncio.gather(*(upload(n) for n in range(uploads)))
+
+
+async def run_storage_layer(uploads, rows, timings):
+    async def upload(n):
+        await timed(timings, 'write', database.asave_website_data(make_rows(n, rows)))
+        await timed(timings, 'read', database.run_read(database.get_all_websites))
+    await asyncio.gather(*(upload(n) for n in range(uploads)))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure(mode, runner, uploads, rows):
+    with tempfile.TemporaryDirectory() as directory:
+        database.DATABASE_NAME = os.path.join(directory, "bench.db")
+        database.init_db()
+        if mode == "legacy":
+            database.get_connection().execute("PRAGMA journal_mode=DELETE")
+            database.close_connections()
+        timings = {'write': [], 'read': []}
+        start = time.perf_counter()
+        try:
+            asyncio.run(runner(uploads, rows, timings))
+        except sqlite3.OperationalError as e:
+            return {'mode': mode, 'error': str(e)}
+        finally:
+            database.close_connections()
+        elapsed = time.perf_counter() - start
+    total_rows = uploads * rows
+    return {
+        'mode': mode,
+        'uploads': uploads,
+        'rows_per_upload': rows,
+        'seconds': round(elapsed, 4),
+        'rows_inserted_per_s': round(total_rows / elapsed, 1),
+        'uploads_per_s': round(uploads / elapsed, 2),
+        'write_p50_ms': round(percentile(timings['write'], 0.5) * 1000, 2),
+        'write_p95_ms': round(percentile(timings['write'], 0.95) * 1000, 2),
+        'read_p50_ms': round(percentile(timings['read'], 0.5) * 1000, 2),
+        'read_p95_ms': round(percentile(timings['read'], 0.95) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=50, help="Concurrent uploads")
+    parser.add_argument("--rows", type=int, default=200, help="Rows per upload")
+    parser.add_argument("--json", help="Write the results to this file as JSON")
+    args = parser.parse_args()
+
+    results = [
+        measure("legacy", run_legacy, args.uploads, args.rows),
+        measure("storage_layer", run_storage_layer, args.uploads, args.rows),
+    ]
+    for result in results:
+        print(json.dumps(result, ensure_ascii=False))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
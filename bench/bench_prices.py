@@ -0,0 +1,91 @@
+"""
+Price cleaning micro-benchmark: clean_price_string per element vs the batch API.
+
+Cleans a column of raw price texts in mixed locale formats, as a catalog page
+with many price nodes produces, and averages them. The legacy path is also run
+with its per-call log record enabled, as it was at INFO before; the log goes to an in-memory stream so only
+the formatting cost is measured, not terminal output.
+
+    python -m bench.bench_prices --texts 500 --repeat 200 --json bench_prices.json
+"""
+import argparse
+import io
+import json
+import logging
+import random
+import time
+
+from parser.prices import clean_prices, price_stats
+
+FORMATS = ["{:,.2f} ₽", "{:,.0f} руб.", "{:,.2f}", "от {:,.0f} ₽", "Цена: {:,.2f} $"]
+
+
+def make_texts(count, seed=0):
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        text = rng.choice(FORMATS).format(rng.uniform(10, 200000))
+        if rng.random() < 0.5:
+            text = text.replace(",", " ").replace(".", ",")  # Russian grouping: "1 299,00"
+        texts.append(text)
+    return texts
+
+
+def legacy_average(texts):
+    from parser.parser import clean_price_string
+
+    prices = []
+    for text in texts:
+        price = clean_price_string(text)
+        if price is not None:
+            prices.append(price)
+    return sum(prices) / len(prices) if prices else None
+
+
+def batch_average(texts):
+    stats = price_stats(clean_prices(texts))
+    return stats['mean'] if stats else None
+
+
+def measure(mode, func, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(texts)
+    elapsed = time.perf_counter() - start
+    return {
+        'mode': mode,
+        'texts': len(texts),
+        'repeat': repeat,
+        'seconds': round(elapsed, 4),
+        'texts_per_s': round(len(texts) * repeat / elapsed, 1),
+        'us_per_text': round(elapsed / (len(texts) * repeat) * 1e6, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=500, help="Price texts per page")
+    parser.add_argument("--repeat", type=int, default=200, help="Pages cleaned per mode")
+    parser.add_argument("--json", help="Write the results to this file as JSON")
+    args = parser.parse_args()
+
+    texts = make_texts(args.texts)
+    import parser.parser  # noqa: F401  Configures logging before the handlers are replaced below
+    root = logging.getLogger()
+    root.handlers = [logging.StreamHandler(io.StringIO())]
+
+    results = []
+    root.setLevel(logging.DEBUG)
+    results.append(measure("legacy_logged", legacy_average, texts, args.repeat))
+    root.setLevel(logging.WARNING)
+    results.append(measure("legacy_no_logging", legacy_average, texts, args.repeat))
+    results.append(measure("batch", batch_average, texts, args.repeat))
+    for result in results:
+        print(json.dumps(result, ensure_ascii=False))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
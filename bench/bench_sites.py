@@ -0,0 +1,287 @@
+"""
+End-to-end parsing benchmark against local shop pages, without network access.
+
+Serves synthetic shop pages (or recorded ones from --pages) from local HTTP
+servers, one per fake shop on its own loopback address (127.0.0.2, 127.0.0.3,
+...), so per-domain limits apply as they would to real shops. It then runs
+get_average_prices at each batch size twice: first cold (refresh=True, every
+site is parsed) and then warm (served from the price cache).
+
+Static pages are parsed by the HTTP tier. With --spa-ratio, that share of the
+shops render their prices with JavaScript, which forces the Selenium tier
+(Chrome and ChromeDriver must be installed).
+
+Reported per run:
+- throughput in sites per second
+- p50/p95 latency per site
+- peak RSS of the process and its child processes, Chrome included
+- peak number of browsers
+
+    python -m bench.bench_sites --sites 1 10 100 1000 --json bench_sites.json
+
+Loopback addresses other than 127.0.0.1 need Linux; use --shops 1 elsewhere.
+"""
+import argparse
+import html
+import json
+import logging
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench.bench_prices import make_texts
+from db import database
+from db.database import init_db
+from metrics import STAGE_SITE, metrics
+from parser import parser
+from parser.cache import PriceCache
+from parser.fetch import shutdown_fetcher
+from parser.pool import browser_count, shutdown_pool
+
+PRICE_XPATH = "//span[@class='price']"
+SAMPLE_INTERVAL = 0.05  # Seconds between RSS and browser count samples
+
+STATIC_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title></head>
+<body><h1>{title}</h1><ul>{items}</ul></body></html>"""
+SPA_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title></head>
+<body><div id="app"></div><script>
+setTimeout(function () {{ document.getElementById("app").innerHTML = {items}; }}, 50);
+</script></body></html>"""
+
+
+@lru_cache(maxsize=None)
+def make_page(shop, item, prices, spa):
+    rng = random.Random(shop * 100003 + item)
+    items = "".join(f"<li>Товар {n} <span class='price'>{html.escape(text)}</span></li>"
+                    for n, text in enumerate(make_texts(prices, seed=rng.randrange(1 << 30))))
+    title = f"Shop {shop} item {item}"
+    if spa:
+        return SPA_PAGE.format(title=title, items=json.dumps(f"<ul>{items}</ul>")).encode("utf-8")
+    return STATIC_PAGE.format(title=title, items=items).encode("utf-8")
+
+
+class ShopHandler(BaseHTTPRequestHandler):
+    """Serves /item/<n> pages of one fake shop."""
+
+    server_version = "BenchShop/1.0"
+
+    def do_GET(self):
+        try:
+            item = int(self.path.rstrip("/").rsplit("/", 1)[1])
+        except (IndexError, ValueError):
+            self.send_error(404)
+            return
+        shop = self.server.shop
+        if self.server.recorded:
+            body = self.server.recorded[item % len(self.server.recorded)]
+        else:
+            body = make_page(shop, item, self.server.prices, self.server.spa)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep the benchmark output clean
+
+
+def start_shops(count, prices, spa_ratio, recorded):
+    """Starts one HTTP server per shop and returns them; shop k listens on 127.0.0.(k+2)."""
+    servers = []
+    spa_shops = round(count * spa_ratio)
+    for shop in range(count):
+        host = f"127.0.0.{shop + 2}" if count > 1 else "127.0.0.1"
+        server = ThreadingHTTPServer((host, 0), ShopHandler)
+        server.daemon_threads = True
+        server.shop = shop
+        server.prices = prices
+        server.spa = shop < spa_shops
+        server.recorded = recorded
+        threading.Thread(target=server.serve_forever, name=f"shop-{shop}", daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def load_recorded(directory):
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(directory, name), "rb") as f:
+                pages.append(f.read())
+    if not pages:
+        raise SystemExit(f"No .html files in {directory}")
+    return pages
+
+
+def make_sites(servers, count, xpath=PRICE_XPATH):
+    sites = []
+    for i in range(count):
+        host, port = servers[i % len(servers)].server_address
+        sites.append({'title': f"Site {i}", 'url': f"http://{host}:{port}/item/{i}", 'xpath': xpath})
+    return sites
+
+
+def tree_rss_bytes():
+    """RSS of this process and all of its descendants (Linux /proc), or None elsewhere."""
+    try:
+        children = {}
+        rss = {}
+        page = os.sysconf("SC_PAGE_SIZE")
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            children.setdefault(int(fields[1]), []).append(int(pid))  # fields[1] is the parent pid
+            rss[int(pid)] = int(fields[21]) * page  # fields[21] is the resident page count
+    except (OSError, ValueError):
+        return None
+    total, stack = 0, [os.getpid()]
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return total
+
+
+class PeakSampler:
+    """Samples the process tree RSS and the number of live browsers in the background, keeping the peaks."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_browsers = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bench-sampler", daemon=True)
+
+    def _sample(self):
+        rss = tree_rss_bytes()
+        if rss is None:  # No /proc: fall back to this process' own peak
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_browsers = max(self.peak_browsers, browser_count())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def measure(sites, mode):
+    """Runs one batch and returns its results; `mode` is 'cold' (parse everything) or 'warm' (cache)."""
+    metrics.reset()
+    with PeakSampler() as sampler:
+        start = time.perf_counter()
+        prices = parser.get_average_prices(sites, refresh=(mode == "cold"))
+        elapsed = time.perf_counter() - start
+    # The engine times every parsed site; cache hits are not timed one by one, so a warm run reports the mean
+    stage = metrics.snapshot()['stages'].get(STAGE_SITE) or {'p50': elapsed / len(sites), 'p95': elapsed / len(sites)}
+    found = sum(price is not None for price in prices.values())
+    return {
+        'mode': mode,
+        'sites': len(sites),
+        'seconds': round(elapsed, 4),
+        'sites_per_s': round(len(sites) / elapsed, 1),
+        'site_p50_ms': round(stage['p50'] * 1000, 2),
+        'site_p95_ms': round(stage['p95'] * 1000, 2),
+        'prices_found': found,
+        'peak_rss_mb': round(sampler.peak_rss / 2 ** 20, 1),
+        'peak_browsers': sampler.peak_browsers,
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    """Compares results with a baseline run; returns a description of every metric worse by more than `tolerance`."""
+    previous = {(result['mode'], result['sites']): result for result in baseline if 'sites_per_s' in result}
+    regressions = []
+    for result in results:
+        base = previous.get((result['mode'], result['sites']))
+        if base is None:
+            continue
+        key = f"{result['mode']} x{result['sites']}"
+        if result['sites_per_s'] < base['sites_per_s'] * (1 - tolerance):
+            regressions.append(f"{key}: sites_per_s {base['sites_per_s']} -> {result['sites_per_s']}")
+        if result['mode'] == "cold" and result['site_p95_ms'] > base['site_p95_ms'] * (1 + tolerance):
+            regressions.append(f"{key}: site_p95_ms {base['site_p95_ms']} -> {result['site_p95_ms']}")
+        if result['prices_found'] < base['prices_found']:
+            regressions.append(f"{key}: prices_found {base['prices_found']} -> {result['prices_found']}")
+    return regressions
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--sites", type=int, nargs="+", default=[1, 10, 100, 1000], help="Batch sizes to run")
+    argparser.add_argument("--shops", type=int, default=20, help="Fake shops (distinct domains) the sites are spread over")
+    argparser.add_argument("--prices", type=int, default=20, help="Price elements per synthetic page")
+    argparser.add_argument("--spa-ratio", type=float, default=0.0,
+                           help="Share of shops rendering prices with JavaScript (needs Chrome)")
+    argparser.add_argument("--pages", help="Serve recorded .html pages from this directory instead of synthetic ones "
+                                           "(prices are looked up with --xpath)")
+    argparser.add_argument("--xpath", default=PRICE_XPATH, help="Price XPath of the recorded pages")
+    argparser.add_argument("--json", help="Write the results to this file as JSON")
+    argparser.add_argument("--baseline", help="Exit with status 1 if results are worse than this earlier --json output")
+    argparser.add_argument("--tolerance", type=float, default=0.25,
+                           help="Allowed relative slowdown against the baseline (default 0.25)")
+    args = argparser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)  # The parser logs every site at INFO
+    recorded = load_recorded(args.pages) if args.pages else None
+    servers = start_shops(args.shops, args.prices, args.spa_ratio, recorded)
+    results = []
+    get_cache = parser.get_cache
+    directory = tempfile.TemporaryDirectory()
+    try:
+        # Breaker state and learned timeouts go to a throwaway database, not the bot's
+        database.DATABASE_NAME = os.path.join(directory.name, "bench.db")
+        init_db()
+        for count in args.sites:
+            sites = make_sites(servers, count, args.xpath)
+            cache = PriceCache(db_path=None)  # Fresh and in memory only, so the bot's persistent cache is left alone
+            parser.get_cache = lambda: cache
+            for mode in ("cold", "warm"):
+                result = measure(sites, mode)
+                results.append(result)
+                print(json.dumps(result, ensure_ascii=False))
+    finally:
+        parser.get_cache = get_cache
+        parser.shutdown_engine()
+        shutdown_fetcher()
+        shutdown_pool()
+        for server in servers:
+            server.shutdown()
+        database.close_connections()
+        directory.cleanup()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
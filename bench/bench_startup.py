@@ -0,0 +1,96 @@
+"""
+Cold start benchmark: how long the bot's modules take to import.
+
+Imports each entry point in a fresh interpreter several times and reports the
+median and fastest import time, the whole process' wall time, and which heavy
+modules (Selenium, webdriver_manager, pandas, openpyxl) got loaded on the way.
+Those should only load on first use, never at startup.
+
+    python -m bench.bench_startup --repeat 5 --json bench_startup.json
+    python -m bench.bench_startup --baseline bench_startup.json  # exit status 1 on a regression
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+TARGETS = ("bot.bot", "bot.handlers.basic", "parser.parser", "worker.worker")
+HEAVY_MODULES = ("selenium", "webdriver_manager", "pandas", "openpyxl")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {target}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'heavy': sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+
+
+def measure(target, repeat):
+    env = dict(os.environ, BOT_TOKEN=os.getenv("BOT_TOKEN") or "0:bench")  # config.py exits without a token
+    imports, walls, heavy = [], [], set()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", PROBE.format(target=target, heavy=HEAVY_MODULES)],
+                                env=env, capture_output=True, text=True, check=True).stdout
+        walls.append(time.perf_counter() - start)
+        probe = json.loads(output.strip().splitlines()[-1])
+        imports.append(probe['seconds'])
+        heavy.update(probe['heavy'])
+    return {
+        'target': target,
+        'import_median_ms': round(statistics.median(imports) * 1000, 1),
+        'import_min_ms': round(min(imports) * 1000, 1),
+        'process_median_ms': round(statistics.median(walls) * 1000, 1),
+        'heavy_modules': sorted(heavy),
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    """Compares results with a baseline run; returns a description of every target that got worse."""
+    previous = {result['target']: result for result in baseline}
+    regressions = []
+    for result in results:
+        if result['heavy_modules']:
+            regressions.append(f"{result['target']}: loads {', '.join(result['heavy_modules'])} at import")
+        base = previous.get(result['target'])
+        if base and result['import_median_ms'] > base['import_median_ms'] * (1 + tolerance):
+            regressions.append(f"{result['target']}: import_median_ms "
+                               f"{base['import_median_ms']} -> {result['import_median_ms']}")
+    return regressions
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--targets", nargs="+", default=list(TARGETS), help="Modules to import")
+    argparser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per module")
+    argparser.add_argument("--json", help="Write the results to this file as JSON")
+    argparser.add_argument("--baseline", help="Exit with status 1 if results are worse than this earlier --json output")
+    argparser.add_argument("--tolerance", type=float, default=0.25,
+                           help="Allowed relative slowdown against the baseline (default 0.25)")
+    args = argparser.parse_args()
+
+    results = []
+    for target in args.targets:
+        result = measure(target, args.repeat)
+        results.append(result)
+        print(json.dumps(result))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+    else:
+        regressions = find_regressions(results, [], args.tolerance)  # Heavy modules at import are always a regression
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Throughput of the distributed mode against the number of worker processes.
+
+Starts the local fake shops of bench_sites, then for each worker count spawns
+that many `python -m worker.worker` processes on a scratch database, publishes
+one parse job and times until every site is finished. Each result records
+the host's CPU count: worker processes beyond it share cores, so scaling can
+only be judged on runs with `workers <= cpus`. Past that, the shops or the
+per-domain limit (TASK_PER_DOMAIN_LIMIT x shops) also cap throughput.
+
+    python -m bench.bench_workers --workers 1 2 4 --sites 2000 --threads 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.bench_sites import make_sites, start_shops
+from db import database
+from db.database import create_parse_job, delete_parse_job, init_db, take_finished_tasks
+from parser.tasks import make_tasks
+
+POLL_INTERVAL = 0.05
+
+
+def run(workers, sites, threads, db_path):
+    env = dict(os.environ, DATABASE_PATH=db_path, WORKER_POLL_INTERVAL="0.05", BROWSER_PREWARM="0")
+    processes = [subprocess.Popen([sys.executable, "-m", "worker.worker", "--threads", str(threads)], env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for _ in range(workers)]
+    try:
+        time.sleep(1.0)  # Let the workers import and connect before the clock starts
+        start = time.perf_counter()
+        job_id = create_parse_job(make_tasks(sites))
+        done = found = 0
+        while done < len(sites):
+            finished = take_finished_tasks(job_id)
+            done += len(finished)
+            found += sum(task['price'] is not None for task in finished)
+            if done < len(sites):
+                time.sleep(POLL_INTERVAL)
+        elapsed = time.perf_counter() - start
+        delete_parse_job(job_id)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    return {
+        'workers': workers,
+        'threads': threads,
+        'cpus': os.cpu_count(),
+        'sites': len(sites),
+        'seconds': round(elapsed, 3),
+        'sites_per_s': round(len(sites) / elapsed, 1),
+        'prices_found': found,
+    }
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker process counts to run")
+    argparser.add_argument("--sites", type=int, default=2000, help="Sites in the parse job")
+    argparser.add_argument("--threads", type=int, default=4, help="Threads per worker")
+    argparser.add_argument("--shops", type=int, default=20, help="Fake shops (distinct domains) the sites are spread over")
+    argparser.add_argument("--prices", type=int, default=20, help="Price elements per synthetic page")
+    argparser.add_argument("--json", help="Write the results to this file as JSON")
+    args = argparser.parse_args()
+
+    if max(args.workers) > (os.cpu_count() or 1):
+        print(f"Warning: only {os.cpu_count()} CPUs, runs with more workers do not show scaling", file=sys.stderr)
+    servers = start_shops(args.shops, args.prices, 0.0, None)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            database.DATABASE_NAME = os.path.join(directory, "bench.db")
+            init_db()
+            sites = make_sites(servers, args.sites)
+            for workers in args.workers:
+                result = run(workers, sites, args.threads, database.DATABASE_NAME)
+                results.append(result)
+                print(json.dumps(result))
+            database.close_connections()
+    finally:
+        for server in servers:
+            server.shutdown()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
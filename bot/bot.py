@@ -1,6 +1,7 @@
 import asyncio
 import logging
 import os
+import time
 
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
@@ -8,9 +9,19 @@ from aiogram.types import BotCommand
 from aiogram.client.default import DefaultBotProperties
 from dotenv import load_dotenv
 
-from bot.handlers import basic
+from bot.handlers import admin, basic, history, subscriptions
+from bot.jobs import JobQueue
+from bot.middlewares import UpdateLatencyMiddleware
+from bot.scheduler import CatalogScheduler
 from config import BOT_TOKEN
-from db.database import init_db
+from db.database import close_connections, count_parse_tasks, init_db, purge_parse_jobs
+from metrics import MetricsServer, metrics
+from parser.cache import get_cache
+from parser.fetch import shutdown_fetcher
+from parser.parser import get_engine, shutdown_engine
+from parser.pool import browser_count, prewarm_pool, shutdown_pool
+from parser.reliability import get_reliability
+from parser.tasks import is_distributed, queued_parse_price
 
 load_dotenv()
 
@@ -18,16 +29,68 @@ async def main():
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     dp = Dispatcher()
 
+    # Замер времени обработки каждого update
+    dp.update.outer_middleware(UpdateLatencyMiddleware())
+
     # Регистрация handlers
     dp.include_router(basic.router)
+    dp.include_router(history.router)
+    dp.include_router(subscriptions.router)
+    dp.include_router(admin.router)
+
+    # Фоновая очередь задач парсинга (передается в handlers как `jobs`)
+    jobs = JobQueue()
+    dp["jobs"] = jobs
+    dp.startup.register(jobs.start)
+
+    # Периодический фоновый перепарсинг сайтов из базы (в распределенном режиме сайты парсят воркеры)
+    scheduler = (CatalogScheduler(bot, parse_func=queued_parse_price) if is_distributed()
+                 else CatalogScheduler(bot, engine=get_engine()))
+    dp.startup.register(scheduler.start)
+
+    # Прогрев браузеров в фоне, чтобы не задерживать начало polling (в распределенном режиме Chrome нужен только воркерам)
+    if not is_distributed():
+        dp.startup.register(prewarm_pool)
+
+    # Метрики: /stats для администраторов и Prometheus-эндпоинт (если задан METRICS_PORT).
+    # Gauges читаются в рабочем потоке, поэтому запросы к БД в них не блокируют event loop
+    metrics.register_gauge("job_queue_depth", lambda: jobs.depth)
+    metrics.register_gauge("jobs_running", lambda: jobs.running)
+    metrics.register_gauge("browsers", browser_count)
+    metrics.register_gauge("price_cache_size", lambda: get_cache().stats()['size'])
+    metrics.register_gauge("price_cache_hit_rate", lambda: get_cache().stats()['hit_rate'])
+    if is_distributed():
+        metrics.register_gauge("tasks_pending", lambda: count_parse_tasks().get('pending', 0))
+        metrics.register_gauge("tasks_leased", lambda: count_parse_tasks().get('leased', 0))
+    else:
+        metrics.register_gauge("open_circuits", lambda: len(get_reliability().open_domains()))
+    metrics_server = MetricsServer()
+    dp.startup.register(metrics_server.start)
 
     # Установка команд бота (для отображения в меню)
     await bot.set_my_commands([
         BotCommand(command="/start", description="Начать работу с ботом"),
-        BotCommand(command="/help", description="Помощь")
+        BotCommand(command="/help", description="Помощь"),
+        BotCommand(command="/history", description="История цен сайта"),
+        BotCommand(command="/subscribe", description="Подписаться на изменение цен"),
+        BotCommand(command="/unsubscribe", description="Отписаться от изменения цен"),
+        BotCommand(command="/subscriptions", description="Мои подписки"),
+        BotCommand(command="/stats", description="Статистика работы (для администраторов)")
     ])
 
     init_db()
+    if is_distributed():
+        purge_parse_jobs(time.time())  # Jobs of a previous run have nobody left to report to
+        logging.info("Distributed mode: parsing is done by worker processes (python -m worker.worker)")
+
+    # Остановка очереди, планировщика, парсера, HTTP-сессии, закрытие пула браузеров и соединений с БД при остановке бота
+    dp.shutdown.register(jobs.stop)
+    dp.shutdown.register(metrics_server.stop)
+    dp.shutdown.register(scheduler.stop)
+    dp.shutdown.register(shutdown_engine)
+    dp.shutdown.register(shutdown_fetcher)
+    dp.shutdown.register(shutdown_pool)
+    dp.shutdown.register(close_connections)
 
     await dp.start_polling(bot, skip_updates=True)
 
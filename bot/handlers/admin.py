@@ -0,0 +1,63 @@
+import html
+import os
+
+from aiogram import Router
+from aiogram.filters import Command
+from aiogram.types import Message
+
+from db.database import run_read
+from metrics import (COUNTER_CACHE_HITS, COUNTER_CIRCUIT_OPEN, COUNTER_FAILURES, COUNTER_RETRIES, COUNTER_SITES,
+                     COUNTER_TIMEOUTS, metrics)
+
+router = Router()
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").replace(",", " ").split()}  # Telegram user ids allowed to use /stats
+TOP_DOMAINS = 10  # Domains with the most failures listed by /stats
+
+
+def by_domain(snapshot, counter):
+    totals = {}
+    for labels, value in snapshot['counters'].get(counter, {}).items():
+        domain = dict(labels).get('domain')
+        totals[domain] = totals.get(domain, 0) + value
+    return totals
+
+
+def format_stats(snapshot=None):
+    """Formats the metrics for the /stats command: stage timings, queue and cache gauges, failing domains."""
+    snapshot = snapshot or metrics.snapshot()
+    text = "<b>Этапы</b> (p50 / p95 / max, с; количество):\n"
+    for stage, stats in sorted(snapshot['stages'].items()):
+        text += f"{html.escape(stage)}: {stats['p50']:.2f} / {stats['p95']:.2f} / {stats['max']:.2f}; {stats['count']}\n"
+    if not snapshot['stages']:
+        text += "нет данных\n"
+
+    if snapshot['gauges']:
+        text += "\n<b>Состояние:</b>\n"
+        for name, value in sorted(snapshot['gauges'].items()):
+            text += f"{html.escape(name)}: {value:g}\n"
+
+    sites = by_domain(snapshot, COUNTER_SITES)
+    hits = by_domain(snapshot, COUNTER_CACHE_HITS)
+    failures = by_domain(snapshot, COUNTER_FAILURES)
+    timeouts = by_domain(snapshot, COUNTER_TIMEOUTS)
+    text += f"\nСайтов спарсено: {sum(sites.values())}, из кэша: {sum(hits.values())}, "
+    text += f"без цены: {sum(failures.values())}, таймаутов: {sum(timeouts.values())}\n"
+    text += f"Повторов: {sum(by_domain(snapshot, COUNTER_RETRIES).values())}, "
+    text += f"пропущено (circuit breaker открыт): {sum(by_domain(snapshot, COUNTER_CIRCUIT_OPEN).values())}\n"
+
+    worst = sorted(failures, key=lambda domain: (-failures[domain], domain))[:TOP_DOMAINS]
+    if worst:
+        text += "\n<b>Домены с ошибками</b> (без цены / таймауты / всего):\n"
+        for domain in worst:
+            text += f"{html.escape(str(domain))}: {failures[domain]} / {timeouts.get(domain, 0)} / {sites.get(domain, 0)}\n"
+    return text
+
+
+@router.message(Command("stats"))
+async def command_stats_handler(message: Message) -> None:
+    """Handles the /stats command (admins only): timings of every pipeline stage and per-domain counters."""
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("Команда доступна только администраторам.")
+        return
+    snapshot = await run_read(metrics.snapshot)  # Gauges may query the database
+    await message.answer(format_stats(snapshot), parse_mode="HTML")
@@ -1,16 +1,29 @@
-import os
-import pandas as pd
+import asyncio
+import html
+import logging
 import sqlite3
+import time
 from aiogram import Router, types, F, Bot
 from aiogram.filters import CommandStart
 from aiogram.types import Message
-from db.database import save_website_data, get_all_websites  # Assuming you have a get_all_websites function
+from db.database import arecord_prices, asave_website_data
 from typing import Optional
-from parser.parser import get_average_prices
+from parser.parser import stream_average_prices
+from parser.tasks import is_distributed, stream_queued_prices
+from bot.progress import ProgressMessage
+from bot.ingest import CSV_EXTENSIONS, IngestError, SheetIngestion, is_supported, read_upload
+from bot.jobs import JobQueue
+from metrics import STAGE_DB_SAVE, STAGE_DOWNLOAD, STAGE_READ, metrics
 
 
 router = Router()
-TEMP_FILE_PATH = "data/temp_file.xlsx"  # Consider making this configurable
+PREVIEW_VALUE_LIMIT = 200  # Characters of a cell shown in the upload preview
+REFRESH_FLAGS = ("refresh", "--refresh", "/refresh", "обновить")  # Caption words that bypass the price cache
+
+
+def wants_refresh(caption: Optional[str]) -> bool:
+    """Checks whether the document caption asks to ignore cached prices."""
+    return any(word in REFRESH_FLAGS for word in (caption or "").lower().split())
 
 @router.message(CommandStart())
 async def command_start_handler(message: Message) -> None:
@@ -18,84 +31,143 @@ async def command_start_handler(message: Message) -> None:
     Handles the /start command.  Provides a welcome message and instructions.
     """
     await message.answer(f"Привет, {message.from_user.full_name}! 👋\n\n"
-                         "Отправь мне Excel файл с данными о сайтах для парсинга.\n\n"
+                         "Отправь мне Excel или CSV файл с данными о сайтах для парсинга.\n\n"
                          "Формат файла:\n"
                          "- Колонка 'title' - название сайта\n"
                          "- Колонка 'url' - ссылка на сайт\n"
                          "- Колонка 'xpath' - XPath к элементу с ценой")
 
+async def run_parse_job(message: types.Message, websites_data: list, refresh: bool = False,
+                        conn: Optional[sqlite3.Connection] = None) -> None:
+    """
+    Parses the websites of one uploaded file and streams the average prices back to the user.
+
+    Selenium work runs in an executor so the event loop keeps serving other updates.
+    A single progress message is edited in place as sites finish, and the prices
+    found are written to the price history in one batch at the end, even if
+    sending the result to the user fails.
+    With `refresh`, cached prices are ignored and every site is parsed again.
+    In distributed mode the sites are published to the task queue and parsed by worker processes.
+    """
+    progress_message = await message.answer("Начинаю парсинг сайтов...")
+    progress = ProgressMessage(progress_message, total=len(websites_data))
+    observations = []
+    try:
+        if is_distributed():
+            prices = stream_queued_prices(websites_data, refresh=refresh, user_id=message.from_user.id)
+        else:
+            prices = stream_average_prices(websites_data, refresh=refresh)
+        async for website, average_price in prices:
+            await progress.add(website['title'], average_price)
+            if 'id' in website:  # Linked by catalog id: titles are not unique
+                observations.append((website['id'], average_price))
+        await progress.finish()
+
+    except Exception as e:
+        await message.answer(f"Произошла ошибка при парсинге: {e}")
+    finally:
+        try:
+            await arecord_prices(observations, conn)  # The prices are worth keeping even if the reply failed
+        except sqlite3.Error as e:
+            logging.error(f"Could not record {len(observations)} prices: {e}")
+
+
+def shorten(value: str, limit: int = PREVIEW_VALUE_LIMIT) -> str:
+    return value if len(value) <= limit else value[:limit - 1] + "…"
+
+
+def format_preview(websites, total):
+    """Formats the first rows of an upload for verification; long values are shortened."""
+    output_text = "Содержимое файла:\n\n"
+    for website in websites:
+        output_text += f"<b>{html.escape(shorten(website['title']))}</b>\n"  # Use HTML for bold title
+        output_text += f"URL: {html.escape(shorten(website['url']))}\n"
+        output_text += f"XPath: {html.escape(shorten(website['xpath']))}\n\n"
+    if total > len(websites):
+        output_text += f"... и еще строк: {total - len(websites)}\n"
+    return output_text
+
+
 @router.message(F.document)
-async def handle_document(message: types.Message, bot: Bot, conn: Optional[sqlite3.Connection] = None):
+async def handle_document(message: types.Message, bot: Bot, conn: Optional[sqlite3.Connection] = None,
+                          jobs: Optional[JobQueue] = None):
     """
-    Handles document messages, expecting an Excel file (.xls, .xlsx).
+    Handles document messages, expecting an Excel (.xls, .xlsx) or CSV (.csv) file.
 
-    Downloads the file, validates its format, saves website data to the database,
-    parses the websites, and sends the average prices back to the user.
+    Downloads the file into memory, streams its rows in validated chunks into the
+    database, and enqueues a parse job that sends the average prices back to the user.
+    Reading and validating the sheet keeps only one chunk at a time, but the parse
+    job (and its result message) holds every valid row, so memory still grows with
+    the number of rows in the upload.
 
     Args:
         message: The incoming message object.
         bot: The Bot instance.
-        conn: An optional SQLite connection.  If None, a temporary connection will be created
-            (and closed) within this function.  This allows the function to be used
-            either with an existing connection (for a transaction) or standalone.
+        conn: An optional SQLite connection.  If None, the write goes through the storage
+            layer's writer thread.  This allows the function to be used either with an
+            existing connection (for a transaction) or standalone.
+        jobs: The background job queue (injected by the dispatcher).  If None, parsing
+            runs before the handler returns.
     """
-    if message.document.file_name.endswith(('.xls', '.xlsx')):
+    file_name = message.document.file_name
+    if not is_supported(file_name):
+        await message.answer("Пожалуйста, отправьте файл в формате Excel (.xls, .xlsx) или CSV (.csv).")
+        return
+
+    try:
+        with metrics.timer(STAGE_DOWNLOAD):
+            buffer = await read_upload(bot, message.document.file_id)
+        ingestion = SheetIngestion(buffer, file_name)
         try:
-            file_id = message.document.file_id
-            file = await bot.get_file(file_id)
-            file_path = file.file_path
-            await bot.download_file(file_path, TEMP_FILE_PATH)
-
-            df = pd.read_excel(TEMP_FILE_PATH)
-
-            required_columns = ['title', 'url', 'xpath']
-            if not all(col in df.columns for col in required_columns):
-                missing_cols = [col for col in required_columns if col not in df.columns]
-                await message.answer(f"Ошибка: В файле отсутствуют колонки: {', '.join(missing_cols)}.")
-                os.remove(TEMP_FILE_PATH)  # Clean up even on error
-                return
-
-            # Check if DataFrame is empty after reading
-            if df.empty:
-                await message.answer("Файл Excel пуст. Данные не загружены.")
+            await asyncio.to_thread(ingestion.read_header)
+        except IngestError as e:
+            await message.answer(str(e))
+            return
+
+        websites_data = []
+        save_seconds = 0.0
+        async for chunk in ingestion.chunks():
+            start = time.perf_counter()
+            website_ids = await asave_website_data(chunk, conn, user_id=message.from_user.id)  # Save to database (using provided connection or the writer thread)
+            save_seconds += time.perf_counter() - start
+            for website, website_id in zip(chunk, website_ids):
+                website['id'] = website_id  # Links the parsed prices to the catalog
+            websites_data.extend(chunk)
+        metrics.observe(STAGE_READ, ingestion.elapsed)
+        metrics.observe(STAGE_DB_SAVE, save_seconds)
+
+        errors = "\n".join(ingestion.errors)
+        if not websites_data:
+            kind = "CSV" if file_name.lower().endswith(CSV_EXTENSIONS) else "Excel"
+            text = f"Файл {kind} пуст. Данные не загружены."
+            if errors:
+                text = f"В файле нет корректных строк. Данные не загружены.\n{errors}"
+            await message.answer(text)
+            return
+
+        # Display the first rows of the file (for verification)
+        await message.answer(format_preview(ingestion.preview, ingestion.valid_rows), parse_mode="HTML")
+        text = "Данные сохранены в базу данных."
+        skipped = ingestion.total_rows - ingestion.valid_rows
+        if skipped:
+            text += f"\nПропущено некорректных строк: {skipped}\n{errors}"
+        await message.answer(text)
+
+        # --- PARSING ---
+        refresh = wants_refresh(message.caption)
+        if jobs is None:
+            await run_parse_job(message, websites_data, refresh, conn)
+        else:
+            try:
+                ahead = jobs.submit(run_parse_job, message, websites_data, refresh, conn)
+            except asyncio.QueueFull:
+                await message.answer("Сейчас слишком много файлов в очереди. Попробуйте позже.")
                 return
+            if ahead:
+                await message.answer(f"Файл поставлен в очередь на парсинг. Перед ним файлов: {ahead}.")
 
-            # Display the content of the file (for verification)
-            output_text = "Содержимое файла:\n\n"
-            for _, row in df.iterrows():  # Use _ for unused index variable
-                output_text += f"<b>{row['title']}</b>\n"  # Use HTML for bold title
-                output_text += f"URL: {row['url']}\n"
-                output_text += f"XPath: {row['xpath']}\n\n"
-            await message.answer(output_text, parse_mode="HTML")
-
-            websites_data = df.to_dict('records')  # Convert DataFrame to list of dictionaries
-            save_website_data(websites_data, conn)  # Save to database (using provided or temporary connection)
-            await message.answer("Данные сохранены в базу данных.")
-
-            # --- PARSING ---
-            await message.answer("Начинаю парсинг сайтов...")
-            try:
-                website_averages = get_average_prices(websites_data)  # Get average prices
-
-                output_prices = "Средние цены по сайтам:\n\n"
-                for title, average_price in website_averages.items():
-                    if average_price is not None:
-                        output_prices += f"<b>{title}</b>: {average_price:.2f}\n"  # Format price to 2 decimal places
-                    else:
-                        output_prices += f"<b>{title}</b>: Цена не найдена\n"  # Indicate if price was not found
-                await message.answer(output_prices, parse_mode="HTML")  # Use HTML for bold title
-
-            except Exception as e:
-                await message.answer(f"Произошла ошибка при парсинге: {e}")
-
-        except Exception as e:
-            await message.answer(f"Произошла ошибка при обработке файла: {e}")
-        finally:
-            # Always remove the temporary file, even if an error occurred
-            if os.path.exists(TEMP_FILE_PATH):
-                os.remove(TEMP_FILE_PATH)
-    else:
-        await message.answer("Пожалуйста, отправьте файл в формате Excel (.xls, .xlsx).")
+    except Exception as e:
+        await message.answer(f"Произошла ошибка при обработке файла: {e}")
 
 @router.message(F.command.in_(["/help"]))
 async def command_help_handler(message: Message) -> None:
@@ -105,5 +177,7 @@ async def command_help_handler(message: Message) -> None:
     await message.answer("Этот бот позволяет загружать Excel файлы для добавления сайтов в базу данных, а также парсит цены с этих сайтов и вычисляет среднюю цену.\n\n"
                          "Инструкция:\n"
                          "1. Отправьте файл напрямую.\n"
-                         "2. Прикрепите Excel файл с колонками 'title', 'url', 'xpath'.\n"
-                         "3. Бот обработает файл, сохранит данные в базу, выполнит парсинг и выведет средние цены.")
\ No newline at end of file
+                         "2. Прикрепите Excel или CSV файл с колонками 'title', 'url', 'xpath'.\n"
+                         "3. Бот обработает файл, сохранит данные в базу, выполнит парсинг и выведет средние цены.\n\n"
+                         "Недавно полученные цены берутся из кэша. Чтобы спарсить все сайты заново, "
+                         "добавьте к файлу подпись «обновить» (или refresh).")
\ No newline at end of file
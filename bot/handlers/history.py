@@ -0,0 +1,58 @@
+import html
+
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message
+
+from db.database import get_daily_prices, get_websites, run_read
+
+router = Router()
+DEFAULT_DAYS = 30  # Period shown by /history when no number of days is given
+MAX_SITES = 5  # Sites shown for one query
+MAX_DAYS_SHOWN = 14  # Daily lines shown per site
+
+
+def format_history(website, daily):
+    """Formats the daily rollups of one site: a trend line followed by the most recent days."""
+    text = f"<b>{html.escape(str(website['title']))}</b>\n"
+    if not daily:
+        return text + "Нет сохраненных цен за этот период.\n"
+
+    first, last = daily[0]['avg'], daily[-1]['avg']
+    change = (last - first) / first * 100 if first else 0.0
+    text += (f"Минимум: {min(d['min'] for d in daily):.2f}, максимум: {max(d['max'] for d in daily):.2f}, "
+             f"изменение средней: {change:+.1f}%\n")
+    for day in daily[-MAX_DAYS_SHOWN:]:
+        text += f"{day['day']:%d.%m}: {day['avg']:.2f} ({day['min']:.2f}–{day['max']:.2f})\n"
+    return text
+
+
+def lookup_history(user_id, query, days):
+    """Finds the user's own sites matching `query` and loads their rollups."""
+    websites = get_websites(user_id=user_id, search=query, limit=MAX_SITES)
+    return [(website, get_daily_prices(website['id'], days)) for website in websites]
+
+
+@router.message(Command("history", "trend"))
+async def command_history_handler(message: Message, command: CommandObject) -> None:
+    """
+    Handles the /history command: /history <site title or URL> [days].
+
+    Answers from the per-day rollups, so it stays fast however long the history is.
+    """
+    words = (command.args or "").split()
+    days = DEFAULT_DAYS
+    if words and words[-1].isdigit():
+        days = max(1, min(int(words.pop()), 365))
+    query = " ".join(words)
+    if not query:
+        await message.answer("Использование: /history <название сайта или часть URL> [количество дней]")
+        return
+
+    results = await run_read(lookup_history, message.from_user.id, query, days)
+    if not results:
+        await message.answer("Сайты не найдены.")
+        return
+
+    text = f"История цен за {days} дн.:\n\n" + "\n".join(format_history(website, daily) for website, daily in results)
+    await message.answer(text, parse_mode="HTML")
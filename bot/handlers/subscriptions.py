@@ -0,0 +1,65 @@
+import html
+
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message
+
+from db.database import get_subscriptions, get_websites, run_read, run_write, subscribe, unsubscribe
+
+router = Router()
+MAX_MATCHES = 20  # Sites one /subscribe or /unsubscribe query may match
+
+
+def find_sites(user_id, query):
+    """Finds the user's own sites matching `query`; other users' uploads are never matched."""
+    return get_websites(user_id=user_id, search=query, limit=MAX_MATCHES)
+
+
+def format_sites(websites):
+    return "\n".join(f"- <b>{html.escape(str(website['title']))}</b>" for website in websites)
+
+
+@router.message(Command("subscribe"))
+async def command_subscribe_handler(message: Message, command: CommandObject) -> None:
+    """
+    Handles the /subscribe command: /subscribe <site title or URL>.
+
+    The user is notified when the background re-parse finds a new price for the matched sites.
+    """
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("Использование: /subscribe <название сайта или часть URL>")
+        return
+    websites = await run_read(find_sites, message.from_user.id, query)
+    if not websites:
+        await message.answer("Сайты не найдены.")
+        return
+    await run_write(subscribe, message.from_user.id, [website['id'] for website in websites])
+    await message.answer("Вы будете получать уведомления об изменении цен:\n" + format_sites(websites),
+                         parse_mode="HTML")
+
+
+@router.message(Command("unsubscribe"))
+async def command_unsubscribe_handler(message: Message, command: CommandObject) -> None:
+    """Handles the /unsubscribe command: /unsubscribe <site title or URL>, or /unsubscribe all."""
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("Использование: /unsubscribe <название сайта или часть URL> или /unsubscribe all")
+        return
+    if query.lower() in ("all", "все"):
+        await run_write(unsubscribe, message.from_user.id)
+        await message.answer("Все подписки отменены.")
+        return
+    websites = await run_read(find_sites, message.from_user.id, query)
+    await run_write(unsubscribe, message.from_user.id, [website['id'] for website in websites])
+    await message.answer("Подписки отменены." if websites else "Сайты не найдены.")
+
+
+@router.message(Command("subscriptions"))
+async def command_subscriptions_handler(message: Message) -> None:
+    """Handles the /subscriptions command: lists the sites the user is subscribed to."""
+    websites = await run_read(get_subscriptions, message.from_user.id)
+    if not websites:
+        await message.answer("У вас нет подписок. Подписаться: /subscribe <название сайта>")
+        return
+    await message.answer("Ваши подписки:\n" + format_sites(websites), parse_mode="HTML")
@@ -0,0 +1,203 @@
+import asyncio
+import csv
+import html
+import io
+import logging
+import time
+from urllib.parse import urlsplit
+
+from parser.profiles import PROFILES
+
+REQUIRED_COLUMNS = ('title', 'url', 'xpath')
+OPTIONAL_COLUMNS = ('profile',)  # Browser load profile of the site: 'full' or 'lean'
+EXCEL_EXTENSIONS = ('.xls', '.xlsx')
+CSV_EXTENSIONS = ('.csv',)
+CHUNK_SIZE = 1000  # Rows validated and saved at a time
+PREVIEW_ROWS = 10  # Rows shown back to the user
+MAX_ERRORS_REPORTED = 5  # Invalid rows described to the user
+ERROR_VALUE_LIMIT = 100  # Characters of a cell quoted in an error description
+
+
+class IngestError(Exception):
+    """An uploaded file cannot be ingested. The message is shown to the user."""
+
+
+def is_supported(file_name):
+    return file_name.lower().endswith(EXCEL_EXTENSIONS + CSV_EXTENSIONS)
+
+
+def _iter_xlsx(buffer):
+    from openpyxl import load_workbook  # Imported on first use, openpyxl is slow to import
+
+    workbook = load_workbook(buffer, read_only=True, data_only=True)  # Streams rows instead of loading the sheet
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _iter_xls(buffer):
+    import pandas as pd  # Legacy .xls has no streaming reader, fall back to pandas
+
+    df = pd.read_excel(buffer, header=None, dtype=object)
+    for row in df.itertuples(index=False, name=None):
+        yield tuple(None if pd.isna(value) else value for value in row)
+
+
+def _iter_csv(buffer):
+    text = io.TextIOWrapper(buffer, encoding="utf-8-sig", errors="replace", newline="")
+    sample = text.read(64 * 1024)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    yield from csv.reader(text, dialect)
+
+
+def iter_raw_rows(buffer, file_name):
+    """Yields every row of an uploaded sheet as a tuple of cell values, header first."""
+    name = file_name.lower()
+    if name.endswith(CSV_EXTENSIONS):
+        return _iter_csv(buffer)
+    if name.endswith('.xls'):
+        return _iter_xls(buffer)
+    return _iter_xlsx(buffer)
+
+
+def _clean(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # Excel stores numeric titles as floats
+    return str(value).strip()
+
+
+def _quote(value, limit=ERROR_VALUE_LIMIT):
+    """Quotes a cell value for an error description, which is sent as HTML."""
+    if len(value) > limit:
+        value = value[:limit - 1] + "…"
+    return f"«{html.escape(value)}»"
+
+
+def normalize_row(values, columns):
+    """
+    Validates and normalizes one data row.
+
+    Args:
+        values (tuple): The row's cell values.
+        columns (dict): Column name -> index in the row.
+
+    Returns:
+        tuple: (website dict or None, error message or None). Both are None for blank rows.
+            Cell values quoted in the error message are HTML-escaped.
+    """
+    row = {name: _clean(values[index]) if index < len(values) else "" for name, index in columns.items()}
+    if not any(row.values()):
+        return None, None  # Blank rows are skipped silently
+
+    url = row['url']
+    if url and "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname or any(c.isspace() for c in url):
+        return None, f"некорректный URL {_quote(row['url'])}"
+    if not row['xpath']:
+        return None, "пустой XPath"
+    profile = row.pop('profile', "").lower()
+    if profile:
+        if profile not in PROFILES:
+            return None, f"неизвестный профиль {_quote(profile)} (допустимы: {', '.join(PROFILES)})"
+        row['profile'] = profile
+
+    row['url'] = url
+    row['title'] = row['title'] or parts.hostname
+    return row, None
+
+
+class SheetIngestion:
+    """
+    Reads an uploaded sheet in chunks of validated rows.
+
+    Only the current chunk, a bounded preview and a few error descriptions are
+    kept, so memory does not grow with the size of the sheet.
+    """
+
+    def __init__(self, buffer, file_name, chunk_size=CHUNK_SIZE):
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        self._rows = iter_raw_rows(buffer, file_name)
+        self.columns = {}
+        self.line = 1  # Line of the file last read, the header is line 1
+        self.total_rows = 0  # Non-blank data rows
+        self.valid_rows = 0
+        self.errors = []  # Descriptions of the first invalid rows
+        self.preview = []  # The first valid rows
+        self.elapsed = 0.0  # Seconds spent reading and validating
+
+    def read_header(self):
+        """
+        Reads the header row and maps the known columns; other columns are ignored.
+
+        Raises:
+            IngestError: If the file has no header or lacks required columns.
+        """
+        start = time.perf_counter()
+        header = next(self._rows, None)
+        self.elapsed += time.perf_counter() - start
+        if header is None:
+            raise IngestError("Файл пуст. Данные не загружены.")
+        names = [_clean(name).lower() for name in header]
+        missing = [column for column in REQUIRED_COLUMNS if column not in names]
+        if missing:
+            raise IngestError(f"Ошибка: В файле отсутствуют колонки: {', '.join(missing)}.")
+        self.columns = {name: index for index, name in enumerate(names) if name in REQUIRED_COLUMNS + OPTIONAL_COLUMNS}
+        return list(self.columns)
+
+    def next_chunk(self):
+        """Returns the next list of up to `chunk_size` valid websites, or None at the end of the file."""
+        start = time.perf_counter()
+        try:
+            return self._read_chunk()
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def _read_chunk(self):
+        chunk = []
+        for values in self._rows:
+            self.line += 1
+            website, error = normalize_row(values, self.columns)
+            if website is None and error is None:
+                continue
+            self.total_rows += 1
+            if error is not None:
+                if len(self.errors) < MAX_ERRORS_REPORTED:
+                    self.errors.append(f"строка {self.line}: {error}")
+                continue
+            self.valid_rows += 1
+            if len(self.preview) < PREVIEW_ROWS:
+                self.preview.append(website)
+            chunk.append(website)
+            if len(chunk) >= self.chunk_size:
+                return chunk
+        if chunk:
+            return chunk
+        logging.info(f"Ingested {self.file_name}: {self.valid_rows} of {self.total_rows} rows valid")
+        return None
+
+    async def chunks(self):
+        """Async iterator over `next_chunk`; parsing of the file runs in a worker thread."""
+        while True:
+            chunk = await asyncio.to_thread(self.next_chunk)
+            if chunk is None:
+                return
+            yield chunk
+
+
+async def read_upload(bot, file_id):
+    """Downloads a Telegram file into an in-memory buffer (no shared temp file on disk)."""
+    file = await bot.get_file(file_id)
+    buffer = io.BytesIO()
+    await bot.download_file(file.file_path, buffer)
+    buffer.seek(0)
+    return buffer
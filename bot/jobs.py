@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import os
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # Parse jobs (uploaded files) processed at the same time
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "100"))  # Jobs allowed to wait in the queue
+
+
+class JobQueue:
+    """
+    Background queue of parse jobs.
+
+    Handlers submit a job (a coroutine function) and return right away; a fixed
+    number of worker tasks run the jobs. Jobs are expected to push any blocking
+    work (Selenium, pandas) to an executor so the event loop stays free.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, limit=JOB_QUEUE_LIMIT):
+        self.workers = workers
+        self._queue = asyncio.Queue(maxsize=limit)
+        self._tasks = []
+        self.running = 0  # Jobs currently being processed
+
+    @property
+    def depth(self):
+        """Number of jobs waiting for a worker."""
+        return self._queue.qsize()
+
+    async def start(self):
+        """Starts the worker tasks. Registered as a dispatcher startup handler."""
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i), name=f"job-worker-{i}") for i in range(self.workers)]
+        logging.info(f"Started {self.workers} job workers")
+
+    async def stop(self):
+        """Cancels the worker tasks. Registered as a dispatcher shutdown handler."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, job, *args, **kwargs):
+        """
+        Enqueues `job(*args, **kwargs)` without waiting for it to run.
+
+        Returns:
+            int: The number of jobs ahead of this one.
+
+        Raises:
+            asyncio.QueueFull: If the queue already holds `limit` jobs.
+        """
+        ahead = self.depth + self.running
+        self._queue.put_nowait((job, args, kwargs))
+        return ahead
+
+    async def _worker(self, number):
+        while True:
+            job, args, kwargs = await self._queue.get()
+            self.running += 1
+            try:
+                await job(*args, **kwargs)
+            except Exception as e:
+                logging.exception(f"Job {getattr(job, '__name__', job)} failed in worker {number}: {e}")
+            finally:
+                self.running -= 1
+                self._queue.task_done()
@@ -0,0 +1,48 @@
+import collections
+import logging
+import time
+
+from aiogram import BaseMiddleware
+
+from metrics import STAGE_UPDATE, metrics
+
+SLOW_UPDATE_THRESHOLD = 1.0  # Seconds; updates handled slower than this are logged as warnings
+
+
+class UpdateLatencyMiddleware(BaseMiddleware):
+    """
+    Outer update middleware that measures how long each update takes to handle.
+
+    Keeps a window of recent samples so the bot's responsiveness while parse
+    jobs are running can be checked (see `snapshot`).
+    """
+
+    def __init__(self, window=1000):
+        self.samples = collections.deque(maxlen=window)
+        self.handled = 0
+
+    async def __call__(self, handler, event, data):
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.samples.append(elapsed)
+            metrics.observe(STAGE_UPDATE, elapsed)
+            self.handled += 1
+            if self.handled % 100 == 0:
+                logging.info(f"Update handling latency: {self.snapshot()}")
+            if elapsed > SLOW_UPDATE_THRESHOLD:
+                logging.warning(f"Update {getattr(event, 'update_id', '?')} took {elapsed:.2f}s to handle")
+
+    def snapshot(self):
+        """Returns the update count and the p50/p95/max handling latency (seconds) of the recent window."""
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {'handled': self.handled, 'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+        return {
+            'handled': self.handled,
+            'p50': ordered[len(ordered) // 2],
+            'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            'max': ordered[-1],
+        }
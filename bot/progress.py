@@ -0,0 +1,122 @@
+import asyncio
+import html
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+from metrics import STAGE_REPLY, metrics
+
+EDIT_INTERVAL = 3.0  # Minimum seconds between edits of one progress message
+MESSAGE_LIMIT = 4096  # Telegram's maximum message length
+
+
+def format_price_line(title, average_price):
+    """Formats one site's result as an HTML line."""
+    if average_price is not None:
+        return f"<b>{html.escape(str(title))}</b>: {average_price:.2f}"  # Format price to 2 decimal places
+    return f"<b>{html.escape(str(title))}</b>: Цена не найдена"  # Indicate if price was not found
+
+
+def split_message(lines, limit=MESSAGE_LIMIT):
+    """Joins lines into as few messages as possible, each within Telegram's length limit."""
+    chunks, current = [], ""
+    for line in lines:
+        if current and len(current) + len(line) + 1 > limit:
+            chunks.append(current)
+            current = ""
+        current += line + "\n"
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class ProgressMessage:
+    """
+    A single chat message that is edited in place as parse results arrive.
+
+    Edits are throttled to one per `interval` seconds (Telegram rate-limits
+    message edits); results arriving in between are folded into the next edit.
+    Edits never overlap, and the final result is sent only after any pending
+    progress edit is cancelled, so a late progress edit cannot overwrite it.
+    """
+
+    def __init__(self, message: Message, total: int, interval: float = EDIT_INTERVAL):
+        self.message = message
+        self.total = total
+        self.interval = interval
+        self.lines = []
+        self._last_edit = 0.0
+        self._flush_task = None  # Scheduled progress edit, kept until it has completed
+        self._edit_lock = asyncio.Lock()
+
+    def _render(self, header):
+        text = header + "\n\n"
+        for shown, line in enumerate(self.lines):
+            if len(text) + len(line) + 50 > MESSAGE_LIMIT:
+                return text + f"... и еще {len(self.lines) - shown}\n"
+            text += line + "\n"
+        return text
+
+    def _progress_text(self):
+        return self._render(f"Парсинг сайтов: {len(self.lines)}/{self.total}")
+
+    async def _edit(self, text):
+        async with self._edit_lock:
+            await self._send_edit(text)
+
+    @staticmethod
+    async def _send(send, text):
+        """Calls `send` (edit_text or answer) with an HTML text, waiting out Telegram's rate limits."""
+        while True:
+            try:
+                return await send(text, parse_mode="HTML")
+            except TelegramRetryAfter as e:
+                logging.warning(f"Reply rate-limited, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+
+    async def _send_edit(self, text):
+        with metrics.timer(STAGE_REPLY):  # Rate-limit waits included
+            try:
+                await self._send(self.message.edit_text, text)
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e):
+                    raise
+        self._last_edit = time.monotonic()
+
+    async def _flush_later(self, delay):
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                shown = len(self.lines)
+                await self._edit(self._progress_text())
+                if len(self.lines) == shown:
+                    break
+                delay = self.interval  # Results arrived during the edit, show them with the next one
+        finally:
+            if self._flush_task is asyncio.current_task():
+                self._flush_task = None
+
+    async def add(self, title, average_price):
+        """Records one site's result and edits the message if the throttle allows it."""
+        self.lines.append(format_price_line(title, average_price))
+        if self._flush_task is not None:
+            return  # An edit is already scheduled and will include this line
+        wait = self.interval - (time.monotonic() - self._last_edit)
+        if wait <= 0:
+            await self._edit(self._progress_text())
+        else:
+            self._flush_task = asyncio.create_task(self._flush_later(wait))
+
+    async def finish(self):
+        """Replaces the progress with the final result; overflow goes to follow-up messages."""
+        task, self._flush_task = self._flush_task, None
+        if task is not None:
+            task.cancel()  # Also stops an edit in flight or waiting out a rate limit
+            await asyncio.gather(task, return_exceptions=True)
+        chunks = split_message(["Средние цены по сайтам:\n"] + self.lines)
+        await self._edit(chunks[0])
+        for chunk in chunks[1:]:
+            with metrics.timer(STAGE_REPLY):
+                await self._send(self.message.answer, chunk)
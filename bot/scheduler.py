@@ -0,0 +1,176 @@
+import asyncio
+import functools
+import html
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from db.database import arecord_prices, count_websites, get_latest_prices, get_subscribers, get_websites, run_read
+from parser.cache import get_cache
+from parser.engine import domain_of
+from parser.parser import parse_price
+
+SCHEDULER_INTERVAL = float(os.getenv("SCHEDULER_INTERVAL", "21600"))  # Seconds between catalog re-parses; 0 disables
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", "600"))  # Seconds each cycle's sites are spread over (and max delay before a cycle)
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "1"))  # Sites re-parsed at once, kept below the user-facing engine
+SCHEDULER_DOMAIN_GAP = float(os.getenv("SCHEDULER_DOMAIN_GAP", "10"))  # Min seconds between two requests to one domain
+SCHEDULER_PAGE_SIZE = 100  # Catalog rows loaded per query
+PRICE_EPSILON = 0.005  # Prices closer than this are considered unchanged
+
+
+class CatalogScheduler:
+    """
+    Periodically re-parses the stored website catalog in the background.
+
+    The sites of a cycle are spread evenly, with random jitter, over `jitter`
+    seconds from the start of the cycle (at most the interval), so the delay
+    does not add up page after page. Requests to one domain are spaced
+    at least `domain_gap` seconds apart, and at most `concurrency` sites are
+    parsed at once on the scheduler's own threads, so interactive jobs always
+    keep most of the parsing capacity. Given an `engine`, every scheduled parse
+    also holds one of the engine's per-domain slots, so a shop is never parsed
+    more often than the engine's per-domain limit allows. Only changed prices (or the first price
+    of a day) are written to the history, and subscribers are notified about changes.
+    """
+
+    def __init__(self, bot: Bot, interval=SCHEDULER_INTERVAL, jitter=SCHEDULER_JITTER,
+                 concurrency=SCHEDULER_CONCURRENCY, domain_gap=SCHEDULER_DOMAIN_GAP, parse_func=parse_price, engine=None):
+        self.bot = bot
+        self.interval = interval
+        self.jitter = jitter
+        self.domain_gap = domain_gap
+        self.parse_func = parse_func  # Called as parse_func(url, xpath[, profile=...]) -> price or None
+        self.engine = engine  # ParseEngine whose per-domain limit scheduled parses share, if any
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="scheduler")
+        self._budget = asyncio.Semaphore(concurrency)
+        self._domain_next_start = {}  # domain -> monotonic time the next request may start
+        self._task = None
+
+    async def start(self):
+        """Starts the scheduling loop. Registered as a dispatcher startup handler."""
+        if self.interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(), name="catalog-scheduler")
+        logging.info(f"Catalog scheduler started, interval {self.interval}s")
+
+    async def stop(self):
+        """Stops the scheduling loop. Registered as a dispatcher shutdown handler."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self):
+        await asyncio.sleep(random.uniform(0, self.jitter))  # Do not start right on boot
+        while True:
+            started = time.monotonic()
+            try:
+                await self.run_cycle()
+            except Exception as e:
+                logging.exception(f"Catalog re-parse failed: {e}")
+            elapsed = time.monotonic() - started
+            await asyncio.sleep(max(0.0, self.interval - elapsed) + random.uniform(0, self.jitter))
+
+    async def _wait_for_domain(self, domain):
+        # Reserving the start time before sleeping needs no lock: nothing else runs until the await
+        now = time.monotonic()
+        start = max(now, self._domain_next_start.get(domain, now))
+        self._domain_next_start[domain] = start + self.domain_gap
+        await asyncio.sleep(start - now)
+
+    def _forget_idle_domains(self):
+        """Drops the domains whose gap has passed, so the table only holds recently parsed domains."""
+        now = time.monotonic()
+        self._domain_next_start = {domain: start for domain, start in self._domain_next_start.items() if start > now}
+
+    def _parse_in_slot(self, parse, domain):
+        with self.engine.domain_slot(domain):
+            return parse()
+
+    async def _parse_site(self, website, start_at):
+        await asyncio.sleep(max(0.0, start_at - time.monotonic()))
+        domain = domain_of(website['url'])
+        await self._wait_for_domain(domain)
+        async with self._budget:
+            loop = asyncio.get_running_loop()
+            try:
+                parse = functools.partial(self.parse_func, website['url'], website['xpath'])
+                if website.get('profile'):
+                    parse = functools.partial(parse, profile=website['profile'])
+                if self.engine is not None:
+                    parse = functools.partial(self._parse_in_slot, parse, domain)
+                return await loop.run_in_executor(self._executor, parse)
+            except Exception as e:
+                logging.error(f"Scheduled parse of {website['url']} failed: {e}")
+                return None
+
+    async def run_cycle(self):
+        """
+        Re-parses the whole catalog once.
+
+        Returns:
+            list: (website, old price, new price) for every site whose price changed.
+        """
+        changes = []
+        after_id = 0
+        today = int(time.time()) // 86400
+        cache = get_cache()
+        # Every site gets its own start offset within the cycle: site i of n starts in slot i of `spread / n` seconds
+        spread = min(self.jitter, self.interval) if self.interval > 0 else self.jitter
+        slot = spread / max(1, await run_read(count_websites))
+        cycle_start = time.monotonic()
+        position = 0
+        while True:
+            page = await run_read(get_websites, after_id=after_id, limit=SCHEDULER_PAGE_SIZE)
+            if not page:
+                break
+            after_id = page[-1]['id']
+
+            latest = await run_read(get_latest_prices, [website['id'] for website in page])
+            prices = await asyncio.gather(*(
+                self._parse_site(website, cycle_start + (position + i + random.random()) * slot)
+                for i, website in enumerate(page)))
+            position += len(page)
+
+            observations = []
+            for website, price in zip(page, prices):
+                if price is None:
+                    continue
+                cache.put(website['url'], website['xpath'], price)
+                observed_at, old_price = latest.get(website['id'], (None, None))
+                if old_price is not None and abs(price - old_price) < PRICE_EPSILON:
+                    if observed_at // 86400 < today:
+                        observations.append((website['id'], price))  # Keep one point per day for the rollups
+                    continue
+                observations.append((website['id'], price))
+                if old_price is not None:
+                    changes.append((website, old_price, price))
+            await arecord_prices(observations)
+            self._forget_idle_domains()
+
+        logging.info(f"Catalog re-parse finished, {len(changes)} prices changed")
+        await self.notify(changes)
+        return changes
+
+    async def notify(self, changes):
+        """Sends each subscriber one message listing the changed prices of their sites."""
+        if not changes:
+            return
+        subscribers = await run_read(get_subscribers, [website['id'] for website, _, _ in changes])
+        messages = {}
+        for website, old_price, new_price in changes:
+            line = f"<b>{html.escape(str(website['title']))}</b>: {old_price:.2f} → {new_price:.2f}"
+            for user_id in subscribers.get(website['id'], []):
+                messages.setdefault(user_id, []).append(line)
+
+        for user_id, lines in messages.items():
+            try:
+                await self.bot.send_message(user_id, "Изменились цены:\n\n" + "\n".join(lines), parse_mode="HTML")
+            except TelegramAPIError as e:
+                logging.warning(f"Could not notify user {user_id}: {e}")
@@ -1,14 +1,130 @@
+import asyncio
+import datetime
+import functools
+import os
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
-DATABASE_NAME = "data/zuzu_bot.db"  # Path to the database file
+DATABASE_NAME = os.getenv("DATABASE_PATH", "data/zuzu_bot.db")  # Path to the database file (shared by the bot and parse workers)
 
+# Applied to every connection the storage layer opens.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",  # Readers no longer wait for the writer (and vice versa)
+    "PRAGMA synchronous=NORMAL",  # Safe with WAL, avoids an fsync per commit
+    "PRAGMA busy_timeout=5000",  # Wait for a lock instead of failing with 'database is locked'
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",  # 16 MB page cache per connection
+)
 
-def init_db(conn=None):
-    """Creates the database and table if they don't exist."""
-    if conn is None:
-        conn = sqlite3.connect(DATABASE_NAME)  # Connect if no connection provided
-    cursor = conn.cursor()
-    cursor.execute("""
+EPOCH = datetime.date(1970, 1, 1)  # Day 0 of price_daily.day
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+_TRACKING_PARAMS = ('utm_', 'yclid', 'gclid', 'fbclid', '_openstat')
+_ROUTE_FRAGMENTS = ('/', '!')  # Fragments of hash-routed single-page apps (#/item/1, #!/item/1) select the page
+
+_local = threading.local()  # One connection per thread, reused across calls
+_connections = []  # Every connection opened by get_connection, so they can be closed on shutdown
+_connections_lock = threading.Lock()
+_generation = 0  # Bumped by close_connections, so threads drop their cached (closed) connection
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")  # All async writes go through one thread
+
+
+def normalize_url(url):
+    """
+    Normalizes a URL so that the same page always gets the same key.
+
+    Lower-cases the scheme and host, drops default ports, tracking parameters
+    and fragments (except hash routes such as #/item/1 or #!/item/1), and sorts
+    the remaining query parameters.
+    """
+    parts = urlsplit(str(url).strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not key.lower().startswith(_TRACKING_PARAMS))
+    fragment = parts.fragment if parts.fragment.startswith(_ROUTE_FRAGMENTS) else ""
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), fragment))
+
+
+def normalize_xpath(xpath):
+    """Normalizes an XPath expression for deduplication."""
+    return str(xpath).strip()
+
+
+def connect(path=None):
+    """Opens a connection with the storage layer's pragmas applied."""
+    path = path or DATABASE_NAME
+    directory = os.path.dirname(str(path))
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection():
+    """Returns this thread's connection to DATABASE_NAME, opening it on first use."""
+    cached = getattr(_local, "conn", None)
+    if cached is not None and cached[0] == DATABASE_NAME and cached[1] == _generation:
+        return cached[2]
+    conn = connect(DATABASE_NAME)
+    with _connections_lock:
+        _connections.append(conn)
+        _local.conn = (DATABASE_NAME, _generation, conn)
+    return conn
+
+
+def close_connections():
+    """Closes every connection opened by get_connection. Registered as a dispatcher shutdown handler."""
+    global _generation
+    with _connections_lock:
+        connections = list(_connections)
+        _connections.clear()
+        _generation += 1
+    for conn in connections:
+        conn.close()
+
+
+@contextmanager
+def transaction(conn=None):
+    """
+    Context manager for a transaction: commits on success, rolls back on error.
+
+    Args:
+        conn: The connection to use. If None, this thread's shared connection is used.
+    """
+    conn = conn or get_connection()
+    if not conn.in_transaction:
+        conn.execute("BEGIN")  # Explicit, so schema changes are part of the transaction too
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+async def run_write(func, *args, **kwargs):
+    """Runs a blocking database write on the single writer thread without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_writer, functools.partial(func, *args, **kwargs))
+
+
+async def run_read(func, *args, **kwargs):
+    """Runs a blocking database read in a worker thread (each with its own connection)."""
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+
+def _create_websites(conn):
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS websites (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT,
@@ -16,29 +132,545 @@ def init_db(conn=None):
             xpath TEXT
         )
     """)
-    conn.commit()
-    if conn is None: #close if we just opened
-       conn.close()
 
 
+def _deduplicate_websites(conn):
+    """Adds normalized keys, owner and timestamps to websites and collapses duplicate rows."""
+    for column in ("url_norm TEXT", "xpath_norm TEXT", "user_id INTEGER", "created_at INTEGER", "updated_at INTEGER"):
+        conn.execute(f"ALTER TABLE websites ADD COLUMN {column}")
 
-def save_website_data(websites_data, conn=None):
-    """Saves website data to the database."""
-    if conn is None:
-        conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
+    now = int(time.time())
+    rows = conn.execute("SELECT id, url, xpath FROM websites").fetchall()
+    conn.executemany("UPDATE websites SET url_norm = ?, xpath_norm = ?, created_at = ?, updated_at = ? WHERE id = ?",
+                     [(normalize_url(url), normalize_xpath(xpath), now, now, row_id) for row_id, url, xpath in rows])
+
+    # Keep the oldest row of every duplicate group, with the title of the most recent upload.
+    conn.execute("""
+        UPDATE websites SET title = (
+            SELECT latest.title FROM websites AS latest
+            WHERE latest.url_norm = websites.url_norm AND latest.xpath_norm = websites.xpath_norm
+            ORDER BY latest.id DESC LIMIT 1
+        )
+    """)
+    conn.execute("DELETE FROM websites WHERE id NOT IN (SELECT MIN(id) FROM websites GROUP BY url_norm, xpath_norm)")
+
+    conn.execute("CREATE UNIQUE INDEX idx_websites_norm ON websites (url_norm, xpath_norm)")
+    conn.execute("CREATE INDEX idx_websites_user ON websites (user_id, id)")
+    conn.execute("CREATE INDEX idx_websites_updated ON websites (updated_at)")
+
+
+def _create_price_history(conn):
+    """Adds the price time series and its per-day rollups, kept in sync by a trigger."""
+    conn.execute("""
+        CREATE TABLE price_history (
+            website_id INTEGER NOT NULL REFERENCES websites (id) ON DELETE CASCADE,
+            observed_at INTEGER NOT NULL,  -- Unix time
+            price REAL NOT NULL,
+            PRIMARY KEY (website_id, observed_at)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE price_daily (
+            website_id INTEGER NOT NULL REFERENCES websites (id) ON DELETE CASCADE,
+            day INTEGER NOT NULL,  -- Days since the Unix epoch (UTC)
+            min_price REAL NOT NULL,
+            max_price REAL NOT NULL,
+            sum_price REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (website_id, day)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TRIGGER price_history_rollup AFTER INSERT ON price_history
+        BEGIN
+            INSERT INTO price_daily (website_id, day, min_price, max_price, sum_price, count)
+            VALUES (NEW.website_id, NEW.observed_at / 86400, NEW.price, NEW.price, NEW.price, 1)
+            ON CONFLICT (website_id, day) DO UPDATE SET
+                min_price = MIN(min_price, excluded.min_price),
+                max_price = MAX(max_price, excluded.max_price),
+                sum_price = sum_price + excluded.sum_price,
+                count = count + 1;
+        END
+    """)
+
+
+def _create_subscriptions(conn):
+    """Adds the users subscribed to price-change notifications of a site."""
+    conn.execute("""
+        CREATE TABLE subscriptions (
+            user_id INTEGER NOT NULL,
+            website_id INTEGER NOT NULL REFERENCES websites (id) ON DELETE CASCADE,
+            created_at INTEGER NOT NULL,
+            PRIMARY KEY (user_id, website_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX idx_subscriptions_website ON subscriptions (website_id)")
+
+
+def _add_load_profile(conn):
+    """Adds the optional browser load profile of a site (NULL means the default profile)."""
+    conn.execute("ALTER TABLE websites ADD COLUMN profile TEXT")
+
+
+def _create_domain_health(conn):
+    """Adds the per-domain circuit breaker state and learned load latency."""
+    conn.execute("""
+        CREATE TABLE domain_health (
+            domain TEXT PRIMARY KEY,
+            state TEXT NOT NULL,  -- 'closed', 'open' or 'half_open'
+            failures INTEGER NOT NULL,  -- Consecutive failures
+            opened_until INTEGER NOT NULL,  -- Unix time the breaker stays open until
+            latency_p95 REAL,  -- Seconds until the price XPath appeared (95th percentile)
+            updated_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+
+def _create_parse_tasks(conn):
+    """Adds the queue the bot publishes parse tasks to in distributed mode (see worker/worker.py)."""
+    conn.execute("""
+        CREATE TABLE parse_jobs (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,  -- Telegram user the results go to (NULL for scheduled re-parses)
+            created_at INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE parse_tasks (
+            id INTEGER PRIMARY KEY,
+            job_id INTEGER NOT NULL REFERENCES parse_jobs (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,  -- Row of the site within its job
+            domain TEXT NOT NULL,
+            url TEXT NOT NULL,
+            xpath TEXT NOT NULL,
+            profile TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',  -- 'pending', 'leased', 'done' or 'failed'
+            attempts INTEGER NOT NULL DEFAULT 0,  -- Times the task was leased
+            leased_by TEXT,  -- Worker id holding the lease
+            lease_until REAL,  -- Unix time the lease expires; an expired lease means the worker died
+            price REAL,
+            error TEXT,
+            finished_at REAL
+        )
+    """)
+    conn.execute("CREATE INDEX idx_parse_tasks_status ON parse_tasks (status, domain)")
+    conn.execute("CREATE INDEX idx_parse_tasks_job ON parse_tasks (job_id, status)")
+
+
+def _index_task_order(conn):
+    """Lets the lease query walk pending tasks oldest first without sorting the whole queue."""
+    conn.execute("CREATE INDEX idx_parse_tasks_order ON parse_tasks (status, id)")
+
+
+def _create_user_websites(conn):
+    """Links every user to each site they uploaded; websites.user_id only holds the last uploader."""
+    conn.execute("""
+        CREATE TABLE user_websites (
+            user_id INTEGER NOT NULL,
+            website_id INTEGER NOT NULL REFERENCES websites (id) ON DELETE CASCADE,
+            created_at INTEGER NOT NULL,
+            PRIMARY KEY (user_id, website_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT INTO user_websites (user_id, website_id, created_at)
+        SELECT user_id, id, COALESCE(updated_at, 0) FROM websites WHERE user_id IS NOT NULL
+    """)
+
+
+def _keep_route_fragments(conn):
+    """Re-keys sites stored before hash routes were kept in the normalized URL."""
+    rows = conn.execute("SELECT id, url FROM websites WHERE url LIKE '%#/%' OR url LIKE '%#!%'").fetchall()
+    conn.executemany("UPDATE websites SET url_norm = ? WHERE id = ?", [(normalize_url(url), row_id) for row_id, url in rows])
+
+
+# Schema migrations, applied in order. PRAGMA user_version holds the number already applied.
+MIGRATIONS = (
+    _create_websites,
+    _deduplicate_websites,
+    _create_price_history,
+    _create_subscriptions,
+    _add_load_profile,
+    _create_domain_health,
+    _create_parse_tasks,
+    _index_task_order,
+    _create_user_websites,
+    _keep_route_fragments,
+)
+
+
+def init_db(conn=None):
+    """Creates the database and brings its schema up to date."""
+    with transaction(conn) as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+
+
+_UPSERT_WEBSITE = """
+    INSERT INTO websites (title, url, xpath, url_norm, xpath_norm, user_id, created_at, updated_at, profile)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (url_norm, xpath_norm) DO UPDATE SET
+        title = excluded.title,
+        url = excluded.url,
+        xpath = excluded.xpath,
+        user_id = COALESCE(excluded.user_id, websites.user_id),
+        profile = COALESCE(excluded.profile, websites.profile),
+        updated_at = excluded.updated_at
+    RETURNING id
+"""
+
+
+def save_website_data(websites_data, conn=None, user_id=None):
+    """
+    Saves website data to the database.
+
+    Rows are upserted on the normalized (url, xpath): a site that is already in
+    the catalog gets its title, last uploader and updated_at refreshed instead of
+    a duplicate row. The site is also linked to `user_id`, so every user who ever
+    uploaded it keeps finding it (see get_websites).
+
+    Args:
+        websites_data (list): Dictionaries with 'title', 'url' and 'xpath' keys, and an
+            optional 'profile' (browser load profile; a row without one keeps the stored profile).
+        conn: An optional SQLite connection (this thread's shared connection by default).
+        user_id (int): The Telegram user who uploaded the rows.
+
+    Returns:
+        list: The catalog id of every row, in the order of `websites_data`.
+    """
+    now = int(time.time())
+    with transaction(conn) as conn:
+        website_ids = [
+            conn.execute(_UPSERT_WEBSITE, (data['title'], data['url'], data['xpath'], normalize_url(data['url']),
+                                           normalize_xpath(data['xpath']), user_id, now, now,
+                                           data.get('profile') or None)).fetchone()[0]
+            for data in websites_data
+        ]
+        if user_id is not None:
+            conn.executemany("INSERT OR IGNORE INTO user_websites (user_id, website_id, created_at) VALUES (?, ?, ?)",
+                             [(user_id, website_id, now) for website_id in website_ids])
+        return website_ids
+
+
+async def asave_website_data(websites_data, conn=None, user_id=None):
+    """
+    Async version of save_website_data.
+
+    Without `conn` the write runs on the writer thread. An explicit connection
+    belongs to the caller, so it is used in place.
+    """
+    if conn is not None:
+        return save_website_data(websites_data, conn, user_id)
+    return await run_write(save_website_data, websites_data, user_id=user_id)
+
+
+def _rows_to_dicts(cursor):
+    columns = [col[0] for col in cursor.description]  # Get column names
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]  # Return list of dicts
 
-    cursor.executemany("INSERT INTO websites (title, url, xpath) VALUES (?, ?, ?)",
-                       [(data['title'], data['url'], data['xpath']) for data in websites_data])
-    conn.commit()
-    if conn is None:
-        conn.close()
 
 def get_all_websites(conn=None):
     """Retrieves all websites from the database."""
-    if conn is None:
-        conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, title, url, xpath FROM websites")
-    columns = [col[0] for col in cursor.description]  # Get column names
-    return [dict(zip(columns, row)) for row in cursor.fetchall()] # Return list of dicts
\ No newline at end of file
+    conn = conn or get_connection()
+    return _rows_to_dicts(conn.execute("SELECT id, title, url, xpath, profile FROM websites ORDER BY id"))
+
+
+def get_websites(conn=None, user_id=None, search=None, updated_since=None, after_id=0, limit=100):
+    """
+    Retrieves one page of the website catalog.
+
+    Uses keyset pagination: pass the last id of the previous page as `after_id`.
+
+    Args:
+        conn: An optional SQLite connection.
+        user_id (int): Only sites this user has uploaded (at any time, not just last).
+        search (str): Only sites whose title or URL contains this text.
+        updated_since (int): Only sites uploaded at or after this Unix time.
+        after_id (int): Only sites with a larger id.
+        limit (int): Maximum number of sites to return.
+
+    Returns:
+        list: Dictionaries with 'id', 'title', 'url', 'xpath', 'profile', 'user_id', 'created_at' and 'updated_at'.
+    """
+    conn = conn or get_connection()
+    where, params = ["id > ?"], [after_id]
+    if user_id is not None:
+        where.append("id IN (SELECT website_id FROM user_websites WHERE user_id = ?)")
+        params.append(user_id)
+    if search:
+        where.append("(title LIKE ? OR url LIKE ?)")
+        params += [f"%{search}%", f"%{search}%"]
+    if updated_since is not None:
+        where.append("updated_at >= ?")
+        params.append(updated_since)
+    params.append(limit)
+    return _rows_to_dicts(conn.execute(
+        f"SELECT id, title, url, xpath, profile, user_id, created_at, updated_at FROM websites "
+        f"WHERE {' AND '.join(where)} ORDER BY id LIMIT ?", params))
+
+
+def count_websites(conn=None, user_id=None):
+    """Counts the websites in the catalog (optionally only those of one user)."""
+    conn = conn or get_connection()
+    if user_id is None:
+        return conn.execute("SELECT COUNT(*) FROM websites").fetchone()[0]
+    return conn.execute("SELECT COUNT(*) FROM user_websites WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def record_prices(observations, conn=None, observed_at=None):
+    """
+    Appends one run's prices to the price history in a single transaction.
+
+    Args:
+        observations (list): (website_id, price) pairs; pairs with a None price are skipped.
+        conn: An optional SQLite connection.
+        observed_at (int): Unix time of the run (now by default).
+
+    Returns:
+        int: The number of prices stored.
+    """
+    observed_at = int(time.time()) if observed_at is None else int(observed_at)
+    rows = [(website_id, observed_at, price) for website_id, price in observations if price is not None]
+    with transaction(conn) as conn:
+        # A site seen twice within one second keeps its first price; the rollup trigger only fires for new rows.
+        conn.executemany("INSERT OR IGNORE INTO price_history (website_id, observed_at, price) VALUES (?, ?, ?)", rows)
+    return len(rows)
+
+
+async def arecord_prices(observations, conn=None, observed_at=None):
+    """Async version of record_prices (see asave_website_data for how `conn` is used)."""
+    if conn is not None:
+        return record_prices(observations, conn, observed_at)
+    return await run_write(record_prices, observations, observed_at=observed_at)
+
+
+def get_price_history(website_id, since=0, until=None, conn=None):
+    """
+    Retrieves the raw prices of one website within [since, until] (Unix time).
+
+    Returns:
+        list: (observed_at, price) tuples, oldest first.
+    """
+    conn = conn or get_connection()
+    until = int(time.time()) if until is None else until
+    return conn.execute("SELECT observed_at, price FROM price_history "
+                        "WHERE website_id = ? AND observed_at BETWEEN ? AND ? ORDER BY observed_at",
+                        (website_id, since, until)).fetchall()
+
+
+def get_latest_prices(website_ids, conn=None):
+    """
+    Retrieves the most recent recorded price of each website.
+
+    Returns:
+        dict: website_id -> (observed_at, price) for the websites that have any history.
+    """
+    conn = conn or get_connection()
+    latest = {}
+    for website_id in website_ids:  # One primary-key lookup per site
+        row = conn.execute("SELECT observed_at, price FROM price_history WHERE website_id = ? "
+                           "ORDER BY observed_at DESC LIMIT 1", (website_id,)).fetchone()
+        if row is not None:
+            latest[website_id] = row
+    return latest
+
+
+def get_daily_prices(website_id, days=30, conn=None):
+    """
+    Retrieves the per-day rollups of one website for the last `days` days.
+
+    Returns:
+        list: Dictionaries with 'day' (datetime.date), 'min', 'max', 'avg' and 'count', oldest first.
+    """
+    conn = conn or get_connection()
+    first_day = int(time.time()) // 86400 - days + 1
+    rows = conn.execute("SELECT day, min_price, max_price, sum_price / count, count FROM price_daily "
+                        "WHERE website_id = ? AND day >= ? ORDER BY day", (website_id, first_day)).fetchall()
+    return [{'day': EPOCH + datetime.timedelta(days=day), 'min': min_price, 'max': max_price, 'avg': avg, 'count': count}
+            for day, min_price, max_price, avg, count in rows]
+
+
+def subscribe(user_id, website_ids, conn=None):
+    """Subscribes a user to price-change notifications of the given websites."""
+    now = int(time.time())
+    with transaction(conn) as conn:
+        conn.executemany("INSERT OR IGNORE INTO subscriptions (user_id, website_id, created_at) VALUES (?, ?, ?)",
+                         [(user_id, website_id, now) for website_id in website_ids])
+
+
+def unsubscribe(user_id, website_ids=None, conn=None):
+    """Removes a user's subscriptions to the given websites (all of them if `website_ids` is None)."""
+    with transaction(conn) as conn:
+        if website_ids is None:
+            conn.execute("DELETE FROM subscriptions WHERE user_id = ?", (user_id,))
+        else:
+            conn.executemany("DELETE FROM subscriptions WHERE user_id = ? AND website_id = ?",
+                             [(user_id, website_id) for website_id in website_ids])
+
+
+def get_subscriptions(user_id, conn=None):
+    """Retrieves the websites a user is subscribed to."""
+    conn = conn or get_connection()
+    return _rows_to_dicts(conn.execute(
+        "SELECT w.id, w.title, w.url FROM subscriptions AS s JOIN websites AS w ON w.id = s.website_id "
+        "WHERE s.user_id = ? ORDER BY w.id", (user_id,)))
+
+
+def get_subscribers(website_ids, conn=None):
+    """
+    Retrieves the subscribers of the given websites.
+
+    Returns:
+        dict: website_id -> list of user ids (websites without subscribers are omitted).
+    """
+    conn = conn or get_connection()
+    subscribers = {}
+    for website_id in website_ids:
+        for (user_id,) in conn.execute("SELECT user_id FROM subscriptions WHERE website_id = ?", (website_id,)):
+            subscribers.setdefault(website_id, []).append(user_id)
+    return subscribers
+
+
+def get_domain_health(conn=None):
+    """
+    Loads the stored reliability state of every domain.
+
+    Returns:
+        dict: domain -> {'state', 'failures', 'opened_until', 'latency_p95'}.
+    """
+    conn = conn or get_connection()
+    return {
+        domain: {'state': state, 'failures': failures, 'opened_until': opened_until, 'latency_p95': latency_p95}
+        for domain, state, failures, opened_until, latency_p95 in conn.execute(
+            "SELECT domain, state, failures, opened_until, latency_p95 FROM domain_health")
+    }
+
+
+def save_domain_health(domain, state, failures, opened_until, latency_p95, conn=None):
+    """Stores the reliability state of one domain."""
+    with transaction(conn) as conn:
+        conn.execute("""
+            INSERT INTO domain_health (domain, state, failures, opened_until, latency_p95, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (domain) DO UPDATE SET
+                state = excluded.state,
+                failures = excluded.failures,
+                opened_until = excluded.opened_until,
+                latency_p95 = COALESCE(excluded.latency_p95, domain_health.latency_p95),
+                updated_at = excluded.updated_at
+        """, (domain, state, failures, int(opened_until), latency_p95, int(time.time())))
+
+
+def create_parse_job(tasks, user_id=None, conn=None):
+    """
+    Publishes one parse job: a row per site for the workers to lease.
+
+    Args:
+        tasks (list): Dictionaries with 'domain', 'url' and 'xpath' keys and an optional 'profile'.
+        user_id (int): The Telegram user who asked for the job.
+
+    Returns:
+        int: The job id.
+    """
+    with transaction(conn) as conn:
+        job_id = conn.execute("INSERT INTO parse_jobs (user_id, created_at) VALUES (?, ?) RETURNING id",
+                              (user_id, int(time.time()))).fetchone()[0]
+        conn.executemany(
+            "INSERT INTO parse_tasks (job_id, position, domain, url, xpath, profile) VALUES (?, ?, ?, ?, ?, ?)",
+            [(job_id, position, task['domain'], task['url'], task['xpath'], task.get('profile') or None)
+             for position, task in enumerate(tasks)])
+        return job_id
+
+
+def lease_parse_tasks(worker_id, limit=1, lease_seconds=300, per_domain_limit=2, max_attempts=3, conn=None):
+    """
+    Leases up to `limit` parse tasks to a worker, oldest first.
+
+    A task is leased for `lease_seconds`; if its worker dies, the lease expires and
+    the task is handed to another worker, at most `max_attempts` times in total,
+    after which it fails. At most `per_domain_limit` tasks of one domain are leased
+    at a time across all workers.
+
+    Only leased tasks are counted per domain, and pending tasks are read in id
+    order until `limit` are picked, so a call costs about as much as the number
+    of tasks in flight plus the tasks it skips, not the length of the queue.
+
+    Returns:
+        list: Dictionaries with 'id', 'url', 'xpath', 'profile' and 'attempts' keys.
+    """
+    now = time.time()
+    with transaction(conn) as conn:
+        conn.execute("""
+            UPDATE parse_tasks SET status = 'failed', error = 'worker lost', finished_at = ?
+            WHERE status = 'leased' AND lease_until < ? AND attempts >= ?
+        """, (now, now, max_attempts))
+        conn.execute("""
+            UPDATE parse_tasks SET status = 'pending', leased_by = NULL, lease_until = NULL
+            WHERE status = 'leased' AND lease_until < ?
+        """, (now,))
+        busy = dict(conn.execute("SELECT domain, COUNT(*) FROM parse_tasks WHERE status = 'leased' GROUP BY domain"))
+        picked = []
+        for task_id, domain in conn.execute("SELECT id, domain FROM parse_tasks WHERE status = 'pending' ORDER BY id"):
+            if busy.get(domain, 0) < per_domain_limit:
+                busy[domain] = busy.get(domain, 0) + 1
+                picked.append(task_id)
+                if len(picked) >= limit:
+                    break
+        if not picked:
+            return []
+        cursor = conn.execute(f"""
+            UPDATE parse_tasks SET status = 'leased', leased_by = ?, lease_until = ?, attempts = attempts + 1
+            WHERE id IN ({', '.join('?' * len(picked))})
+            RETURNING id, url, xpath, profile, attempts
+        """, (worker_id, now + lease_seconds, *picked))
+        return sorted(_rows_to_dicts(cursor), key=lambda task: task['id'])
+
+
+def complete_parse_task(task_id, worker_id, price, error=None, conn=None):
+    """
+    Stores the result of a leased task.
+
+    Returns:
+        bool: False if the lease was lost meanwhile (expired and taken by another
+            worker, or the job was cancelled); the result is then dropped.
+    """
+    with transaction(conn) as conn:
+        cursor = conn.execute("""
+            UPDATE parse_tasks SET status = ?, price = ?, error = ?, finished_at = ?, lease_until = NULL
+            WHERE id = ? AND leased_by = ? AND status = 'leased'
+        """, ('failed' if error else 'done', price, error, time.time(), task_id, worker_id))
+        return cursor.rowcount == 1
+
+
+def take_finished_tasks(job_id, conn=None):
+    """
+    Removes the finished tasks of a job from the queue and returns them.
+
+    Returns:
+        list: Dictionaries with 'position', 'price' and 'error' keys.
+    """
+    with transaction(conn) as conn:
+        return _rows_to_dicts(conn.execute("""
+            DELETE FROM parse_tasks WHERE job_id = ? AND status IN ('done', 'failed')
+            RETURNING position, price, error
+        """, (job_id,)))
+
+
+def delete_parse_job(job_id, conn=None):
+    """Deletes a job together with its unfinished tasks."""
+    with transaction(conn) as conn:
+        conn.execute("DELETE FROM parse_jobs WHERE id = ?", (job_id,))
+
+
+def purge_parse_jobs(before, conn=None):
+    """Deletes jobs created before the Unix time `before` (left behind by a bot that stopped mid-job)."""
+    with transaction(conn) as conn:
+        return conn.execute("DELETE FROM parse_jobs WHERE created_at < ?", (int(before),)).rowcount
+
+
+def count_parse_tasks(conn=None):
+    """Returns the number of queued tasks by status, e.g. {'pending': 10, 'leased': 4}."""
+    conn = conn or get_connection()
+    return dict(conn.execute("SELECT status, COUNT(*) FROM parse_tasks GROUP BY status"))
@@ -0,0 +1,205 @@
+import asyncio
+import collections
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Port of the Prometheus text endpoint; 0 disables it
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_WINDOW = 1000  # Recent samples kept per stage for the quantiles
+MAX_LABEL_VALUES = 500  # Distinct label values per counter; the rest are counted as "other"
+QUANTILES = (0.5, 0.95, 0.99)
+PREFIX = "zuzu_"
+
+# Pipeline stages timed with `metrics.timer`
+STAGE_DOWNLOAD = "download"  # Telegram file download
+STAGE_READ = "read"  # Reading and validating the uploaded sheet
+STAGE_DB_SAVE = "db_save"  # Saving the uploaded rows
+STAGE_BROWSER_ACQUIRE = "browser_acquire"  # Waiting for a pooled browser
+STAGE_PAGE_LOAD = "page_load"  # driver.get
+STAGE_XPATH_WAIT = "xpath_wait"  # Waiting for the price XPath to appear
+STAGE_EXTRACTION = "extraction"  # Collecting the matched texts
+STAGE_STATIC_FETCH = "static_fetch"  # Fetching a page without a browser
+STAGE_SITE = "site"  # One site end to end, as seen by the parse engine
+STAGE_REPLY = "reply"  # Sending or editing a reply message
+STAGE_UPDATE = "update"  # Handling one Telegram update
+
+# Counters, labelled by domain
+COUNTER_SITES = "sites_parsed"  # Sites sent to the parse engine
+COUNTER_CACHE_HITS = "cache_hits"  # Sites answered from the price cache
+COUNTER_FAILURES = "parse_failures"  # Parsed sites that produced no price (timeouts included)
+COUNTER_TIMEOUTS = "parse_timeouts"  # Page waits and batch deadlines that ran out
+COUNTER_RETRIES = "parse_retries"  # Retries after a page failed to load
+COUNTER_CIRCUIT_OPEN = "circuit_open_skips"  # Sites skipped because their domain's circuit breaker was open
+
+_LABEL_ESCAPES = str.maketrans({'\\': r'\\', '"': r'\"', '\n': r'\n'})
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value).translate(_LABEL_ESCAPES)}"' for name, value in labels) + "}"
+
+
+class Metrics:
+    """
+    In-process registry of stage timings, counters and gauges.
+
+    Timings keep a count, a sum and a window of recent samples per stage, so
+    quantiles reflect current behaviour. Counters may carry labels (e.g. the
+    domain); each counter tracks at most `max_label_values` distinct label
+    sets. Gauges are callables read when the metrics are rendered.
+    """
+
+    def __init__(self, window=METRICS_WINDOW, max_label_values=MAX_LABEL_VALUES):
+        self.window = window
+        self.max_label_values = max_label_values
+        self._lock = threading.Lock()
+        self._timings = {}  # stage -> [count, sum, deque of recent samples]
+        self._counters = collections.defaultdict(dict)  # name -> {labels tuple: value}
+        self._gauges = {}  # name -> callable returning a number
+
+    def observe(self, stage, seconds):
+        """Records one timing sample of `stage`."""
+        with self._lock:
+            timing = self._timings.get(stage)
+            if timing is None:
+                timing = self._timings[stage] = [0, 0.0, collections.deque(maxlen=self.window)]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2].append(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        """Times the body of a `with` block as one sample of `stage` (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def inc(self, name, value=1, **labels):
+        """Adds `value` to a counter, e.g. metrics.inc("parse_failures", domain="shop.example")."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters[name]
+            if key not in series and len(series) >= self.max_label_values:
+                key = tuple((label, "other") for label, _ in key)
+            series[key] = series.get(key, 0) + value
+
+    def register_gauge(self, name, func):
+        """
+        Registers a gauge whose value is read from `func()` at render time.
+
+        The bot renders metrics in a worker thread, so `func` may block (e.g. query the database).
+        """
+        with self._lock:
+            self._gauges[name] = func
+
+    def counter(self, name, **labels):
+        """Returns the current value of a counter (0 if it was never incremented)."""
+        with self._lock:
+            return self._counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def _read_gauges(self):
+        with self._lock:
+            gauges = list(self._gauges.items())
+        values = {}
+        for name, func in gauges:
+            try:
+                values[name] = float(func())
+            except Exception as e:
+                logging.warning(f"Could not read gauge {name}: {e}")
+        return values
+
+    def snapshot(self):
+        """
+        Returns every metric as plain data.
+
+        Returns:
+            dict: 'stages' ({stage: {count, sum, p50, p95, p99, max}}), 'counters'
+                ({name: {labels tuple: value}}) and 'gauges' ({name: value}).
+        """
+        with self._lock:
+            timings = {stage: (count, total, sorted(samples)) for stage, (count, total, samples) in self._timings.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+        stages = {}
+        for stage, (count, total, ordered) in timings.items():
+            stats = {'count': count, 'sum': total, 'max': ordered[-1] if ordered else 0.0}
+            for quantile in QUANTILES:
+                key = f"p{int(quantile * 100)}"
+                stats[key] = ordered[min(len(ordered) - 1, int(len(ordered) * quantile))] if ordered else 0.0
+            stages[stage] = stats
+        return {'stages': stages, 'counters': counters, 'gauges': self._read_gauges()}
+
+    def render_prometheus(self):
+        """Renders the metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {PREFIX}stage_seconds Time spent in each pipeline stage (quantiles over the recent window).",
+            f"# TYPE {PREFIX}stage_seconds summary",
+        ]
+        for stage, stats in sorted(snapshot['stages'].items()):
+            for quantile in QUANTILES:
+                labels = _format_labels((('stage', stage), ('quantile', quantile)))
+                lines.append(f"{PREFIX}stage_seconds{labels} {stats[f'p{int(quantile * 100)}']:.6f}")
+            labels = _format_labels((('stage', stage),))
+            lines.append(f"{PREFIX}stage_seconds_sum{labels} {stats['sum']:.6f}")
+            lines.append(f"{PREFIX}stage_seconds_count{labels} {stats['count']}")
+        for name, series in sorted(snapshot['counters'].items()):
+            metric = PREFIX + re.sub(r"[^a-zA-Z0-9_]", "_", name) + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+        for name, value in sorted(snapshot['gauges'].items()):
+            metric = PREFIX + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Drops every timing and counter; gauges stay registered."""
+        with self._lock:
+            self._timings.clear()
+            self._counters.clear()
+
+
+metrics = Metrics()
+
+
+class MetricsServer:
+    """Serves `metrics.render_prometheus()` at /metrics over HTTP (aiohttp, on the bot's event loop)."""
+
+    def __init__(self, port=METRICS_PORT, host=METRICS_HOST, registry=metrics):
+        self.port = port
+        self.host = host
+        self.registry = registry
+        self._runner = None
+
+    async def _handle(self, request):
+        from aiohttp import web
+
+        text = await asyncio.to_thread(self.registry.render_prometheus)  # Gauges may query the database
+        return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        """Starts listening. Does nothing when the port is 0. Registered as a dispatcher startup handler."""
+        if not self.port or self._runner is not None:
+            return
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        """Stops listening. Registered as a dispatcher shutdown handler."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,129 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+from db.database import connect, normalize_url, normalize_xpath
+
+CACHE_TTL = float(os.getenv("PRICE_CACHE_TTL", "3600"))  # Seconds a parsed price stays fresh
+CACHE_MAX_ENTRIES = int(os.getenv("PRICE_CACHE_MAX_ENTRIES", "10000"))  # In-memory LRU bound
+CACHE_DB_PATH = os.getenv("PRICE_CACHE_DB")  # SQLite file for the persistent tier; unset keeps the cache in memory only
+
+def normalize_key(url, xpath):
+    """Returns the normalized (url, xpath) cache key."""
+    return normalize_url(url), normalize_xpath(xpath)
+
+
+class PriceCache:
+    """
+    Cache of parsed prices keyed by normalized (url, xpath).
+
+    Entries live in an in-memory LRU bounded by `max_entries` and expire after
+    `ttl` seconds. If `db_path` is given, entries are also written to a SQLite
+    table so they survive restarts. Only found prices are cached; a missing
+    price is usually a transient failure and is retried on the next run.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, db_path=CACHE_DB_PATH):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> (price, stored_at); most recently used last
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        if db_path:
+            self._conn = connect(db_path)  # Shared by all threads, guarded by self._lock
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS price_cache (
+                    url TEXT NOT NULL,
+                    xpath TEXT NOT NULL,
+                    price REAL NOT NULL,
+                    stored_at REAL NOT NULL,
+                    PRIMARY KEY (url, xpath)
+                )
+            """)
+            self._conn.commit()
+
+    def _remember(self, key, price, stored_at):
+        self._entries[key] = (price, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)  # Evict the least recently used entry
+
+    def _load(self, key):
+        return self._conn.execute("SELECT price, stored_at FROM price_cache WHERE url = ? AND xpath = ?",
+                                  key).fetchone()
+
+    def get(self, url, xpath):
+        """Returns the cached price for (url, xpath), or None if it is missing or expired."""
+        key = normalize_key(url, xpath)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._conn is not None:
+                entry = self._load(key)
+                if entry is not None:
+                    self._remember(key, *entry)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._entries.pop(key, None)  # Expired
+            self.misses += 1
+            return None
+
+    def put(self, url, xpath, price):
+        """Stores a parsed price. None prices are ignored."""
+        if price is None:
+            return
+        key = normalize_key(url, xpath)
+        now = time.time()
+        with self._lock:
+            self._remember(key, price, now)
+            if self._conn is not None:
+                self._conn.execute("INSERT OR REPLACE INTO price_cache (url, xpath, price, stored_at) VALUES (?, ?, ?, ?)",
+                                   (*key, price, now))
+                self._conn.commit()
+
+    def stats(self):
+        """Returns hit/miss counters and the number of entries held in memory."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._entries),
+            }
+
+    def clear(self):
+        """Drops every cached price (memory and persistent tier)."""
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM price_cache")
+                self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the process-wide price cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PriceCache()
+            if CACHE_DB_PATH:
+                logging.info(f"Price cache persisted to {CACHE_DB_PATH}")
+        return _cache
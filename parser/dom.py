@@ -0,0 +1,57 @@
+import logging
+
+FIELD_PRICE = "price"
+FIELD_TITLE = "title"
+FIELD_AVAILABILITY = "availability"
+
+# Evaluates every XPath in the page and returns the texts of all matches at once,
+# so a page costs one WebDriver round-trip however many nodes match.
+# Element texts use innerText, which is what WebElement.text returns (rendered text).
+EXTRACT_SCRIPT = """
+const xpaths = arguments[0];
+const fields = {};
+for (const name of Object.keys(xpaths)) {
+    const texts = [];
+    try {
+        const result = document.evaluate(xpaths[name], document, null, XPathResult.ANY_TYPE, null);
+        switch (result.resultType) {
+            case XPathResult.STRING_TYPE: texts.push(result.stringValue); break;
+            case XPathResult.NUMBER_TYPE: texts.push(String(result.numberValue)); break;
+            case XPathResult.BOOLEAN_TYPE: texts.push(String(result.booleanValue)); break;
+            default:
+                for (let node = result.iterateNext(); node; node = result.iterateNext()) {
+                    const text = node.innerText !== undefined ? node.innerText : node.textContent;
+                    texts.push((text || "").trim());
+                }
+        }
+    } catch (e) {
+        fields[name] = null;  // Invalid XPath
+        continue;
+    }
+    fields[name] = texts;
+}
+return fields;
+"""
+
+
+def extract_browser_fields(driver, xpaths):
+    """
+    Evaluates several XPaths in a loaded page with a single `execute_script` call.
+
+    Args:
+        driver (WebDriver): A browser with the page loaded.
+        xpaths (dict): Field name -> XPath, e.g. {FIELD_PRICE: ..., FIELD_AVAILABILITY: ...}.
+
+    Returns:
+        dict: Field name -> list of the texts of every matched node (empty if nothing
+            matched or the XPath is invalid).
+    """
+    fields = driver.execute_script(EXTRACT_SCRIPT, xpaths) or {}
+    result = {}
+    for name, xpath in xpaths.items():
+        texts = fields.get(name)
+        if texts is None:
+            logging.warning(f"Could not evaluate XPath {xpath} in the browser")
+            texts = []
+        result[name] = texts
+    return result
@@ -0,0 +1,153 @@
+import collections
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+MAX_WORKERS = int(os.getenv("PARSER_MAX_WORKERS", "4"))  # Sites parsed at the same time
+PER_DOMAIN_LIMIT = int(os.getenv("PARSER_PER_DOMAIN_LIMIT", "2"))  # Sites of one shop parsed at the same time
+BATCH_DEADLINE = float(os.getenv("PARSER_BATCH_DEADLINE", "600"))  # Seconds allowed for a whole batch
+DOMAIN_POLL_INTERVAL = 0.5  # Seconds between checks while every pending domain is saturated
+
+
+def domain_of(url):
+    """Returns the lower-cased host of a URL without a leading 'www.'."""
+    host = (urlsplit(str(url)).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+class SiteResult:
+    """The outcome of parsing a single website row."""
+
+    def __init__(self, website, price=None, elapsed=0.0, error=None):
+        self.website = website  # The original row ('title', 'url', 'xpath', ...)
+        self.price = price  # Average price, or None if nothing was found
+        self.elapsed = elapsed  # Seconds spent parsing the site
+        self.error = error  # Short description of why no price was produced, if known
+
+    @property
+    def title(self):
+        return self.website['title']
+
+    def __repr__(self):
+        return f"SiteResult(title={self.title!r}, price={self.price!r}, elapsed={self.elapsed:.2f}, error={self.error!r})"
+
+
+class ParseEngine:
+    """
+    Runs website parsing on a bounded thread pool.
+
+    At most `max_workers` sites of one batch are in flight at a time and at most
+    `per_domain_limit` sites of the same domain run concurrently across all
+    batches, so a sheet full of one shop does not hammer it (or starve other users).
+    """
+
+    def __init__(self, parse_func, max_workers=MAX_WORKERS, per_domain_limit=PER_DOMAIN_LIMIT):
+        self.parse_func = parse_func  # Called as parse_func(url, xpath, pool, deadline_at=...[, profile=...]) -> price or None
+        self.max_workers = max_workers
+        self.per_domain_limit = per_domain_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="parser")
+        self._domain_lock = threading.Lock()
+        self._domain_in_flight = collections.Counter()
+
+    def _reserve(self, domain):
+        with self._domain_lock:
+            if self._domain_in_flight[domain] >= self.per_domain_limit:
+                return False
+            self._domain_in_flight[domain] += 1
+            return True
+
+    def _release(self, domain):
+        with self._domain_lock:
+            self._domain_in_flight[domain] -= 1
+            if self._domain_in_flight[domain] <= 0:
+                del self._domain_in_flight[domain]
+
+    @contextmanager
+    def domain_slot(self, domain):
+        """
+        Holds one of `domain`'s slots under the per-domain limit, waiting until one is free.
+
+        For parses that run outside the engine (the catalog scheduler), so they
+        count against the same limit as the engine's own batches.
+        """
+        while not self._reserve(domain):
+            time.sleep(DOMAIN_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            self._release(domain)
+
+    def _run_site(self, website, pool, deadline_at):
+        domain = domain_of(website['url'])
+        start = time.monotonic()
+        try:
+            if start >= deadline_at:
+                return SiteResult(website, error="deadline")
+            options = {'profile': website['profile']} if website.get('profile') else {}  # Optional browser load profile
+            price = self.parse_func(website['url'], website['xpath'], pool, deadline_at=deadline_at, **options)
+            return SiteResult(website, price, time.monotonic() - start)
+        except Exception as e:
+            logging.error(f"An error occurred while parsing {website['url']}: {e}")
+            return SiteResult(website, None, time.monotonic() - start, error=str(e))
+        finally:
+            self._release(domain)
+
+    def _dispatch(self, pending, running, pool, deadline_at):
+        """Submits pending sites whose domain has a free slot, keeping the batch within max_workers."""
+        for _ in range(len(pending)):
+            if len(running) >= self.max_workers:
+                return
+            website = pending.popleft()
+            if self._reserve(domain_of(website['url'])):
+                future = self._executor.submit(self._run_site, website, pool, deadline_at)
+                running[future] = website
+            else:
+                pending.append(website)  # Domain is saturated, try again after something finishes
+
+    def iter_results(self, websites_data, pool=None, deadline=BATCH_DEADLINE):
+        """
+        Parses websites concurrently, yielding a SiteResult as soon as each site finishes.
+
+        Args:
+            websites_data (list): Website rows, each containing 'title', 'url' and 'xpath' keys.
+            pool (BrowserPool): Passed through to the parse function.
+            deadline (float): Seconds allowed for the whole batch. Sites that have not
+                finished by then are yielded with price None and error 'deadline'.
+
+        Yields:
+            SiteResult: One result per website row, in completion order.
+        """
+        deadline_at = time.monotonic() + deadline
+        pending = collections.deque(websites_data)
+        running = {}
+
+        while pending or running:
+            self._dispatch(pending, running, pool, deadline_at)
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+            if not running:  # Every pending domain is busy with other batches
+                time.sleep(min(DOMAIN_POLL_INTERVAL, remaining))
+                continue
+            timeout = min(remaining, DOMAIN_POLL_INTERVAL) if pending else remaining
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                yield future.result()
+
+        if pending or running:
+            logging.warning(f"Batch deadline of {deadline}s reached with {len(pending) + len(running)} sites unfinished")
+        for future, website in running.items():
+            if future.cancel():  # Never started, so _run_site will not free its domain slot
+                self._release(domain_of(website['url']))
+            yield SiteResult(website, error="deadline")
+        for website in pending:
+            yield SiteResult(website, error="deadline")
+
+    def shutdown(self):
+        """Stops accepting work and drops queued sites; sites already running are allowed to finish."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import threading
+
+import aiohttp
+from lxml import etree, html
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_FETCH_TIMEOUT", "10"))  # Seconds for one static page fetch
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "20"))  # Open connections shared by all fetches
+HTTP_HEADERS = {
+    'User-Agent': ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                   "(KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36"),
+    'Accept': "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    'Accept-Language': "ru-RU,ru;q=0.9,en;q=0.8",
+}
+
+TIER_HTTP = "http"  # Static HTML fetched with aiohttp, XPath evaluated with lxml
+TIER_SELENIUM = "selenium"  # Page rendered in a pooled headless Chrome
+
+
+class HttpFetcher:
+    """
+    Pooled static page fetcher.
+
+    A single aiohttp session (and its keep-alive connection pool) lives on a
+    private event loop in a background thread, so the parser's worker threads
+    can share it through the blocking `fetch` method.
+    """
+
+    def __init__(self, pool_limit=HTTP_POOL_LIMIT):
+        self.pool_limit = pool_limit
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="http-fetcher", daemon=True)
+        self._thread.start()
+        self._session = asyncio.run_coroutine_threadsafe(self._open_session(), self._loop).result()
+
+    async def _open_session(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_limit, ttl_dns_cache=300)
+        return aiohttp.ClientSession(connector=connector, headers=HTTP_HEADERS)
+
+    async def _fetch(self, url, timeout):
+        async with self._session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            response.raise_for_status()
+            return await response.text(errors="replace")  # Decoded with the charset from the headers
+
+    def fetch(self, url, timeout=HTTP_TIMEOUT):
+        """
+        Downloads a page and returns its HTML.
+
+        Raises:
+            aiohttp.ClientError: If the request fails or returns an error status.
+            asyncio.TimeoutError: If the page did not arrive within `timeout` seconds.
+        """
+        return asyncio.run_coroutine_threadsafe(self._fetch(url, timeout), self._loop).result()
+
+    def close(self):
+        """Closes the session and stops the background loop."""
+        asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+_parsers = threading.local()  # lxml parsers must not be shared between threads
+
+
+def extract_static_fields(page_html, xpaths):
+    """
+    Evaluates several XPaths against static HTML (str, or UTF-8 bytes), parsing it once.
+
+    Args:
+        page_html (str | bytes): The page.
+        xpaths (dict): Field name -> XPath, e.g. {'price': ..., 'availability': ...}.
+
+    Returns:
+        dict: Field name -> list of the texts of every matched node (empty if nothing matched).
+    """
+    try:
+        if isinstance(page_html, str):
+            page_html = page_html.encode("utf-8")  # lxml rejects str input that carries an encoding declaration
+        if not hasattr(_parsers, "utf8"):
+            _parsers.utf8 = html.HTMLParser(encoding="utf-8")
+        tree = html.fromstring(page_html, parser=_parsers.utf8)
+    except (etree.ParserError, ValueError) as e:
+        logging.warning(f"Could not parse static HTML: {e}")
+        return {name: [] for name in xpaths}
+
+    fields = {}
+    for name, xpath in xpaths.items():
+        try:
+            matches = tree.xpath(xpath)
+        except (etree.XPathError, ValueError) as e:
+            logging.warning(f"Could not evaluate XPath {xpath} on static HTML: {e}")
+            fields[name] = []
+            continue
+        if not isinstance(matches, list):  # e.g. string(...) or count(...) expressions
+            matches = [matches]
+        texts = []
+        for match in matches:
+            if isinstance(match, etree._Element):
+                texts.append(match.text_content())
+            else:
+                texts.append(str(match))
+        fields[name] = texts
+    return fields
+
+
+def extract_static_texts(page_html, xpath):
+    """
+    Evaluates an XPath against static HTML (str, or UTF-8 bytes).
+
+    Returns:
+        list: The text of every matched node (empty if nothing matched).
+    """
+    return extract_static_fields(page_html, {'price': xpath})['price']
+
+
+class TierMemory:
+    """Remembers, per domain, which fetch tier produced a price last time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tiers = {}
+
+    def get(self, domain):
+        with self._lock:
+            return self._tiers.get(domain)
+
+    def remember(self, domain, tier):
+        with self._lock:
+            if self._tiers.get(domain) != tier:
+                logging.info(f"Using {tier} tier for {domain}")
+            self._tiers[domain] = tier
+
+
+tier_memory = TierMemory()
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher():
+    """Returns the process-wide HTTP fetcher, creating it on first use."""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = HttpFetcher()
+        return _fetcher
+
+
+def shutdown_fetcher():
+    """Closes the process-wide HTTP fetcher, if it was ever created."""
+    global _fetcher
+    with _fetcher_lock:
+        fetcher, _fetcher = _fetcher, None
+    if fetcher is not None:
+        fetcher.close()
@@ -1,17 +1,31 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service as ChromeService
-from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+import asyncio
 import re
 import logging
+import threading
+import time
+
+from metrics import (COUNTER_CACHE_HITS, COUNTER_FAILURES, COUNTER_SITES, COUNTER_TIMEOUTS, STAGE_EXTRACTION,
+                     STAGE_PAGE_LOAD, STAGE_SITE, STAGE_STATIC_FETCH, STAGE_XPATH_WAIT, metrics)
+from parser.cache import get_cache
+from parser.dom import FIELD_PRICE, extract_browser_fields
+from parser.engine import BATCH_DEADLINE, ParseEngine, domain_of
+from parser.fetch import TIER_HTTP, TIER_SELENIUM, extract_static_texts, get_fetcher, tier_memory
+from parser.pool import get_pool
+from parser.profiles import (LEAN_POLL_INTERVAL, PROFILE_LEAN, normalize_profile, page_transfer_size, profile_stats,
+                             unblocked_page)
+from parser.prices import clean_prices, price_stats
+from parser.reliability import DEFAULT_TIMEOUT, PriceTimeout, SiteUnavailable, get_reliability
+
+MIN_XPATH_WAIT = 1.0  # Seconds the price XPath is waited for even when the page load used up the timeout
 
 def clean_price_string(price_string):
-    """Очищает строку с ценой от лишних символов (пробелов, валют)."""
-    logging.info(f"Cleaning price string: {price_string}")
+    """
+    Очищает строку с ценой от лишних символов (пробелов, валют).
+
+    Для пачки строк используйте parser.prices.clean_prices: он быстрее и учитывает
+    разделители разных локалей ("1,299.00" и "1.299,00").
+    """
+    logging.debug(f"Cleaning price string: {price_string}")
     price_string = price_string.replace(" ", "")  # Удаляем обычные пробелы
     price_string = price_string.replace(" ", "")  # Удаляем неразрывные пробелы ( )
     price_string = re.sub(r'[^\d,.]', '', price_string)  # Удаляем все, кроме цифр, точек и запятых
@@ -32,81 +46,316 @@ def clean_price_string(price_string):
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def parse_website_price(url, xpath):
+
+def average_price(price_texts, url, xpath):
+    """
+    Cleans the texts of the matched price elements in one batch and averages the valid prices.
+
+    Returns:
+        float: The average price, or None if none of the texts is a valid price.
+    """
+    stats = price_stats(clean_prices(price_texts))
+    if stats is None:
+        logging.warning(f"No valid prices found for XPath: {xpath} on {url}")
+        return None  # Return None if no valid prices were found
+
+    logging.info(f"Successfully parsed {stats['count']} prices from {url}. Average: {stats['mean']}, "
+                 f"median: {stats['median']}, range: {stats['min']}-{stats['max']}")
+    return stats['mean']
+
+def parse_website_fields(url, xpaths, pool=None, wait_for=FIELD_PRICE, profile=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Loads a website in a pooled browser and extracts several fields in one pass.
+
+    Once the `wait_for` field's XPath is present, every XPath is evaluated and
+    all matched texts are collected by a single script call, instead of one
+    WebDriver round-trip per matched element. The load time and bytes
+    transferred are logged and recorded per load profile, and the time until
+    the XPath appeared is reported to the reliability layer.
+
+    Args:
+        url (str): The URL of the website to parse.
+        xpaths (dict): Field name -> XPath, e.g. {'price': ..., 'title': ..., 'availability': ...}.
+        pool (BrowserPool): The pool to check a browser out of (the process-wide pool of `profile` by default).
+        wait_for (str): The field whose XPath must appear before extracting.
+        profile (str): The load profile ('full' or 'lean'); ignored when `pool` is given.
+        timeout (float): Seconds allowed for the page load and the `wait_for` XPath together.
+
+    Returns:
+        dict: Field name -> list of matched texts, or None if the texts could not be extracted.
+
+    Raises:
+        SiteUnavailable: If the page failed to load or its load timed out.
+        PriceTimeout: If the `wait_for` XPath did not appear in time.
+    """
+    from selenium.common.exceptions import NoSuchElementException, TimeoutException, WebDriverException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait  # Imported on first use to keep the bot's startup fast
+
+    pool = pool or get_pool(profile)
+    profile = getattr(pool, "profile", normalize_profile(profile))
+    poll_interval = LEAN_POLL_INTERVAL if profile == PROFILE_LEAN else 0.5
+    domain = domain_of(url)
+
+    with pool.browser() as driver, unblocked_page(driver, profile, url):  # Check a warm Chrome instance out of the pool
+        start = time.monotonic()
+        try:
+            driver.set_page_load_timeout(timeout)  # Pooled browsers are shared by all domains, so set it every time
+            with metrics.timer(STAGE_PAGE_LOAD):
+                driver.get(url)  # Navigate to the URL (returns at DOMContentLoaded with the lean profile)
+        except TimeoutException:
+            metrics.inc(COUNTER_TIMEOUTS, domain=domain)
+            get_reliability().observe_timeout(domain, time.monotonic() - start)
+            raise SiteUnavailable(f"Timed out loading {url} after {timeout:.0f}s")
+        except WebDriverException as e:
+            raise SiteUnavailable(f"Failed to load {url}: {e.msg}")
+
+        try:
+            with metrics.timer(STAGE_XPATH_WAIT):
+                remaining = max(MIN_XPATH_WAIT, timeout - (time.monotonic() - start))
+                wait = WebDriverWait(driver, remaining, poll_frequency=poll_interval)
+                wait.until(EC.presence_of_element_located((By.XPATH, xpaths[wait_for])))
+        except TimeoutException:
+            metrics.inc(COUNTER_TIMEOUTS, domain=domain)
+            get_reliability().observe_timeout(domain, time.monotonic() - start)
+            raise PriceTimeout(f"XPath {xpaths[wait_for]} did not appear on {url} within {timeout:.0f}s")
+        get_reliability().observe_latency(domain, time.monotonic() - start)
+
+        try:
+            with metrics.timer(STAGE_EXTRACTION):
+                fields = extract_browser_fields(driver, xpaths)  # One round-trip for all fields and matches
+
+            elapsed = time.monotonic() - start
+            transferred = page_transfer_size(driver)
+            profile_stats.record(profile, elapsed, transferred)
+            logging.info(f"Loaded {url} with the {profile} profile in {elapsed:.2f}s, "
+                         f"{(transferred or 0) / 1024:.0f} KB transferred")
+            return fields
+
+        except NoSuchElementException:
+            logging.error(f"No elements found with XPath: {xpaths[wait_for]} on {url}")
+            return None  # Return None if no elements are found
+        except Exception as e:
+            logging.error(f"An error occurred while parsing {url}: {e}")
+            return None  # Return None for any other exceptions
+
+
+def parse_website_price(url, xpath, pool=None, profile=None, timeout=DEFAULT_TIMEOUT):
     """
     Parses a website to extract prices of a product and calculates their average.
 
     Args:
         url (str): The URL of the website to parse.
         xpath (str): The XPath expression to locate the price elements.
+        pool (BrowserPool): The pool to check a browser out of (the process-wide pool by default).
+        profile (str): The load profile used when no pool is given.
+        timeout (float): Seconds allowed for the page load and the price XPath together.
 
     Returns:
         float: The average price found on the website, or None if no valid prices are found.
+
+    Raises:
+        SiteError: See `parse_website_fields`.
     """
-    chrome_options = Options()
-    chrome_options.add_argument('--headless')  # Run Chrome in headless mode (no GUI)
-    chrome_options.add_argument('--no-sandbox')  # Bypass OS security model
-    chrome_options.add_argument('--disable-dev-shm-usage')  # Overcome limited resource problems
-    chrome_options.add_argument('--disable-gpu') # applicable to windows os only
-    chrome_options.add_argument('--window-size=1920,1080') # Set a reasonable window size.
-    service = ChromeService(ChromeDriverManager().install())  # Use webdriver_manager to handle ChromeDriver
-    driver = webdriver.Chrome(service=service, options=chrome_options)  # Initialize Chrome WebDriver
+    fields = parse_website_fields(url, {FIELD_PRICE: xpath}, pool, profile=profile, timeout=timeout)
+    if fields is None:
+        return None
+    if not fields[FIELD_PRICE]:
+        logging.warning(f"No elements found with XPath: {xpath} on {url}")
+        return None  # Return None if no elements are found
+    return average_price(fields[FIELD_PRICE], url, xpath)  # Return the average price
 
-    try:
-        driver.get(url)  # Navigate to the URL
-        wait = WebDriverWait(driver, 10)  # Wait up to 10 seconds
-        wait.until(EC.presence_of_element_located((By.XPATH, xpath)))
 
-        price_elements = driver.find_elements(By.XPATH, xpath)  # Find all elements matching the XPath
-        if not price_elements:
-            logging.warning(f"No elements found with XPath: {xpath} on {url}")
-            return None  # Return None if no elements are found
+def parse_static_price(url, xpath):
+    """
+    Parses a website without a browser: fetches the static HTML and evaluates the XPath on it.
 
-        # Extract and clean the prices
-        prices = []
-        for price_element in price_elements:
-            price_text = price_element.text  # Get the text content of the element
-            cleaned_price = clean_price_string(price_text)  # Clean and convert the price
-            if cleaned_price is not None:
-                prices.append(cleaned_price)  # Add valid prices to the list
-
-        if not prices:
-            logging.warning(f"No valid prices found for XPath: {xpath} on {url}")
-            return None  # Return None if no valid prices were found
-
-        # Calculate the average price for this website
-        average_price_for_website = sum(prices) / len(prices)
-        logging.info(f"Successfully parsed prices from {url}. Average: {average_price_for_website}")
-        return average_price_for_website  # Return the average price
-
-    except NoSuchElementException:
-        logging.error(f"No elements found with XPath: {xpath} on {url}")
-        return None  # Return None if no elements are found
-    except TimeoutException:
-        logging.error(f"Timeout waiting for page to load: {url}")
-        return None  # Return None in case of a timeout
+    Returns:
+        tuple: (matched, price) where `matched` tells whether the XPath matched anything
+            and `price` is the average price (or None).
+    """
+    try:
+        with metrics.timer(STAGE_STATIC_FETCH):
+            page_html = get_fetcher().fetch(url)
     except Exception as e:
-        logging.error(f"An error occurred while parsing {url}: {e}")
-        return None  # Return None for any other exceptions
+        logging.info(f"Static fetch failed for {url}: {e!r}")
+        return False, None
+
+    price_texts = extract_static_texts(page_html, xpath)
+    if not price_texts:
+        logging.info(f"XPath matched nothing in static HTML of {url}, escalating to Selenium")
+        return False, None
+    return True, average_price(price_texts, url, xpath)
+
+
+def parse_price(url, xpath, pool=None, profile=None, deadline_at=None):
+    """
+    Parses a website using the cheapest tier that works for its domain.
+
+    The static HTTP tier is tried first; Selenium is used only when the XPath
+    matches nothing in the static HTML. The tier that produced a price is
+    remembered per domain, so later runs go straight to it. Each site runs under
+    its domain's reliability policy (see parser.reliability): the page timeout is
+    learned per domain, pages that fail to load are retried, and domains that
+    keep failing are skipped for a while. Only the Selenium step is retried, and
+    never past `deadline_at`.
+
+    Args:
+        url (str): The URL of the website to parse.
+        xpath (str): The XPath expression to locate the price elements.
+        pool (BrowserPool): The pool to check a browser out of if Selenium is needed.
+        profile (str): The browser load profile of the site ('full' or 'lean', the default if None).
+        deadline_at (float): time.monotonic() value the site must be done by (the batch deadline), if any.
+
+    Returns:
+        float: The average price found on the website, or None if no valid prices are found.
+
+    Raises:
+        SiteError: If the domain's circuit breaker is open or the site kept failing.
+    """
+    domain = domain_of(url)
+    static_tried = []
+
+    def attempt(timeout):
+        if not static_tried and tier_memory.get(domain) != TIER_SELENIUM:
+            static_tried.append(True)  # A retry means the page failed to load in Selenium, so skip straight to it
+            matched, price = parse_static_price(url, xpath)
+            if matched:
+                if price is not None:
+                    tier_memory.remember(domain, TIER_HTTP)
+                return price
+
+        price = parse_website_price(url, xpath, pool, profile, timeout)
+        if price is not None:
+            tier_memory.remember(domain, TIER_SELENIUM)
+        return price
+
+    return get_reliability().call(domain, attempt, deadline_at)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Returns the process-wide parse engine, creating it on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ParseEngine(parse_price)
+        return _engine
+
+
+def shutdown_engine():
+    """Shuts down the process-wide parse engine, if it was ever created."""
+    global _engine
+    with _engine_lock:
+        engine, _engine = _engine, None
+    if engine is not None:
+        engine.shutdown()
+
+
+def iter_average_prices(websites_data, pool=None, deadline=BATCH_DEADLINE, refresh=False):
+    """
+    Collects the average price of a product from multiple websites, yielding each one as soon as it is known.
+
+    Prices still fresh in the price cache are yielded first without parsing; the
+    remaining sites are parsed concurrently by the parse engine. Sites that have
+    not finished when `deadline` runs out are yielded as None.
+
+    Args:
+        websites_data (list): A list of dictionaries, each containing 'title', 'url' and 'xpath' keys.
+        pool (BrowserPool): The pool browsers are checked out of (the process-wide pool by default).
+        deadline (float): Seconds allowed for the whole batch.
+        refresh (bool): Ignore cached prices and parse every site again.
+
+    Yields:
+        tuple: (website row, average price or None), in completion order. The row is the
+            dictionary from `websites_data`, so callers can tell apart sites with the same title.
+    """
+    cache = get_cache()
+
+    to_parse = []
+    for website in websites_data:
+        cached_price = None if refresh else cache.get(website['url'], website['xpath'])
+        if cached_price is not None:
+            metrics.inc(COUNTER_CACHE_HITS, domain=domain_of(website['url']))
+            yield website, cached_price
+        else:
+            to_parse.append(website)
+
+    for result in get_engine().iter_results(to_parse, pool, deadline):
+        domain = domain_of(result.website['url'])
+        metrics.inc(COUNTER_SITES, domain=domain)
+        if result.error == "deadline":
+            metrics.inc(COUNTER_TIMEOUTS, domain=domain)
+        else:
+            metrics.observe(STAGE_SITE, result.elapsed)
+        if result.price is None:
+            metrics.inc(COUNTER_FAILURES, domain=domain)
+        cache.put(result.website['url'], result.website['xpath'], result.price)
+        yield result.website, result.price
+
+    logging.info(f"Parsed {len(to_parse)} of {len(websites_data)} sites, price cache: {cache.stats()}")
+
+
+async def stream_average_prices(websites_data, pool=None, deadline=BATCH_DEADLINE, refresh=False):
+    """
+    Async version of `iter_average_prices` for use from the bot's event loop.
+
+    Parsing runs in an executor thread; each (website row, price) pair is handed over
+    to the loop as soon as the site finishes. Closing the generator early stops
+    the remaining sites from being dispatched.
+    """
+    loop = asyncio.get_running_loop()
+    results = asyncio.Queue()
+    finished = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iter_average_prices(websites_data, pool, deadline, refresh):
+                loop.call_soon_threadsafe(results.put_nowait, item)
+                if stop.is_set():
+                    break
+        except Exception as e:
+            loop.call_soon_threadsafe(results.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(results.put_nowait, finished)
+
+    loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item = await results.get()
+            if item is finished:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
     finally:
-        driver.quit()  # Close the browser instance in all cases
+        stop.set()  # The producer thread stops at its next result
 
 
-def get_average_prices(websites_data, product_name="зюзюблик"):
+def get_average_prices(websites_data, product_name="зюзюблик", pool=None, deadline=BATCH_DEADLINE, refresh=False):
     """
     Collects the average price of a product from multiple websites.
 
+    Blocking wrapper around `iter_average_prices` that waits for the whole batch.
+
     Args:
-        websites_data (list): A list of dictionaries, each containing 'url' and 'xpath' keys.
+        websites_data (list): A list of dictionaries, each containing 'title', 'url' and 'xpath' keys.
         product_name (str): The name of product (not used in current logic but can be used for future enchancement).
+        pool (BrowserPool): The pool browsers are checked out of (the process-wide pool by default).
+        deadline (float): Seconds allowed for the whole batch.
+        refresh (bool): Ignore cached prices and parse every site again.
 
     Returns:
         dict: A dictionary where keys are website titles and values are the average prices (or None).
     """
-    website_averages = {}  # Store average price for each website
+    website_averages = {website['title']: None for website in websites_data}  # Keep the order of the file
 
-    for website in websites_data:
-        average_price = parse_website_price(website['url'], website['xpath'])  # Get average price from each website
+    for website, average_price in iter_average_prices(websites_data, pool, deadline, refresh):
         website_averages[website['title']] = average_price  # Store average or None
 
-    return website_averages  # Return only the dictionary of website averages
\ No newline at end of file
+    return website_averages  # Return only the dictionary of website averages
@@ -0,0 +1,329 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Selenium and webdriver_manager are imported where they are used, so importing
+# the pool (and the bot, which imports it) does not pay for them before the first browser starts.
+from metrics import STAGE_BROWSER_ACQUIRE, metrics
+from parser.profiles import PROFILE_FULL, apply_profile_options, configure_browser, normalize_profile
+
+POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))  # Number of warm Chrome instances
+MAX_PAGES_PER_BROWSER = int(os.getenv("BROWSER_MAX_PAGES", "50"))  # Recycle a browser after this many pages
+ACQUIRE_TIMEOUT = float(os.getenv("BROWSER_ACQUIRE_TIMEOUT", "120"))  # Seconds to wait for a free browser
+PREWARM_BROWSERS = int(os.getenv("BROWSER_PREWARM", "1"))  # Browsers started in the background after the bot starts
+DRIVER_CACHE_FILE = os.getenv("CHROMEDRIVER_CACHE", "data/chromedriver_path")  # Written by `python -m parser.pool`
+
+_RESET_STORAGE_SCRIPT = "try { window.localStorage.clear(); window.sessionStorage.clear(); } catch (e) {}"
+
+
+def _install_driver():
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    return ChromeDriverManager().install()
+
+
+def _read_cached_driver_path(cache_file):
+    try:
+        with open(cache_file) as f:
+            path = f.read().strip()
+    except OSError:
+        return None
+    return path if path and os.path.isfile(path) else None  # A stale entry (driver removed) is resolved again
+
+
+def _write_cached_driver_path(cache_file, path):
+    try:
+        directory = os.path.dirname(cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(cache_file, "w") as f:
+            f.write(path)
+    except OSError as e:
+        logging.warning(f"Could not cache the ChromeDriver path in {cache_file}: {e}")
+
+
+_driver_paths = {}  # cache_file -> resolved ChromeDriver path
+_driver_paths_lock = threading.Lock()
+
+
+def resolve_driver_path(cache_file=DRIVER_CACHE_FILE):
+    """
+    Resolves the ChromeDriver binary once per process.
+
+    The CHROMEDRIVER_PATH environment variable takes precedence, then the path
+    cached in `cache_file` (written at deploy time by `python -m parser.pool`).
+    Otherwise webdriver_manager is asked to install (or find the cached) driver,
+    which may hit the network, and the result is cached for the next start.
+    Concurrent first calls (engine threads, the prewarm thread) wait for one
+    resolution instead of downloading the driver side by side.
+    """
+    with _driver_paths_lock:
+        path = _driver_paths.get(cache_file)
+        if path is None:
+            path = _driver_paths[cache_file] = _find_driver_path(cache_file)
+        return path
+
+
+def _find_driver_path(cache_file):
+    path = os.getenv("CHROMEDRIVER_PATH") or _read_cached_driver_path(cache_file)
+    if path:
+        return path
+    path = _install_driver()
+    logging.info(f"Resolved ChromeDriver at {path}")
+    _write_cached_driver_path(cache_file, path)
+    return path
+
+
+def build_chrome_options(profile=PROFILE_FULL):
+    """Builds the Chrome options used for every pooled browser of a load profile."""
+    from selenium.webdriver.chrome.options import Options
+
+    chrome_options = Options()
+    chrome_options.add_argument('--headless')  # Run Chrome in headless mode (no GUI)
+    chrome_options.add_argument('--no-sandbox')  # Bypass OS security model
+    chrome_options.add_argument('--disable-dev-shm-usage')  # Overcome limited resource problems
+    chrome_options.add_argument('--disable-gpu')  # applicable to windows os only
+    chrome_options.add_argument('--window-size=1920,1080')  # Set a reasonable window size.
+    apply_profile_options(chrome_options, profile)
+    return chrome_options
+
+
+class PooledBrowser:
+    """A Chrome WebDriver together with the bookkeeping the pool needs to recycle it."""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0  # Pages served since the browser was started
+
+
+class BrowserPool:
+    """
+    A fixed-size pool of warm headless Chrome instances.
+
+    Browsers are started lazily up to `size`, handed out one job at a time,
+    reset (cookies, extra tabs, storage) when returned, and replaced after
+    `max_pages` jobs or as soon as they stop responding. All browsers of a
+    pool share one load profile (see parser.profiles).
+    """
+
+    def __init__(self, size=POOL_SIZE, max_pages=MAX_PAGES_PER_BROWSER, profile=PROFILE_FULL):
+        self.size = size
+        self.max_pages = max_pages
+        self.profile = profile
+        self._idle = []  # Used as a stack, so the most recently used (warmest) browser goes out first
+        self._cond = threading.Condition()  # Guards _idle, _created and _closed; notified when either changes
+        self._created = 0  # Browsers currently alive (idle or checked out)
+        self._closed = False
+
+    def _start_browser(self):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service as ChromeService
+
+        service = ChromeService(resolve_driver_path())
+        driver = webdriver.Chrome(service=service, options=build_chrome_options(self.profile))
+        try:
+            configure_browser(driver, self.profile)
+        except Exception:
+            driver.quit()
+            raise
+        logging.info(f"Started pooled Chrome instance ({self.profile} profile)")
+        return PooledBrowser(driver)
+
+    def _free_slot(self):
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()  # A waiter may start a replacement
+
+    def _discard(self, browser):
+        self._free_slot()
+        try:
+            browser.driver.quit()
+        except Exception as e:
+            logging.warning(f"Failed to quit pooled Chrome instance: {e}")
+
+    def _reset(self, browser):
+        """Clears per-job state. Returns False if the browser is no longer usable."""
+        from selenium.common.exceptions import WebDriverException
+
+        driver = browser.driver
+        try:
+            handles = driver.window_handles
+            for handle in handles[1:]:  # Close every tab the job opened
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            driver.execute_script(_RESET_STORAGE_SCRIPT)
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            driver.get("about:blank")
+        except WebDriverException as e:
+            logging.warning(f"Pooled Chrome instance failed to reset, recycling it: {e}")
+            return False
+        return True
+
+    @property
+    def browsers(self):
+        """Number of browsers currently alive (idle or checked out)."""
+        return self._created
+
+    def warm_up(self, count=None):
+        """Starts up to `count` browsers (the whole pool by default) ahead of the first job."""
+        count = self.size if count is None else min(count, self.size)
+        started = []
+        while len(started) < count:
+            with self._cond:
+                if self._closed or self._created >= self.size:
+                    break
+                self._created += 1
+            try:
+                started.append(self._start_browser())
+            except Exception:
+                self._free_slot()
+                raise
+        for browser in started:
+            with self._cond:
+                if not self._closed:
+                    self._idle.append(browser)
+                    self._cond.notify()
+                    continue
+            self._discard(browser)  # Shut down while the browsers were starting
+
+    def acquire(self, timeout=ACQUIRE_TIMEOUT):
+        """
+        Checks a browser out of the pool, starting a new one if the pool is not full yet.
+
+        Waiters are woken both when a browser is returned and when a recycled
+        browser frees its slot, so they never wait while the pool has capacity.
+
+        Raises:
+            RuntimeError: If the pool has been shut down.
+            TimeoutError: If no browser became free within `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Browser pool is shut down")
+                if self._idle:
+                    return self._idle.pop()
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No browser became available within {timeout} seconds")
+                self._cond.wait(remaining)
+        try:
+            return self._start_browser()
+        except Exception:
+            self._free_slot()
+            raise
+
+    def release(self, browser):
+        """Returns a browser to the pool, recycling it if it is worn out or fails its reset (crashed)."""
+        browser.pages += 1
+        if self._closed or browser.pages >= self.max_pages or not self._reset(browser):
+            self._discard(browser)
+            return
+        with self._cond:
+            if not self._closed:
+                self._idle.append(browser)
+                self._cond.notify()
+                return
+        self._discard(browser)
+
+    @contextmanager
+    def browser(self):
+        """Context manager yielding a WebDriver checked out of the pool."""
+        with metrics.timer(STAGE_BROWSER_ACQUIRE):
+            browser = self.acquire()
+        try:
+            yield browser.driver
+        finally:
+            self.release(browser)  # A crashed browser fails its reset and is replaced
+
+    def shutdown(self):
+        """Quits every idle browser; browsers still checked out are quit when released."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()  # Waiters fail fast instead of running into their timeout
+        for browser in idle:
+            self._discard(browser)
+        logging.info(f"Browser pool shut down ({self.profile} profile)")
+
+
+_pools = {}  # Load profile -> process-wide pool
+_pools_lock = threading.Lock()
+
+
+def get_pool(profile=None):
+    """Returns the process-wide browser pool of a load profile (the default profile if None), creating it on first use."""
+    profile = normalize_profile(profile)
+    with _pools_lock:
+        if profile not in _pools:
+            _pools[profile] = BrowserPool(profile=profile)
+        return _pools[profile]
+
+
+def browser_count():
+    """Number of Chrome instances alive across every process-wide pool."""
+    with _pools_lock:
+        return sum(pool.browsers for pool in _pools.values())
+
+
+def shutdown_pool():
+    """Shuts down every process-wide browser pool that was ever created."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
+
+
+def _prewarm(count):
+    try:
+        get_pool().warm_up(count)
+        logging.info(f"Pre-warmed {count} browser(s)")
+    except Exception as e:
+        logging.warning(f"Could not pre-warm the browser pool: {e}")
+
+
+def prewarm_pool(count=PREWARM_BROWSERS):
+    """
+    Starts `count` browsers of the default pool on a background thread and returns right away.
+
+    Registered as a dispatcher startup handler, so polling is not delayed by
+    Chrome starting (or by the driver being resolved) and the first parse finds a warm browser.
+    """
+    if count <= 0:
+        return None
+    thread = threading.Thread(target=_prewarm, args=(count,), name="pool-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description="Resolves ChromeDriver ahead of time (run at build or deploy time) and caches its path, "
+                    "so the bot does not download or look it up on its first parse.")
+    argparser.add_argument("--cache-file", default=DRIVER_CACHE_FILE, help="Where to store the driver path")
+    argparser.add_argument("--warm", action="store_true", help="Also start one browser to check the driver works")
+    args = argparser.parse_args()
+
+    path = os.getenv("CHROMEDRIVER_PATH") or _install_driver()
+    _write_cached_driver_path(args.cache_file, path)
+    print(path)
+    if args.warm:
+        pool = BrowserPool(size=1)
+        try:
+            pool.warm_up()
+        finally:
+            pool.shutdown()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,80 @@
+import re
+import statistics
+
+# The first number in a text, with the separators that may appear inside it
+NUMBER_PATTERN = re.compile(r"\d[\d \u00a0\u2009\u202f'’.,]*")
+GROUP_SPACES_PATTERN = re.compile(r"[ \u00a0\u2009\u202f'’]")  # Spaces and apostrophes between digit groups
+TRIM_FRACTION = 0.1  # Share of prices cut from each end for the trimmed mean
+
+
+def parse_price_text(text):
+    """
+    Converts the text of a price element to a number, whatever the locale.
+
+    "1 299,00 ₽", "1.299,00", "1,299.00" and "1299" all give 1299.0. When both
+    separators occur, the last one is the decimal separator. A single separator
+    followed by exactly three digits, or repeated, groups thousands; otherwise
+    it is the decimal separator ("12,5" is 12.5).
+
+    Returns:
+        float: The price, or None if the text has no number.
+    """
+    match = NUMBER_PATTERN.search(text)
+    if match is None:
+        return None
+    token = match.group()
+    if token.isdigit():
+        return float(token)
+    token = GROUP_SPACES_PATTERN.sub("", token).rstrip(".,")
+
+    last_comma, last_dot = token.rfind(","), token.rfind(".")
+    if last_comma >= 0 and last_dot >= 0:
+        decimal = "," if last_comma > last_dot else "."
+    elif last_comma >= 0 or last_dot >= 0:
+        decimal = "," if last_comma >= 0 else "."
+        integer, _, fraction = token.rpartition(decimal)
+        if token.count(decimal) > 1 or (len(fraction) == 3 and integer != "0"):
+            decimal = None  # Thousands separator
+    else:
+        decimal = None
+
+    if decimal is None:
+        return float(token.replace(",", "").replace(".", ""))
+    integer, _, fraction = token.rpartition(decimal)
+    return float(integer.replace(",", "").replace(".", "") + "." + fraction)
+
+
+def clean_prices(texts):
+    """
+    Converts a whole column of price texts at once.
+
+    Returns:
+        list: A price for every text, None where the text has no number.
+    """
+    return [parse_price_text(text) for text in texts]
+
+
+def price_stats(prices, trim=TRIM_FRACTION):
+    """
+    Summarizes the valid prices of one site.
+
+    Args:
+        prices (iterable): Prices; None values are ignored.
+        trim (float): Share of the lowest and of the highest prices left out of the trimmed mean.
+
+    Returns:
+        dict: count, mean, median, min, max and trimmed_mean, or None if there are no prices.
+    """
+    values = sorted(price for price in prices if price is not None)
+    if not values:
+        return None
+    cut = int(len(values) * trim)
+    trimmed = values[cut:len(values) - cut] or values
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'median': statistics.median(values),
+        'min': values[0],
+        'max': values[-1],
+        'trimmed_mean': sum(trimmed) / len(trimmed),
+    }
@@ -0,0 +1,136 @@
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+PROFILE_FULL = "full"  # Load everything, as a user's browser would
+PROFILE_LEAN = "lean"  # Eager load without images, media, fonts and trackers
+PROFILES = (PROFILE_FULL, PROFILE_LEAN)
+DEFAULT_PROFILE = os.getenv("BROWSER_PROFILE", PROFILE_FULL)  # Profile of sites without one
+
+# File extensions never downloaded by the lean profile
+BLOCKED_EXTENSIONS = (
+    "png", "jpg", "jpeg", "gif", "webp", "avif", "svg", "ico", "bmp",
+    "mp4", "webm", "ogg", "mp3", "wav", "m3u8",
+    "woff", "woff2", "ttf", "otf", "eot",
+)
+# URL patterns (Network.setBlockedURLs syntax, '*' is the only wildcard). Each extension is anchored to the
+# end of the path, with or without a query string or fragment, so hosts like gifts.example are not matched
+BLOCKED_RESOURCE_PATTERNS = tuple(f"*.{extension}{tail}" for extension in BLOCKED_EXTENSIONS for tail in ("", "?*", "#*"))
+TRACKER_DOMAINS = (
+    "google-analytics.com", "googletagmanager.com", "googlesyndication.com", "doubleclick.net",
+    "mc.yandex.ru", "an.yandex.ru", "top-fwz1.mail.ru", "vk.com/rtrg", "connect.facebook.net",
+    "criteo.com", "criteo.net", "adriver.ru", "hotjar.com", "mindbox.ru", "tiktok.com/i18n/pixel",
+)
+LEAN_POLL_INTERVAL = 0.1  # Seconds between XPath checks with the lean profile (WebDriverWait default is 0.5)
+
+# Bytes the page and its subresources took over the network (0 for cached or cross-origin entries without timing)
+TRANSFER_SIZE_SCRIPT = """
+let total = 0;
+for (const entry of performance.getEntriesByType("navigation").concat(performance.getEntriesByType("resource"))) {
+    total += entry.transferSize || 0;
+}
+return total;
+"""
+
+
+def normalize_profile(profile):
+    """Returns a known profile name for `profile` (case-insensitive), or the default profile."""
+    profile = (profile or "").strip().lower()
+    return profile if profile in PROFILES else DEFAULT_PROFILE
+
+
+def url_matches(url, pattern):
+    """Tells whether `url` matches a Network.setBlockedURLs pattern."""
+    return re.fullmatch(".*".join(map(re.escape, pattern.split("*"))), url, re.DOTALL) is not None
+
+
+def blocked_url_patterns(page_url=None):
+    """URL patterns the lean profile blocks; with `page_url`, without the patterns that would block that page itself."""
+    patterns = list(BLOCKED_RESOURCE_PATTERNS) + [f"*{domain}*" for domain in TRACKER_DOMAINS]
+    if page_url:
+        patterns = [pattern for pattern in patterns if not url_matches(page_url, pattern)]
+    return patterns
+
+
+def apply_profile_options(chrome_options, profile):
+    """Adds the Chrome options of `profile` to the options a pooled browser starts with."""
+    if profile != PROFILE_LEAN:
+        return
+    chrome_options.page_load_strategy = "eager"  # driver.get returns at DOMContentLoaded
+    chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+    chrome_options.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+        "profile.managed_default_content_settings.media_stream": 2,
+    })
+
+
+def configure_browser(driver, profile):
+    """Sets up request blocking on a freshly started browser of `profile`."""
+    if profile != PROFILE_LEAN:
+        return
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_url_patterns()})
+
+
+@contextmanager
+def unblocked_page(driver, profile, url):
+    """
+    Lets a lean browser load `url` even if a blocked pattern matches it ("item?img=a.png").
+
+    Blocked patterns also apply to the page's own navigation request, so while
+    the block is held the patterns matching `url` are lifted. Pages that no
+    pattern matches, the common case, cost no extra DevTools calls.
+    """
+    patterns = blocked_url_patterns(url) if profile == PROFILE_LEAN else None
+    exempt = patterns is not None and len(patterns) < len(blocked_url_patterns())
+    if exempt:
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+    try:
+        yield
+    finally:
+        if exempt:
+            try:
+                driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_url_patterns()})
+            except Exception as e:
+                logging.warning(f"Could not restore blocked URLs after loading {url}: {e}")
+
+
+def page_transfer_size(driver):
+    """Returns the bytes transferred for the loaded page, or None if the browser cannot tell."""
+    try:
+        return int(driver.execute_script(TRANSFER_SIZE_SCRIPT) or 0)
+    except Exception as e:
+        logging.debug(f"Could not read transfer size: {e}")
+        return None
+
+
+class ProfileStats:
+    """Pages, load time and bytes transferred per load profile, to compare what each profile saves."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, profile, seconds, transferred):
+        with self._lock:
+            stats = self._stats.setdefault(profile, {'pages': 0, 'seconds': 0.0, 'bytes': 0})
+            stats['pages'] += 1
+            stats['seconds'] += seconds
+            stats['bytes'] += transferred or 0
+
+    def snapshot(self):
+        """Returns {profile: {pages, avg_seconds, avg_bytes}}."""
+        with self._lock:
+            return {
+                profile: {
+                    'pages': stats['pages'],
+                    'avg_seconds': stats['seconds'] / stats['pages'],
+                    'avg_bytes': stats['bytes'] / stats['pages'],
+                }
+                for profile, stats in self._stats.items()
+            }
+
+
+profile_stats = ProfileStats()
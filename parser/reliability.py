@@ -0,0 +1,271 @@
+import collections
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from db.database import get_domain_health, save_domain_health
+from metrics import COUNTER_CIRCUIT_OPEN, COUNTER_RETRIES, metrics
+
+DEFAULT_TIMEOUT = float(os.getenv("SITE_TIMEOUT", "10"))  # Seconds allowed per page until enough latency is learned
+MIN_TIMEOUT = float(os.getenv("SITE_MIN_TIMEOUT", "5"))
+MAX_TIMEOUT = float(os.getenv("SITE_MAX_TIMEOUT", "60"))
+TIMEOUT_FACTOR = 2.0  # Timeout = p95 latency of the domain times this factor
+MIN_SAMPLES = 5  # Latency samples needed before the learned timeout is used
+LATENCY_WINDOW = 50  # Recent latency samples kept per domain
+PERSIST_EVERY = 10  # Latency samples between saves of the learned p95
+
+RETRIES = int(os.getenv("SITE_RETRIES", "2"))  # Extra attempts after a transient failure
+RETRY_BACKOFF = float(os.getenv("SITE_RETRY_BACKOFF", "1.0"))  # Seconds before the first retry, doubled each time
+
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))  # Consecutive failed sites that open the breaker
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "900"))  # Seconds a domain is skipped once its breaker opens
+
+STATE_CLOSED = "closed"  # Domain is parsed normally
+STATE_OPEN = "open"  # Domain is skipped until the cool-down ends
+STATE_HALF_OPEN = "half_open"  # Cool-down over: one probe decides whether to close or reopen
+
+
+class SiteError(Exception):
+    """A site could not be parsed for a reason that says something about the health of its domain."""
+
+
+class SiteUnavailable(SiteError):
+    """The page failed to load or timed out loading. Transient, so the site is retried."""
+
+
+class PriceTimeout(SiteError):
+    """The page loaded but the price XPath never appeared. The domain is up, so neither retried nor counted."""
+
+
+class CircuitOpen(SiteError):
+    """The domain's circuit breaker is open, so the site was skipped."""
+
+
+def backoff_delay(attempt, base=RETRY_BACKOFF):
+    """Seconds to wait before retry number `attempt` (1-based): exponential with up to 50% jitter."""
+    delay = base * 2 ** (attempt - 1)
+    return delay * (1 + random.random() / 2)
+
+
+class DomainHealth:
+    """Learned latency and circuit breaker state of one domain."""
+
+    def __init__(self, state=STATE_CLOSED, failures=0, opened_until=0, latency_p95=None):
+        self.state = state
+        self.failures = failures  # Consecutive failed sites
+        self.opened_until = opened_until  # Unix time the breaker stays open until
+        self.stored_p95 = latency_p95  # p95 loaded from the database, used until enough samples are seen
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.samples = 0  # Latency samples since the last save
+        self.probing = False  # A half-open probe is in flight
+
+    def p95(self):
+        if len(self.latencies) < MIN_SAMPLES:
+            return self.stored_p95
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class Reliability:
+    """
+    Per-domain timeouts, retries and circuit breakers.
+
+    Each domain's page timeout is learned from its recent load latency (p95
+    times `timeout_factor`, within `min_timeout`..`max_timeout`); pages that
+    time out count as taking the whole timeout, so it grows when a domain slows. Transient
+    failures (SiteUnavailable) are retried with exponential backoff. After
+    `threshold` consecutive failed sites the domain's breaker opens and the
+    domain is skipped for `cooldown` seconds; then a single probe either
+    closes the breaker or opens it again. With `persist`, breaker state and the
+    learned p95 are kept in the domain_health table and survive restarts.
+    """
+
+    def __init__(self, persist=True, retries=RETRIES, backoff=RETRY_BACKOFF, threshold=BREAKER_THRESHOLD,
+                 cooldown=BREAKER_COOLDOWN, default_timeout=DEFAULT_TIMEOUT, min_timeout=MIN_TIMEOUT,
+                 max_timeout=MAX_TIMEOUT, timeout_factor=TIMEOUT_FACTOR):
+        self.persist = persist
+        self.retries = retries
+        self.backoff = backoff
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_factor = timeout_factor
+        self._lock = threading.Lock()
+        self._domains = None  # domain -> DomainHealth, loaded from the database on first use
+
+    def _load(self):
+        domains = {}
+        if self.persist:
+            try:
+                for domain, row in get_domain_health().items():
+                    domains[domain] = DomainHealth(row['state'], row['failures'], row['opened_until'], row['latency_p95'])
+            except sqlite3.Error as e:
+                logging.warning(f"Could not load domain health, starting fresh: {e}")
+        return domains
+
+    def _health(self, domain):
+        """Returns the DomainHealth of `domain`; call with self._lock held."""
+        if self._domains is None:
+            self._domains = self._load()
+        health = self._domains.get(domain)
+        if health is None:
+            health = self._domains[domain] = DomainHealth()
+        return health
+
+    def _save(self, domain, health):
+        """Writes one domain's state to the database; call with self._lock held."""
+        if not self.persist:
+            return
+        try:
+            save_domain_health(domain, health.state, health.failures, health.opened_until, health.p95())
+        except sqlite3.Error as e:
+            logging.warning(f"Could not save domain health, keeping it in memory only: {e}")
+            self.persist = False
+
+    def timeout_for(self, domain):
+        """Seconds a page of `domain` may take to load and show its price."""
+        with self._lock:
+            p95 = self._health(domain).p95()
+        if p95 is None:
+            return self.default_timeout
+        return min(self.max_timeout, max(self.min_timeout, p95 * self.timeout_factor))
+
+    def observe_latency(self, domain, seconds):
+        """Records how long a page of `domain` took until its price appeared."""
+        with self._lock:
+            health = self._health(domain)
+            health.latencies.append(seconds)
+            health.samples += 1
+            if health.samples >= PERSIST_EVERY:
+                health.samples = 0
+                self._save(domain, health)
+
+    def observe_timeout(self, domain, seconds):
+        """
+        Records that a page of `domain` was still not done after `seconds`.
+
+        The real latency is unknown but at least that long, so the sample is
+        stored as the domain's full timeout (or `seconds` if longer). That lets
+        the learned timeout grow again once a domain slows down, instead of
+        timing out at the old value forever.
+        """
+        self.observe_latency(domain, max(seconds, self.timeout_for(domain)))
+
+    def allow(self, domain):
+        """Tells whether `domain` may be parsed now. After the cool-down, lets one probe through."""
+        with self._lock:
+            health = self._health(domain)
+            if health.state == STATE_CLOSED:
+                return True
+            if health.state == STATE_OPEN:
+                if time.time() < health.opened_until:
+                    return False
+                health.state = STATE_HALF_OPEN
+                health.probing = False
+                self._save(domain, health)
+            if health.probing:
+                return False
+            health.probing = True
+            return True
+
+    def record_success(self, domain):
+        with self._lock:
+            health = self._health(domain)
+            changed = health.state != STATE_CLOSED or health.failures
+            if health.state != STATE_CLOSED:
+                logging.info(f"Circuit breaker for {domain} closed")
+            health.state = STATE_CLOSED
+            health.failures = 0
+            health.probing = False
+            if changed:
+                self._save(domain, health)
+
+    def record_failure(self, domain):
+        with self._lock:
+            health = self._health(domain)
+            health.failures += 1
+            health.probing = False
+            if health.state == STATE_HALF_OPEN or health.failures >= self.threshold:
+                health.state = STATE_OPEN
+                health.opened_until = time.time() + self.cooldown
+                logging.warning(f"Circuit breaker for {domain} opened after {health.failures} failed sites, "
+                                f"skipping it for {self.cooldown:.0f}s")
+            self._save(domain, health)
+
+    def open_domains(self):
+        """Domains whose breaker is currently open."""
+        now = time.time()
+        with self._lock:
+            if self._domains is None:
+                self._domains = self._load()
+            return sorted(domain for domain, health in self._domains.items()
+                          if health.state == STATE_OPEN and now < health.opened_until)
+
+    def call(self, domain, attempt, deadline_at=None):
+        """
+        Runs `attempt(timeout)` for a site of `domain` under the domain's breaker.
+
+        With `deadline_at` (a time.monotonic() value), every timeout is capped at
+        the time left and a retry is only made if its backoff still leaves
+        `min_timeout` seconds for the attempt; otherwise the last error is raised.
+
+        SiteUnavailable is retried up to `retries` times with exponential backoff
+        and then counts as a failure, as does a CircuitOpen raised by `attempt`.
+        Anything else (a PriceTimeout means the page did load) says nothing about
+        the health of the domain and is passed through as is.
+
+        Returns:
+            The result of `attempt`.
+
+        Raises:
+            CircuitOpen: If the domain's breaker is open.
+            SiteError: The last error once the retries are used up.
+        """
+        if not self.allow(domain):
+            metrics.inc(COUNTER_CIRCUIT_OPEN, domain=domain)
+            raise CircuitOpen(f"Circuit breaker for {domain} is open")
+        retry = 0
+        while True:
+            timeout = self.timeout_for(domain)
+            if deadline_at is not None:
+                timeout = min(timeout, deadline_at - time.monotonic())
+            try:
+                result = attempt(timeout)
+            except SiteUnavailable as e:
+                delay = backoff_delay(retry + 1, self.backoff)
+                out_of_time = deadline_at is not None and time.monotonic() + delay + self.min_timeout > deadline_at
+                if retry >= self.retries or out_of_time:
+                    self.record_failure(domain)
+                    raise
+                retry += 1
+                metrics.inc(COUNTER_RETRIES, domain=domain)
+                logging.info(f"{e}; retry {retry} of {self.retries} in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            except CircuitOpen:
+                self.record_failure(domain)
+                raise
+            except BaseException:
+                with self._lock:
+                    self._health(domain).probing = False  # Let the next site probe instead
+                raise
+            self.record_success(domain)
+            return result
+
+
+_reliability = None
+_reliability_lock = threading.Lock()
+
+
+def get_reliability():
+    """Returns the process-wide reliability layer, creating it on first use."""
+    global _reliability
+    with _reliability_lock:
+        if _reliability is None:
+            _reliability = Reliability()
+        return _reliability
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import os
+import time
+
+from db.database import create_parse_job, delete_parse_job, run_write, take_finished_tasks
+from metrics import COUNTER_CACHE_HITS, COUNTER_FAILURES, COUNTER_SITES, COUNTER_TIMEOUTS, metrics
+from parser.cache import get_cache
+from parser.engine import BATCH_DEADLINE, PER_DOMAIN_LIMIT, domain_of
+
+MODE_LOCAL = "local"  # The bot process parses sites itself
+MODE_DISTRIBUTED = "distributed"  # The bot publishes tasks to the database; worker processes parse them
+PARSER_MODE = os.getenv("PARSER_MODE", MODE_LOCAL).strip().lower()
+
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", "0.5"))  # Seconds between checks for finished tasks
+TASK_LEASE_SECONDS = float(os.getenv("TASK_LEASE_SECONDS", "300"))  # A task whose worker is silent this long is re-leased
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "3"))  # Leases per task before it fails
+TASK_PER_DOMAIN_LIMIT = int(os.getenv("TASK_PER_DOMAIN_LIMIT", str(PER_DOMAIN_LIMIT)))  # Tasks of one domain leased at a time, across all workers
+
+
+def is_distributed():
+    return PARSER_MODE == MODE_DISTRIBUTED
+
+
+def make_tasks(websites_data):
+    return [{'domain': domain_of(website['url']), 'url': website['url'], 'xpath': website['xpath'],
+             'profile': website.get('profile')} for website in websites_data]
+
+
+async def stream_queued_prices(websites_data, deadline=BATCH_DEADLINE, refresh=False, user_id=None):
+    """
+    Distributed counterpart of `parser.parser.stream_average_prices`.
+
+    Prices still fresh in the price cache are yielded first; the remaining sites
+    are published as one parse job and yielded as workers finish them. Sites not
+    finished when `deadline` runs out are yielded as None and withdrawn from the queue.
+
+    Yields:
+        tuple: (website row, average price or None), in completion order.
+    """
+    cache = get_cache()
+    to_parse = []
+    for website in websites_data:
+        cached_price = None if refresh else cache.get(website['url'], website['xpath'])
+        if cached_price is not None:
+            metrics.inc(COUNTER_CACHE_HITS, domain=domain_of(website['url']))
+            yield website, cached_price
+        else:
+            to_parse.append(website)
+    if not to_parse:
+        return
+
+    job_id = await run_write(create_parse_job, make_tasks(to_parse), user_id=user_id)
+    deadline_at = time.monotonic() + deadline
+    finished = set()
+    try:
+        while len(finished) < len(to_parse) and time.monotonic() < deadline_at:
+            for task in await run_write(take_finished_tasks, job_id):
+                website = to_parse[task['position']]
+                domain = domain_of(website['url'])
+                finished.add(task['position'])
+                metrics.inc(COUNTER_SITES, domain=domain)
+                if task['price'] is None:
+                    metrics.inc(COUNTER_FAILURES, domain=domain)
+                cache.put(website['url'], website['xpath'], task['price'])
+                yield website, task['price']
+            if len(finished) < len(to_parse):
+                await asyncio.sleep(TASK_POLL_INTERVAL)
+    finally:
+        await run_write(delete_parse_job, job_id)  # Withdraws the tasks nobody finished
+
+    if len(finished) < len(to_parse):
+        logging.warning(f"Parse job {job_id} reached its deadline of {deadline}s with "
+                        f"{len(to_parse) - len(finished)} sites unfinished")
+    for position, website in enumerate(to_parse):
+        if position not in finished:
+            domain = domain_of(website['url'])
+            metrics.inc(COUNTER_SITES, domain=domain)
+            metrics.inc(COUNTER_TIMEOUTS, domain=domain)
+            metrics.inc(COUNTER_FAILURES, domain=domain)
+            yield website, None
+
+
+def queued_parse_price(url, xpath, profile=None, deadline=BATCH_DEADLINE):
+    """
+    Blocking, distributed counterpart of `parser.parser.parse_price` for the catalog scheduler.
+
+    Publishes a single-site job and waits for a worker to finish it.
+
+    Returns:
+        float: The average price, or None if none was found in time.
+    """
+    job_id = create_parse_job([{'domain': domain_of(url), 'url': url, 'xpath': xpath, 'profile': profile}])
+    deadline_at = time.monotonic() + deadline
+    try:
+        while time.monotonic() < deadline_at:
+            for task in take_finished_tasks(job_id):
+                if task['error']:
+                    logging.info(f"Worker could not parse {url}: {task['error']}")
+                return task['price']
+            time.sleep(TASK_POLL_INTERVAL)
+        logging.warning(f"No worker parsed {url} within {deadline}s")
+        return None
+    finally:
+        delete_parse_job(job_id)
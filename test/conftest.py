@@ -0,0 +1,14 @@
+import pytest
+
+from db import database
+from db.database import init_db
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Points the storage layer at a fresh database file."""
+    path = str(tmp_path / "zuzu_bot.db")
+    monkeypatch.setattr(database, "DATABASE_NAME", path)
+    init_db()
+    yield path
+    database.close_connections()
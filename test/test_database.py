@@ -0,0 +1,203 @@
+import asyncio
+import datetime
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from db import database
+from db.database import (asave_website_data, complete_parse_task, count_parse_tasks, count_websites,
+                         create_parse_job, delete_parse_job, get_all_websites, get_connection, get_daily_prices,
+                         get_price_history, get_subscribers, get_subscriptions, get_websites, init_db,
+                         lease_parse_tasks, record_prices, save_website_data, subscribe, take_finished_tasks,
+                         transaction, unsubscribe)
+
+
+def make_rows(count, prefix="Site"):
+    return [{'title': f"{prefix} {i}", 'url': f"https://example.com/{prefix}/{i}", 'xpath': '//span'}
+            for i in range(count)]
+
+
+def test_connection_is_reused_and_uses_wal(db_path):
+    conn = get_connection()
+    assert get_connection() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(get_connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn  # Each thread gets its own connection
+
+
+def test_connection_is_reopened_after_close(db_path):
+    init_db()
+    database.close_connections()
+    assert count_websites() == 0  # Not the closed handle cached for this thread
+
+
+def test_transaction_rolls_back_on_error(db_path):
+    with pytest.raises(RuntimeError):
+        with transaction() as conn:
+            conn.execute("INSERT INTO websites (title, url, xpath) VALUES ('a', 'b', 'c')")
+            raise RuntimeError("boom")
+    assert get_all_websites() == []
+
+
+def test_save_uses_explicit_connection(db_path):
+    conn = sqlite3.connect(db_path)
+    save_website_data(make_rows(2), conn)
+    assert len(get_all_websites(conn)) == 2
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_async_saves_from_many_uploads(db_path):
+    await asyncio.gather(*(asave_website_data(make_rows(50, f"Upload {n}")) for n in range(20)))
+    assert len(get_all_websites()) == 1000
+
+
+def test_upsert_deduplicates_on_normalized_url_and_xpath(db_path):
+    first = save_website_data([{'title': 'Old', 'url': 'https://Shop.example/item?utm_source=x', 'xpath': '//b'}],
+                              user_id=1)
+    second = save_website_data([
+        {'title': 'New', 'url': 'https://shop.example/item', 'xpath': ' //b '},
+        {'title': 'Other', 'url': 'https://shop.example/other', 'xpath': '//b'},
+    ], user_id=2)
+
+    assert second[0] == first[0]
+    websites = get_websites()
+    assert [(w['title'], w['user_id']) for w in websites] == [('New', 2), ('Other', 2)]
+
+
+def test_hash_routes_are_separate_sites(db_path):
+    ids = save_website_data([{'title': 'One', 'url': 'https://spa.example/#/item/1', 'xpath': '//b'},
+                             {'title': 'Two', 'url': 'https://spa.example/#!/item/2', 'xpath': '//b'},
+                             {'title': 'Anchor', 'url': 'https://spa.example/#reviews', 'xpath': '//b'},
+                             {'title': 'Plain', 'url': 'https://spa.example/', 'xpath': '//b'}])
+    assert ids[0] != ids[1] and ids[2] == ids[3] and ids[2] not in ids[:2]
+
+
+def test_migration_rekeys_hash_routes(db_path):
+    (website_id,) = save_website_data([{'title': 'SPA', 'url': 'https://spa.example/#/item/1', 'xpath': '//b'}])
+    with transaction() as conn:  # As keyed before hash routes were kept
+        conn.execute("UPDATE websites SET url_norm = 'https://spa.example/' WHERE id = ?", (website_id,))
+        conn.execute(f"PRAGMA user_version = {len(database.MIGRATIONS) - 1}")
+    init_db()
+    assert save_website_data([{'title': 'SPA', 'url': 'https://spa.example/#/item/1', 'xpath': '//b'}]) == [website_id]
+
+
+def test_load_profile_is_stored_and_kept_on_reupload(db_path):
+    save_website_data([{'title': 'Lean', 'url': 'https://shop.example/a', 'xpath': '//b', 'profile': 'lean'},
+                       {'title': 'Default', 'url': 'https://shop.example/b', 'xpath': '//b'}])
+    save_website_data([{'title': 'Lean again', 'url': 'https://shop.example/a', 'xpath': '//b'}])
+
+    assert [(w['title'], w['profile']) for w in get_websites()] == [('Lean again', 'lean'), ('Default', None)]
+
+
+def test_get_websites_paginates_and_filters(db_path):
+    save_website_data(make_rows(5), user_id=1)
+    save_website_data([{'title': f"Mine {i}", 'url': f"https://mine.example/{i}", 'xpath': '//span'}
+                       for i in range(3)], user_id=2)
+
+    page = get_websites(limit=4)
+    assert len(page) == 4
+    rest = get_websites(after_id=page[-1]['id'], limit=4)
+    assert len(rest) == 4
+    assert count_websites() == 8
+    assert count_websites(user_id=2) == 3
+    assert [w['title'] for w in get_websites(user_id=2, search="Mine 1")] == ["Mine 1"]
+
+
+def test_migration_collapses_existing_duplicates(tmp_path, monkeypatch):
+    path = str(tmp_path / "legacy.db")
+    monkeypatch.setattr(database, "DATABASE_NAME", path)
+    legacy = sqlite3.connect(path)  # Schema and data as written by the append-only version
+    legacy.execute("CREATE TABLE websites (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, url TEXT, xpath TEXT)")
+    legacy.executemany("INSERT INTO websites (title, url, xpath) VALUES (?, ?, ?)", [
+        ('Shop', 'https://shop.example/item', '//b'),
+        ('Other', 'https://other.example/', '//i'),
+        ('Shop renamed', 'https://shop.example/item#top', '//b'),
+    ])
+    legacy.commit()
+    legacy.close()
+
+    init_db()
+    websites = get_websites()
+    database.close_connections()
+
+    assert [(w['id'], w['title']) for w in websites] == [(1, 'Shop renamed'), (2, 'Other')]
+
+
+def test_price_history_and_daily_rollups(db_path):
+    (website_id,) = save_website_data(make_rows(1))
+    day_start = (int(time.time()) // 86400) * 86400
+
+    assert record_prices([(website_id, 100.0)], observed_at=day_start + 10) == 1
+    assert record_prices([(website_id, 300.0), (website_id, None)], observed_at=day_start + 20) == 1
+    record_prices([(website_id, 999.0)], observed_at=day_start + 20)  # Same second: ignored, not double counted
+    record_prices([(website_id, 50.0)], observed_at=day_start - 10)  # Previous day
+
+    assert get_price_history(website_id, since=day_start) == [(day_start + 10, 100.0), (day_start + 20, 300.0)]
+    daily = get_daily_prices(website_id, days=2)
+    assert [(d['min'], d['max'], d['avg'], d['count']) for d in daily] == [(50.0, 50.0, 50.0, 1),
+                                                                            (100.0, 300.0, 200.0, 2)]
+    assert daily[1]['day'] == datetime.datetime.fromtimestamp(day_start, datetime.timezone.utc).date()
+
+
+def test_subscriptions(db_path):
+    ids = save_website_data(make_rows(3))
+    subscribe(1, ids[:2])
+    subscribe(2, ids[1:])
+    subscribe(1, ids[:1])  # Subscribing twice is harmless
+
+    assert [w['id'] for w in get_subscriptions(1)] == ids[:2]
+    assert get_subscribers(ids) == {ids[0]: [1], ids[1]: [1, 2], ids[2]: [2]}
+
+    unsubscribe(1, ids[:1])
+    assert [w['id'] for w in get_subscriptions(1)] == ids[1:2]
+    unsubscribe(2)
+    assert get_subscriptions(2) == []
+
+
+def make_tasks(domains):
+    return [{'domain': domain, 'url': f"https://{domain}/{i}", 'xpath': '//b'} for i, domain in enumerate(domains)]
+
+
+def test_parse_task_leasing_limits_domains(db_path):
+    job_id = create_parse_job(make_tasks(["a.example"] * 3 + ["b.example"]))
+
+    leased = lease_parse_tasks("w1", limit=10, per_domain_limit=2)
+    assert [task['url'] for task in leased] == ["https://a.example/0", "https://a.example/1", "https://b.example/3"]
+    assert lease_parse_tasks("w2", limit=10, per_domain_limit=2) == []  # a.example is at its limit
+
+    assert complete_parse_task(leased[0]['id'], "w1", 10.0)
+    assert not complete_parse_task(leased[1]['id'], "w2", 20.0)  # Not w2's lease
+    assert [task['url'] for task in lease_parse_tasks("w2", limit=10, per_domain_limit=2)] == ["https://a.example/2"]
+    assert count_parse_tasks() == {'done': 1, 'leased': 3}
+
+    assert take_finished_tasks(job_id) == [{'position': 0, 'price': 10.0, 'error': None}]
+    assert take_finished_tasks(job_id) == []
+    delete_parse_job(job_id)
+    assert count_parse_tasks() == {}  # Unfinished tasks go with their job
+
+
+def test_parse_task_leasing_skips_saturated_domains(db_path):
+    create_parse_job(make_tasks(["a.example"] * 5 + ["b.example", "c.example"]))
+
+    leased = lease_parse_tasks("w1", limit=2, per_domain_limit=1)
+    assert [task['url'] for task in leased] == ["https://a.example/0", "https://b.example/5"]
+    assert [task['url'] for task in lease_parse_tasks("w2", limit=2, per_domain_limit=1)] == ["https://c.example/6"]
+
+
+def test_expired_parse_task_lease_is_retried_then_failed(db_path):
+    job_id = create_parse_job(make_tasks(["a.example"]))
+
+    (first,) = lease_parse_tasks("crashed", lease_seconds=-1)  # A worker that died right away
+    (second,) = lease_parse_tasks("w2", lease_seconds=-1)
+    assert second['id'] == first['id'] and second['attempts'] == 2
+    assert not complete_parse_task(first['id'], "crashed", 1.0)  # The stale worker lost its lease
+
+    assert lease_parse_tasks("w3", max_attempts=2) == []
+    assert take_finished_tasks(job_id) == [{'position': 0, 'price': None, 'error': 'worker lost'}]
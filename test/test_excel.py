@@ -1,18 +1,28 @@
+import asyncio
 import pytest
 import pandas as pd
 from io import BytesIO
 import os
 import sqlite3
+import time
+import tracemalloc
 from unittest.mock import AsyncMock
 
-from bot.handlers.basic import handle_document
-from db.database import save_website_data, get_all_websites, init_db, DATABASE_NAME
+from bot.handlers.basic import handle_document, run_parse_job
+from bot.ingest import CHUNK_SIZE, PREVIEW_ROWS, SheetIngestion
+from bot.jobs import JobQueue
+from bot.progress import ProgressMessage
+from parser import parser
+from db import database
+from db.database import save_website_data, get_all_websites, init_db
 
 # Fixture for the database
 @pytest.fixture
-def test_db():
-    """Creates an in-memory database for testing."""
-    conn = sqlite3.connect(DATABASE_NAME)  # Use the actual name for consistency
+def test_db(tmp_path, monkeypatch):
+    """Creates a scratch database for testing and points the storage layer at it."""
+    path = str(tmp_path / "zuzu_bot.db")
+    monkeypatch.setattr(database, "DATABASE_NAME", path)
+    conn = sqlite3.connect(path)
     init_db(conn)  # Initialize the schema
 
     # --- Pre-populate with some data for other tests ---
@@ -25,8 +35,7 @@ def test_db():
     yield conn  # Provide the connection to the tests
 
     conn.close()
-    if os.path.exists(DATABASE_NAME): # added cleanup
-        os.remove(DATABASE_NAME)
+    database.close_connections()
 
 
 @pytest.fixture
@@ -34,6 +43,8 @@ def mock_message():
     """Creates a mock message object."""
     mock = AsyncMock()
     mock.document = AsyncMock()  # Ensure document is also a mock
+    mock.caption = None
+    mock.from_user.id = 42
     return mock
 
 @pytest.fixture
@@ -65,8 +76,7 @@ async def test_handle_document_success(mock_message, mock_bot, test_db):
     mock_bot.get_file.return_value.file_path = "test_file_path"
 
     async def download_side_effect(file_path, destination):
-        with open(destination, 'wb') as f:
-            f.write(excel_file.read())  # Read from the BytesIO object
+        destination.write(excel_file.read())  # The file is downloaded into memory
 
     mock_bot.download_file.side_effect = download_side_effect
 
@@ -98,8 +108,7 @@ async def test_handle_document_missing_column(mock_message, mock_bot, test_db):
     mock_bot.get_file.return_value.file_path = "test_file_path"
 
     async def download_side_effect(file_path, destination):
-        with open(destination, 'wb') as f:
-            f.write(excel_file.read())
+        destination.write(excel_file.read())
     mock_bot.download_file.side_effect = download_side_effect
 
      # Clear the database before this specific test
@@ -121,7 +130,7 @@ async def test_handle_document_invalid_file(mock_message, mock_bot, test_db):
 
     await handle_document(mock_message, mock_bot, test_db)
 
-    mock_message.answer.assert_called_with("Пожалуйста, отправьте файл в формате Excel (.xls, .xlsx).")
+    mock_message.answer.assert_called_with("Пожалуйста, отправьте файл в формате Excel (.xls, .xlsx) или CSV (.csv).")
 
 
 @pytest.mark.asyncio
@@ -150,8 +159,7 @@ async def test_handle_document_empty_excel(mock_message, mock_bot, test_db):
     mock_bot.get_file.return_value.file_path = "empty_file_path"
 
     async def download_side_effect(file_path, destination):
-        with open(destination, 'wb') as f:
-            f.write(excel_file.read())
+        destination.write(excel_file.read())
     mock_bot.download_file.side_effect = download_side_effect
 
     # Clear the database before this specific test
@@ -166,4 +174,280 @@ async def test_handle_document_empty_excel(mock_message, mock_bot, test_db):
     assert not os.path.exists("data/temp_file.xlsx")
 
     websites = get_all_websites(test_db)
-    assert len(websites) == 0, "Database should be empty for an empty Excel file."
\ No newline at end of file
+    assert len(websites) == 0, "Database should be empty for an empty Excel file."
+
+@pytest.mark.asyncio
+async def test_handle_document_enqueues_parse_job(mock_message, mock_bot, test_db, monkeypatch):
+    """Parsing runs as a background job and does not block the event loop."""
+
+    def slow_iter_average_prices(websites_data, pool=None, deadline=None, refresh=False):
+        for website in websites_data:
+            time.sleep(0.5)  # Simulates blocking Selenium work
+            yield website, 100.0
+
+    monkeypatch.setattr(parser, "iter_average_prices", slow_iter_average_prices)
+
+    df = pd.DataFrame({'title': ['Test Site 5'], 'url': ['https://example.com/5'], 'xpath': ['//span']})
+    excel_file = BytesIO()
+    df.to_excel(excel_file, index=False)
+    excel_file.seek(0)
+
+    mock_message.document.file_name = "test_file.xlsx"
+    mock_message.document.file_id = "test_file_id"
+    mock_bot.get_file.return_value.file_path = "test_file_path"
+
+    async def download_side_effect(file_path, destination):
+        destination.write(excel_file.read())
+    mock_bot.download_file.side_effect = download_side_effect
+
+    jobs = JobQueue(workers=1)
+    await jobs.start()
+    try:
+        await handle_document(mock_message, mock_bot, test_db, jobs)
+        answers = [call.args[0] for call in mock_message.answer.call_args_list]
+        assert not any("Средние цены" in text for text in answers)
+
+        # The loop keeps serving other work while the job is running
+        start = time.perf_counter()
+        await asyncio.sleep(0.05)
+        assert time.perf_counter() - start < 0.3
+
+        await asyncio.wait_for(jobs._queue.join(), timeout=5)
+    finally:
+        await jobs.stop()
+
+    progress_message = mock_message.answer.return_value
+    assert "<b>Test Site 5</b>: 100.00" in progress_message.edit_text.call_args[0][0]
+    assert test_db.execute("SELECT price FROM price_history").fetchall() == [(100.0,)]
+
+
+@pytest.mark.asyncio
+async def test_parse_job_links_prices_by_id_not_title(mock_message, test_db, monkeypatch):
+    """Two products of one shop with the same title keep separate price histories."""
+    test_db.execute("DELETE FROM websites")
+    rows = [{'title': 'shop.example', 'url': f'https://shop.example/{n}', 'xpath': '//b'} for n in (1, 2)]
+    for row, website_id in zip(rows, save_website_data(rows, test_db)):
+        row['id'] = website_id
+
+    async def stream(websites_data, refresh=False):
+        for website in websites_data:
+            yield website, float(website['url'][-1]) * 10
+
+    monkeypatch.setattr("bot.handlers.basic.stream_average_prices", stream)
+    await run_parse_job(mock_message, rows, conn=test_db)
+
+    history = test_db.execute("SELECT website_id, price FROM price_history ORDER BY website_id").fetchall()
+    assert history == [(rows[0]['id'], 10.0), (rows[1]['id'], 20.0)]
+
+
+@pytest.mark.asyncio
+async def test_parse_job_records_prices_when_reply_fails(mock_message, test_db, monkeypatch):
+    test_db.execute("DELETE FROM websites")
+    rows = [{'title': f"Site {n} of a long sheet", 'url': f'https://shop.example/{n}', 'xpath': '//b'} for n in range(200)]
+    for row, website_id in zip(rows, save_website_data(rows, test_db)):
+        row['id'] = website_id
+
+    async def stream(websites_data, refresh=False):
+        for website in websites_data:
+            yield website, 10.0
+
+    monkeypatch.setattr("bot.handlers.basic.stream_average_prices", stream)
+    mock_message.answer.return_value.answer.side_effect = RuntimeError("Telegram is down")  # Follow-up chunks fail
+    await run_parse_job(mock_message, rows, conn=test_db)
+
+    assert test_db.execute("SELECT COUNT(*) FROM price_history").fetchone()[0] == 200
+
+
+@pytest.mark.asyncio
+async def test_handle_document_csv_with_invalid_rows(mock_message, mock_bot, test_db):
+    """CSV uploads are accepted; invalid rows are skipped and reported, blank rows ignored."""
+    test_db.execute("DELETE FROM websites")
+    test_db.commit()
+    csv_file = BytesIO("title;url;xpath\n"
+                       "Shop A;shop-a.example/item;//span\n"
+                       ";;\n"
+                       "Shop B;not a url;//span\n"
+                       "Shop C;https://shop-c.example/item;\n".encode("utf-8-sig"))
+
+    mock_message.document.file_name = "sites.csv"
+    mock_message.document.file_id = "csv_file_id"
+
+    async def download_side_effect(file_path, destination):
+        destination.write(csv_file.read())
+    mock_bot.download_file.side_effect = download_side_effect
+
+    async def stream_nothing(websites_data, refresh=False):
+        return
+        yield
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr("bot.handlers.basic.stream_average_prices", stream_nothing)
+        await handle_document(mock_message, mock_bot, test_db)
+
+    websites = get_all_websites(test_db)
+    assert [(w['title'], w['url']) for w in websites] == [('Shop A', 'https://shop-a.example/item')]
+    answers = [call.args[0] for call in mock_message.answer.call_args_list]
+    saved = next(text for text in answers if text.startswith("Данные сохранены"))
+    assert "Пропущено некорректных строк: 2" in saved
+    assert "пустой XPath" in saved
+
+
+def test_ingestion_reads_optional_profile_column():
+    csv_file = BytesIO("title,url,xpath,profile,notes\n"
+                       "A,https://a.example,//b,Lean,x\n"
+                       "B,https://b.example,//b,,y\n"
+                       "C,https://c.example,//b,turbo,z\n".encode())
+    ingestion = SheetIngestion(csv_file, "sites.csv")
+    assert ingestion.read_header() == ['title', 'url', 'xpath', 'profile']
+    chunk = ingestion.next_chunk()
+    assert [(w['title'], w.get('profile')) for w in chunk] == [('A', 'lean'), ('B', None)]
+    assert "неизвестный профиль «turbo»" in ingestion.errors[0]
+
+
+def test_ingestion_errors_escape_cell_values():
+    """Error descriptions are sent as HTML, so quoted cells must not break the markup."""
+    csv_file = BytesIO(("title,url,xpath,profile\n"
+                        "A,<b>bad & url</b>,//b,\n"
+                        "B,https://b.example,//b,<i>\n"
+                        f"C,{'x ' * 500},//b,\n").encode())
+    ingestion = SheetIngestion(csv_file, "sites.csv")
+    ingestion.read_header()
+    assert ingestion.next_chunk() is None
+    assert "«&lt;b&gt;bad &amp; url&lt;/b&gt;»" in ingestion.errors[0]
+    assert "«&lt;i&gt;»" in ingestion.errors[1]
+    assert len(ingestion.errors[2]) < 150  # Long cells are shortened
+
+
+def test_ingestion_preview_is_bounded():
+    """A large sheet is read in chunks of CHUNK_SIZE with a preview of only PREVIEW_ROWS rows."""
+    rows = CHUNK_SIZE * 2 + 5
+    df = pd.DataFrame({'title': [f"Site {i}" for i in range(rows)],
+                       'url': [f"https://example.com/{i}" for i in range(rows)],
+                       'xpath': ['//span'] * rows})
+    excel_file = BytesIO()
+    df.to_excel(excel_file, index=False)
+    excel_file.seek(0)
+
+    ingestion = SheetIngestion(excel_file, "big.xlsx")
+    assert ingestion.read_header() == ['title', 'url', 'xpath']
+    sizes = []
+    while (chunk := ingestion.next_chunk()) is not None:
+        sizes.append(len(chunk))
+    assert sizes == [CHUNK_SIZE, CHUNK_SIZE, 5]
+    assert ingestion.valid_rows == rows
+    assert len(ingestion.preview) == PREVIEW_ROWS
+
+
+def test_ingestion_memory_does_not_grow_with_rows():
+    """Reading a 100k-row CSV only holds one chunk at a time."""
+    def make_csv(rows):
+        lines = ["title,url,xpath"] + [f"Site {i},https://example.com/{i},//span[@class='p']" for i in range(rows)]
+        return BytesIO("\n".join(lines).encode())
+
+    def peak_memory(buffer):
+        ingestion = SheetIngestion(buffer, "sites.csv")
+        ingestion.read_header()
+        tracemalloc.start()
+        while ingestion.next_chunk() is not None:
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak, ingestion.valid_rows
+
+    small_peak, _ = peak_memory(make_csv(10_000))
+    large_peak, large_rows = peak_memory(make_csv(100_000))
+    assert large_rows == 100_000
+    assert large_peak < small_peak * 2
+
+
+@pytest.mark.asyncio
+async def test_progress_message_throttles_edits():
+    """Results arriving faster than the edit interval are folded into one edit."""
+    progress_message = AsyncMock()
+    progress = ProgressMessage(progress_message, total=3, interval=0.2)
+
+    await progress.add("Site A", 10.0)
+    await progress.add("Site B", None)
+    await progress.add("Site C", 30.5)
+    assert progress_message.edit_text.call_count == 1  # Only the first result is shown right away
+
+    await asyncio.sleep(0.3)
+    assert progress_message.edit_text.call_count == 2
+    assert "3/3" in progress_message.edit_text.call_args[0][0]
+
+    await progress.finish()
+    final_text = progress_message.edit_text.call_args[0][0]
+    assert final_text.startswith("Средние цены по сайтам:")
+    assert "<b>Site B</b>: Цена не найдена" in final_text
+    assert "<b>Site C</b>: 30.50" in final_text
+
+
+@pytest.mark.asyncio
+async def test_progress_edit_in_flight_does_not_overwrite_result():
+    """A slow progress edit is cancelled by finish() and never lands after the final result."""
+    edits = []
+
+    async def edit_text(text, **kwargs):
+        if text.startswith("Парсинг"):
+            await asyncio.sleep(0.2)  # Slow request (or a rate-limit wait)
+        edits.append(text)
+
+    progress_message = AsyncMock()
+    progress_message.edit_text.side_effect = edit_text
+    progress = ProgressMessage(progress_message, total=3, interval=0.01)
+
+    await progress.add("Site A", 10.0)  # Edits right away
+    await progress.add("Site B", 20.0)  # Scheduled
+    await asyncio.sleep(0.05)  # The scheduled edit is now in flight
+    await progress.add("Site C", 30.0)  # Must not start an overlapping edit
+    await progress.finish()
+    await asyncio.sleep(0.3)
+
+    assert len(edits) == 2 and edits[-1].startswith("Средние цены по сайтам:")
+
+
+@pytest.mark.asyncio
+async def test_progress_follow_up_chunks_wait_out_rate_limits(monkeypatch):
+    from aiogram.exceptions import TelegramRetryAfter
+    from aiogram.methods import SendMessage
+
+    sent, waits = [], []
+
+    async def answer(text, **kwargs):
+        if len(sent) == 1 and not waits:
+            raise TelegramRetryAfter(SendMessage(chat_id=1, text=text), "Too Many Requests", retry_after=3)
+        sent.append(text)
+
+    async def fake_sleep(seconds):
+        waits.append(seconds)
+
+    progress_message = AsyncMock()
+    progress_message.answer.side_effect = answer
+    progress = ProgressMessage(progress_message, total=300, interval=3600)
+    progress.lines = [f"<b>Site {n}</b>: 10.00" for n in range(600)]  # Several messages long
+    monkeypatch.setattr("bot.progress.asyncio.sleep", fake_sleep)
+    await progress.finish()
+
+    assert waits == [3]
+    assert "".join(sent).count("<b>Site") + progress_message.edit_text.call_args[0][0].count("<b>Site") == 600
+
+
+def test_site_lookups_never_match_other_users_uploads(test_db):
+    from bot.handlers.history import lookup_history
+    from bot.handlers.subscriptions import find_sites
+
+    save_website_data([{'title': 'Private Shop', 'url': 'https://private.example/1', 'xpath': '//b'}], test_db, user_id=7)
+    assert find_sites(42, "Private") == []
+    assert lookup_history(42, "Private", 30) == []
+    assert [website['title'] for website in find_sites(7, "Private")] == ['Private Shop']
+
+
+def test_site_stays_visible_to_earlier_uploaders(test_db):
+    from bot.handlers.history import lookup_history
+    from bot.handlers.subscriptions import find_sites
+
+    row = [{'title': 'Shop', 'url': 'https://a.example/p', 'xpath': '//b'}]
+    save_website_data(row, test_db, user_id=1)
+    save_website_data(row, test_db, user_id=2)  # The same site uploaded again by someone else
+    for user_id in (1, 2):
+        assert [website['title'] for website in find_sites(user_id, "Shop")] == ['Shop']
+        assert [website['title'] for website, _ in lookup_history(user_id, "Shop", 30)] == ['Shop']
@@ -0,0 +1,127 @@
+import threading
+
+import aiohttp
+import pytest
+from unittest.mock import AsyncMock
+
+from bot.handlers import admin
+from metrics import COUNTER_FAILURES, COUNTER_SITES, COUNTER_TIMEOUTS, Metrics, MetricsServer
+from parser import parser
+
+
+def test_timer_and_counters():
+    registry = Metrics(window=10, max_label_values=2)
+    for seconds in (0.1, 0.2, 0.3, 0.4):
+        registry.observe("page_load", seconds)
+    with pytest.raises(ValueError):
+        with registry.timer("download"):
+            raise ValueError  # Failed stages are timed too
+
+    registry.inc(COUNTER_FAILURES, domain="a.example")
+    registry.inc(COUNTER_FAILURES, domain="a.example")
+    registry.inc(COUNTER_FAILURES, domain="b.example")
+    registry.inc(COUNTER_FAILURES, domain="c.example")  # Over the label limit
+
+    snapshot = registry.snapshot()
+    assert snapshot['stages']['page_load']['count'] == 4
+    assert snapshot['stages']['page_load']['p50'] == 0.3
+    assert snapshot['stages']['page_load']['max'] == 0.4
+    assert snapshot['stages']['download']['count'] == 1
+    assert registry.counter(COUNTER_FAILURES, domain="a.example") == 2
+    assert registry.counter(COUNTER_FAILURES, domain="other") == 1
+
+
+def test_render_prometheus():
+    registry = Metrics()
+    registry.observe("page_load", 0.5)
+    registry.inc(COUNTER_TIMEOUTS, domain='shop"s.example')
+    registry.register_gauge("job_queue_depth", lambda: 3)
+    registry.register_gauge("broken", lambda: 1 / 0)  # Skipped, does not break the endpoint
+
+    text = registry.render_prometheus()
+    assert 'zuzu_stage_seconds{stage="page_load",quantile="0.95"} 0.500000' in text
+    assert 'zuzu_stage_seconds_count{stage="page_load"} 1' in text
+    assert 'zuzu_parse_timeouts_total{domain="shop\\"s.example"} 1' in text
+    assert "zuzu_job_queue_depth 3" in text
+    assert "broken" not in text
+
+
+def test_parse_results_are_counted_per_domain(monkeypatch):
+    registry = Metrics()
+    monkeypatch.setattr(parser, "metrics", registry)
+    monkeypatch.setattr(parser, "parse_price", lambda url, xpath, pool, deadline_at: None if "bad" in url else 10.0)
+    monkeypatch.setattr(parser, "_engine", None)
+    sites = [{'title': 'Good', 'url': 'https://good.example/1', 'xpath': '//b'},
+             {'title': 'Bad', 'url': 'https://bad.example/1', 'xpath': '//b'}]
+    try:
+        list(parser.iter_average_prices(sites, refresh=True))
+    finally:
+        parser.shutdown_engine()
+
+    assert registry.counter(COUNTER_SITES, domain="good.example") == 1
+    assert registry.counter(COUNTER_FAILURES, domain="bad.example") == 1
+    assert registry.counter(COUNTER_FAILURES, domain="good.example") == 0
+    assert registry.snapshot()['stages']['site']['count'] == 2
+
+
+@pytest.mark.asyncio
+async def test_stats_command_is_admin_only(monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_IDS", {1})
+    message = AsyncMock()
+    message.from_user.id = 2
+    await admin.command_stats_handler(message)
+    assert "только администраторам" in message.answer.call_args[0][0]
+
+    message.from_user.id = 1
+    await admin.command_stats_handler(message)
+    assert message.answer.call_args[0][0].startswith("<b>Этапы</b>")
+
+
+@pytest.mark.asyncio
+async def test_gauges_are_read_off_the_event_loop(monkeypatch, unused_tcp_port):
+    registry = Metrics()
+    threads = []
+    registry.register_gauge("tasks_pending", lambda: threads.append(threading.current_thread()) or 3)
+    monkeypatch.setattr(admin, "metrics", registry)
+    monkeypatch.setattr(admin, "ADMIN_IDS", {1})
+    message = AsyncMock()
+    message.from_user.id = 1
+    await admin.command_stats_handler(message)
+    assert "tasks_pending: 3" in message.answer.call_args[0][0]
+
+    server = MetricsServer(port=unused_tcp_port, registry=registry)
+    await server.start()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{unused_tcp_port}/metrics") as response:
+                assert "zuzu_tasks_pending 3" in await response.text()
+    finally:
+        await server.stop()
+    assert len(threads) == 2 and threading.current_thread() not in threads
+
+
+def test_format_stats_lists_failing_domains():
+    registry = Metrics()
+    registry.observe("download", 0.25)
+    registry.inc(COUNTER_SITES, domain="slow.example", value=4)
+    registry.inc(COUNTER_FAILURES, domain="slow.example", value=3)
+    registry.inc(COUNTER_TIMEOUTS, domain="slow.example", value=2)
+
+    text = admin.format_stats(registry.snapshot())
+    assert "download: 0.25 / 0.25 / 0.25; 1" in text
+    assert "slow.example: 3 / 2 / 4" in text
+
+
+@pytest.mark.asyncio
+async def test_metrics_server_serves_prometheus_text(unused_tcp_port):
+    registry = Metrics()
+    registry.observe("reply", 0.1)
+    server = MetricsServer(port=unused_tcp_port, registry=registry)
+    await server.start()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{unused_tcp_port}/metrics") as response:
+                assert response.status == 200
+                assert 'zuzu_stage_seconds_count{stage="reply"} 1' in await response.text()
+    finally:
+        await server.stop()
@@ -0,0 +1,665 @@
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+from selenium.common.exceptions import NoSuchElementException
+
+from parser import parser
+from parser.cache import PriceCache, normalize_key
+from parser.engine import ParseEngine, domain_of
+from parser.dom import FIELD_AVAILABILITY, FIELD_PRICE, FIELD_TITLE
+from parser.fetch import TIER_HTTP, TIER_SELENIUM, TierMemory, extract_static_fields, extract_static_texts
+from parser.profiles import (PROFILE_FULL, PROFILE_LEAN, TRANSFER_SIZE_SCRIPT, ProfileStats, blocked_url_patterns,
+                             normalize_profile, unblocked_page, url_matches)
+from parser.prices import clean_prices, parse_price_text, price_stats
+from parser.reliability import (STATE_CLOSED, STATE_OPEN, CircuitOpen, PriceTimeout, Reliability, SiteUnavailable,
+                                backoff_delay)
+
+
+@pytest.fixture(autouse=True)
+def reliability(monkeypatch):
+    """An in-memory reliability layer without retry delays, so tests never touch the bot's database."""
+    layer = Reliability(persist=False, backoff=0)
+    monkeypatch.setattr(parser, "get_reliability", lambda: layer)
+    return layer
+
+
+def make_sites(count, domain="shop.example"):
+    return [{'title': f"Site {i}", 'url': f"https://{domain}/{i}", 'xpath': '//span'} for i in range(count)]
+
+
+@pytest.fixture
+def tracking_parse():
+    """A fake parse function that records the peak number of concurrent calls per domain."""
+    lock = threading.Lock()
+    state = {'active': {}, 'peak': {}}
+
+    def parse(url, xpath, pool, deadline_at=None):
+        domain = domain_of(url)
+        with lock:
+            state['active'][domain] = state['active'].get(domain, 0) + 1
+            state['peak'][domain] = max(state['peak'].get(domain, 0), state['active'][domain])
+        time.sleep(0.05)
+        with lock:
+            state['active'][domain] -= 1
+        return float(url.rsplit('/', 1)[1])
+
+    parse.state = state
+    return parse
+
+
+def test_domain_of():
+    assert domain_of("https://WWW.Citilink.ru/catalog/") == "citilink.ru"
+    assert domain_of("not a url") == ""
+
+
+def test_engine_respects_per_domain_limit(tracking_parse):
+    engine = ParseEngine(tracking_parse, max_workers=4, per_domain_limit=2)
+    sites = make_sites(6, "a.example") + make_sites(6, "b.example")
+
+    results = list(engine.iter_results(sites, deadline=10))
+    engine.shutdown()
+
+    assert len(results) == 12
+    assert tracking_parse.state['peak']['a.example'] <= 2
+    assert tracking_parse.state['peak']['b.example'] <= 2
+    assert sorted(r.price for r in results if r.website['url'].startswith("https://a.")) == [0, 1, 2, 3, 4, 5]
+
+
+def test_engine_returns_partial_results_on_deadline():
+    def parse(url, xpath, pool, deadline_at=None):
+        if url.endswith("/slow"):
+            time.sleep(1)
+        return 1.0
+
+    engine = ParseEngine(parse, max_workers=2, per_domain_limit=2)
+    sites = [
+        {'title': 'Fast', 'url': 'https://fast.example/', 'xpath': '//span'},
+        {'title': 'Slow', 'url': 'https://slow.example/slow', 'xpath': '//span'},
+    ]
+
+    start = time.monotonic()
+    results = {r.title: r for r in engine.iter_results(sites, deadline=0.3)}
+    engine.shutdown()
+
+    assert time.monotonic() - start < 0.9
+    assert results['Fast'].price == 1.0
+    assert results['Slow'].price is None
+    assert results['Slow'].error == "deadline"
+
+
+def test_engine_reports_parse_errors():
+    def parse(url, xpath, pool, deadline_at=None):
+        raise RuntimeError("browser crashed")
+
+    engine = ParseEngine(parse, max_workers=1)
+    (result,) = engine.iter_results(make_sites(1), deadline=5)
+    engine.shutdown()
+
+    assert result.price is None
+    assert result.error == "browser crashed"
+
+
+def test_extract_static_texts():
+    page = b"<html><body><span class='price'>1 299 \xe2\x82\xbd</span><span class='price'>999</span></body></html>"
+    assert extract_static_texts(page, "//span[@class='price']") == ["1 299 ₽", "999"]
+    assert extract_static_texts(page, "//div[@class='price']") == []
+    assert extract_static_texts(page, "//span[") == []  # Invalid XPath
+
+
+def test_extract_static_fields_parses_once():
+    page = b"<div><h1>Widget</h1><b>100</b><b>200</b><i>In stock</i></div>"
+    fields = extract_static_fields(page, {'price': "//b", 'title': "//h1", 'availability': "//i", 'bad': "//["})
+    assert fields == {'price': ["100", "200"], 'title': ["Widget"], 'availability': ["In stock"], 'bad': []}
+
+
+class FakeDriver:
+    """Answers the extraction script the way the browser would, counting WebDriver round-trips."""
+
+    def __init__(self, page):
+        self.page = page
+        self.round_trips = 0
+        self.page_load_timeout = None
+
+    def set_page_load_timeout(self, seconds):
+        self.page_load_timeout = seconds  # Session setting, applied by the driver without touching the page
+
+    def get(self, url):
+        self.round_trips += 1
+
+    def find_element(self, by, value):
+        self.round_trips += 1  # Used by the presence wait
+        return object()
+
+    def execute_script(self, script, *args):
+        self.round_trips += 1
+        if script == TRANSFER_SIZE_SCRIPT:
+            return len(self.page)
+        return extract_static_fields(self.page, args[0])
+
+
+class FakePool:
+    def __init__(self, driver):
+        self.driver = driver
+
+    @contextmanager
+    def browser(self):
+        yield self.driver
+
+
+def test_parse_website_fields_uses_one_round_trip():
+    page = b"<div><h1>Widget</h1>" + b"<b>100</b>" * 300 + b"<i>In stock</i></div>"
+    driver = FakeDriver(page)
+    xpaths = {FIELD_PRICE: "//b", FIELD_TITLE: "//h1", FIELD_AVAILABILITY: "//i"}
+
+    fields = parser.parse_website_fields("https://spa.example/item", xpaths, FakePool(driver))
+    assert len(fields[FIELD_PRICE]) == 300
+    assert fields[FIELD_TITLE] == ["Widget"] and fields[FIELD_AVAILABILITY] == ["In stock"]
+    assert driver.round_trips == 4  # Load, presence check, one extraction call for all 302 matches, transfer size
+
+    assert parser.parse_website_price("https://spa.example/item", "//b", FakePool(FakeDriver(page))) == 100.0
+
+
+class FakeFetcher:
+    def __init__(self, page):
+        self.page = page
+        self.calls = 0
+
+    def fetch(self, url):
+        self.calls += 1
+        return self.page
+
+
+@pytest.fixture
+def tiers(monkeypatch):
+    memory = TierMemory()
+    monkeypatch.setattr(parser, "tier_memory", memory)
+    return memory
+
+
+def test_parse_price_uses_static_tier_when_xpath_matches(monkeypatch, tiers):
+    monkeypatch.setattr(parser, "get_fetcher", lambda: FakeFetcher(b"<p><b>100</b><b>200</b></p>"))
+    monkeypatch.setattr(parser, "parse_website_price", lambda url, xpath, pool, profile, timeout: pytest.fail("Selenium must not run"))
+
+    assert parser.parse_price("https://static.example/item", "//b") == 150.0
+    assert tiers.get("static.example") == TIER_HTTP
+
+
+def test_parse_price_escalates_and_remembers_selenium(monkeypatch, tiers):
+    fetcher = FakeFetcher(b"<div id='app'></div>")
+    selenium_calls = []
+    monkeypatch.setattr(parser, "get_fetcher", lambda: fetcher)
+    monkeypatch.setattr(parser, "parse_website_price", lambda url, xpath, pool, profile, timeout: selenium_calls.append(url) or 42.0)
+
+    assert parser.parse_price("https://spa.example/item", "//b") == 42.0
+    assert tiers.get("spa.example") == TIER_SELENIUM
+
+    assert parser.parse_price("https://spa.example/other", "//b") == 42.0
+    assert fetcher.calls == 1  # The failing static tier is skipped on repeat runs
+    assert len(selenium_calls) == 2
+
+
+def test_parse_price_retries_only_selenium_within_deadline(monkeypatch, tiers, reliability):
+    fetcher = FakeFetcher(b"<div id='app'></div>")
+    timeouts = []
+
+    def flaky_selenium(url, xpath, pool, profile, timeout):
+        timeouts.append(timeout)
+        if len(timeouts) < 3:
+            raise SiteUnavailable("connection reset")
+        return 42.0
+
+    monkeypatch.setattr(parser, "get_fetcher", lambda: fetcher)
+    monkeypatch.setattr(parser, "parse_website_price", flaky_selenium)
+    assert parser.parse_price("https://spa.example/item", "//b", deadline_at=time.monotonic() + 8) == 42.0
+    assert fetcher.calls == 1 and len(timeouts) == 3  # The static HTML is fetched once, not once per retry
+    assert all(timeout <= 8 for timeout in timeouts)  # Capped at the batch deadline, below the 10s default
+
+
+def test_retry_is_skipped_when_backoff_would_pass_deadline():
+    layer = Reliability(persist=False, backoff=5, min_timeout=1)
+    calls = []
+
+    def down(timeout):
+        calls.append(timeout)
+        raise SiteUnavailable("connection refused")
+
+    start = time.monotonic()
+    with pytest.raises(SiteUnavailable):
+        layer.call("down.example", down, deadline_at=start + 3)
+    assert len(calls) == 1 and calls[0] <= 3
+    assert time.monotonic() - start < 1  # Gave up instead of sleeping past the deadline
+
+
+def test_normalize_key():
+    assert normalize_key(" HTTPS://Shop.Example:443/item?b=2&utm_source=x&a=1#reviews ", " //span ") == \
+        ("https://shop.example/item?a=1&b=2", "//span")
+    # Hash routes of single-page shops are different pages
+    assert normalize_key("https://spa.example/#/item/1", "//b") != normalize_key("https://spa.example/#/item/2", "//b")
+    assert normalize_key("https://spa.example/#!/item/1", "//b")[0] == "https://spa.example/#!/item/1"
+
+
+def test_price_cache_ttl_and_lru():
+    cache = PriceCache(ttl=60, max_entries=2)
+    cache.put("https://a.example/", "//b", 1.0)
+    cache.put("https://b.example/", "//b", 2.0)
+    assert cache.get("https://a.example", "//b") == 1.0  # Touch a, so b is the least recently used
+    cache.put("https://c.example/", "//b", 3.0)
+
+    assert cache.get("https://b.example/", "//b") is None  # Evicted
+    assert cache.get("https://c.example/", "//b") == 3.0
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'hit_rate': 2 / 3, 'size': 2}
+
+    cache.ttl = 0
+    assert cache.get("https://a.example/", "//b") is None  # Expired
+
+
+def test_price_cache_persists(tmp_path):
+    db_path = tmp_path / "cache.db"
+    cache = PriceCache(db_path=db_path)
+    cache.put("https://a.example/", "//b", 10.0)
+    cache.put("https://b.example/", "//b", None)  # Missing prices are not cached
+    cache.close()
+
+    restarted = PriceCache(db_path=db_path)
+    assert restarted.get("https://a.example/", "//b") == 10.0
+    assert restarted.get("https://b.example/", "//b") is None
+    restarted.close()
+
+
+def test_get_average_prices_serves_cache_hits(monkeypatch):
+    cache = PriceCache()
+    cache.put("https://cached.example/", "//b", 5.0)
+    parsed = []
+    monkeypatch.setattr(parser, "get_cache", lambda: cache)
+    monkeypatch.setattr(parser, "get_engine", lambda: ParseEngine(lambda url, xpath, pool, deadline_at: parsed.append(url) or 7.0))
+    sites = [
+        {'title': 'Cached', 'url': 'https://cached.example/', 'xpath': '//b'},
+        {'title': 'Fresh', 'url': 'https://fresh.example/', 'xpath': '//b'},
+    ]
+
+    assert parser.get_average_prices(sites) == {'Cached': 5.0, 'Fresh': 7.0}
+    assert parsed == ['https://fresh.example/']
+
+    assert parser.get_average_prices(sites, refresh=True) == {'Cached': 7.0, 'Fresh': 7.0}
+    assert cache.get("https://cached.example/", "//b") == 7.0
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("1 299,00 ₽", 1299.0),
+    ("1.299,00", 1299.0),
+    ("1,299.00", 1299.0),
+    ("1 299 руб.", 1299.0),
+    ("от 12,5 $", 12.5),
+    ("0,999", 0.999),
+    ("1.234.567", 1234567.0),
+    ("Нет в наличии", None),
+])
+def test_parse_price_text_locales(text, expected):
+    assert parse_price_text(text) == expected
+
+
+def test_clean_prices_and_stats():
+    prices = clean_prices(["100 ₽", "—", "200 ₽", "300 ₽", "10 000 ₽"] + ["150 ₽"] * 6)
+    assert prices[1] is None
+    stats = price_stats(prices)
+    assert stats['count'] == 10
+    assert stats['min'] == 100.0 and stats['max'] == 10000.0
+    assert stats['median'] == 150.0
+    assert stats['trimmed_mean'] < stats['mean']  # The outlier is cut off
+    assert price_stats([None]) is None
+    assert parser.average_price(["1 299,00 ₽", "1.301,00"], "https://shop.example", "//span") == 1300.0
+
+
+def test_lean_profile_options_and_stats():
+    from parser.pool import build_chrome_options
+
+    lean = build_chrome_options(PROFILE_LEAN)
+    assert lean.page_load_strategy == "eager"
+    assert lean.experimental_options["prefs"]["profile.managed_default_content_settings.images"] == 2
+    assert build_chrome_options(PROFILE_FULL).page_load_strategy == "normal"
+    assert normalize_profile(" LEAN ") == PROFILE_LEAN
+    assert normalize_profile("turbo") == normalize_profile(None)
+
+    stats = ProfileStats()
+    stats.record(PROFILE_LEAN, 1.0, 1000)
+    stats.record(PROFILE_LEAN, 3.0, None)
+    assert stats.snapshot() == {PROFILE_LEAN: {'pages': 2, 'avg_seconds': 2.0, 'avg_bytes': 500.0}}
+
+
+@pytest.mark.parametrize("url, blocked", [
+    ("https://cdn.example/fonts/main.woff2?v=3", True),
+    ("https://cdn.example/img/item.jpg#zoom", True),
+    ("https://cdn.example/img/item.png", True),
+    ("https://mc.yandex.ru/watch/123", True),
+    ("https://shop.example/item?img=a.png", True),  # As a subresource; as the page itself it still loads
+    ("https://shop.example/app.js?v=3", False),
+    ("https://shop.example/item/42", False),
+    ("https://www.gifts.ru/catalog/item/1", False),
+    ("https://www.icon-shop.ru/p/2", False),
+    ("https://shop.example/fonts.otfx/3", False),
+])
+def test_lean_profile_blocks_resources_with_query_strings(url, blocked):
+    assert any(url_matches(url, pattern) for pattern in blocked_url_patterns()) == blocked
+    assert not any(url_matches(url, pattern) for pattern in blocked_url_patterns(page_url=url))
+
+
+def test_lean_page_matching_a_blocked_pattern_is_exempted():
+    class CdpDriver:
+        def __init__(self):
+            self.blocked = []
+
+        def execute_cdp_cmd(self, command, params):
+            self.blocked.append(params['urls'])
+
+    driver = CdpDriver()
+    with unblocked_page(driver, PROFILE_LEAN, "https://shop.example/item/42"):
+        pass
+    assert driver.blocked == []  # Nothing to lift, no extra DevTools calls
+
+    with unblocked_page(driver, PROFILE_LEAN, "https://shop.example/item?img=a.png"):
+        assert "*.png" not in driver.blocked[-1] and "*.jpg" in driver.blocked[-1]
+    assert driver.blocked[-1] == blocked_url_patterns()
+
+
+def test_engine_passes_site_profile():
+    calls = []
+
+    def parse(url, xpath, pool, deadline_at=None, profile=None):
+        calls.append((url, profile))
+        return 1.0
+
+    sites = make_sites(2)
+    sites[1]['profile'] = PROFILE_LEAN
+    engine = ParseEngine(parse, max_workers=1)
+    try:
+        list(engine.iter_results(sites))
+    finally:
+        engine.shutdown()
+    assert sorted(calls) == [("https://shop.example/0", None), ("https://shop.example/1", PROFILE_LEAN)]
+
+
+def test_parse_website_fields_reports_latency_and_timeouts(monkeypatch, reliability):
+    monkeypatch.setattr(parser, "MIN_XPATH_WAIT", 0.05)
+    driver = FakeDriver(b"<b>100</b>")
+    parser.parse_website_fields("https://spa.example/item", {FIELD_PRICE: "//b"}, FakePool(driver), timeout=7)
+    assert driver.page_load_timeout == 7
+    assert len(reliability._health("spa.example").latencies) == 1
+
+    class MissingPriceDriver(FakeDriver):
+        def find_element(self, by, value):
+            raise NoSuchElementException()
+
+    with pytest.raises(PriceTimeout):
+        parser.parse_website_fields("https://spa.example/item", {FIELD_PRICE: "//b"},
+                                    FakePool(MissingPriceDriver(b"")), timeout=0.01)
+    assert len(reliability._health("spa.example").latencies) == 2  # The timeout counts as a censored sample
+
+
+def test_reliability_learns_timeout_per_domain():
+    layer = Reliability(persist=False, default_timeout=20, min_timeout=2, max_timeout=30, timeout_factor=2.0)
+    assert layer.timeout_for("slow.example") == 20  # Nothing learned yet
+    for seconds in (1.0, 1.2, 1.5, 1.1, 1.3, 1.4, 4.0):
+        layer.observe_latency("fast.example", seconds)
+        layer.observe_latency("slow.example", seconds * 100)
+    assert layer.timeout_for("fast.example") == 8.0  # p95 (4.0) times the factor
+    assert layer.timeout_for("slow.example") == 30  # Clamped to the maximum
+    assert layer.timeout_for("new.example") == 20
+
+
+def test_reliability_timeout_grows_after_timeouts():
+    layer = Reliability(persist=False, min_timeout=5, max_timeout=60, timeout_factor=2.0)
+    for _ in range(50):
+        layer.observe_latency("shop.example", 1.0)
+    assert layer.timeout_for("shop.example") == 5  # Learned from a fast domain
+    timeouts = []
+    for _ in range(20):  # The domain slowed down to 7s, so every attempt times out
+        timeouts.append(layer.timeout_for("shop.example"))
+        layer.observe_timeout("shop.example", timeouts[-1])
+    assert timeouts[-1] >= 10 and layer.timeout_for("shop.example") == 60
+
+
+def test_reliability_retries_transient_failures(reliability):
+    calls = []
+
+    def flaky(timeout):
+        calls.append(timeout)
+        if len(calls) < 3:
+            raise SiteUnavailable("connection reset")
+        return 10.0
+
+    assert reliability.call("flaky.example", flaky) == 10.0
+    assert len(calls) == 3
+    assert reliability._health("flaky.example").failures == 0
+
+    def missing_price(timeout):
+        calls.append(timeout)
+        raise PriceTimeout("no price")
+
+    calls.clear()
+    with pytest.raises(PriceTimeout):
+        reliability.call("flaky.example", missing_price)
+    assert len(calls) == 1  # The page loaded, so a retry would not help
+    assert 1.0 <= backoff_delay(1) <= 1.5 and 4.0 <= backoff_delay(3) <= 6.0
+
+
+def test_missing_price_does_not_open_breaker():
+    layer = Reliability(persist=False, retries=0, threshold=2, cooldown=3600)
+
+    def missing_price(timeout):
+        raise PriceTimeout("no price")
+
+    for _ in range(5):
+        with pytest.raises(PriceTimeout):
+            layer.call("shop.example", missing_price)
+    assert layer._health("shop.example").failures == 0 and layer.open_domains() == []
+
+    layer._health("shop.example").state = STATE_OPEN  # A half-open probe that loads but finds no price
+    with pytest.raises(PriceTimeout):
+        layer.call("shop.example", missing_price)
+    assert layer.allow("shop.example")  # Neither reopened nor stuck probing
+
+
+def test_circuit_breaker_opens_and_probes_after_cooldown():
+    layer = Reliability(persist=False, retries=0, threshold=3, cooldown=3600)
+
+    def down(timeout):
+        raise SiteUnavailable("connection refused")
+
+    for _ in range(3):
+        with pytest.raises(SiteUnavailable):
+            layer.call("down.example", down)
+    assert layer.open_domains() == ["down.example"]
+    with pytest.raises(CircuitOpen):
+        layer.call("down.example", pytest.fail)
+    assert layer.call("up.example", lambda timeout: 1.0) == 1.0  # Other domains are unaffected
+
+    layer.cooldown = 0
+    layer._health("down.example").opened_until = 0  # Cool-down over
+    assert layer.allow("down.example")
+    assert not layer.allow("down.example")  # Only one probe at a time
+    layer.record_failure("down.example")  # The probe failed: open again
+    assert layer._health("down.example").state == STATE_OPEN
+    assert layer.call("down.example", lambda timeout: 2.0) == 2.0  # Zero cool-down: the next probe closes it
+    assert layer._health("down.example").state == STATE_CLOSED
+    assert layer.open_domains() == []
+
+
+def test_parse_price_skips_domain_with_open_breaker(monkeypatch, tiers, reliability):
+    monkeypatch.setattr(parser, "get_fetcher", lambda: FakeFetcher(b"<div id='app'></div>"))
+    monkeypatch.setattr(parser, "parse_website_price", lambda url, xpath, pool, profile, timeout: pytest.fail("Skipped"))
+    for _ in range(reliability.threshold):
+        reliability.record_failure("down.example")
+
+    with pytest.raises(CircuitOpen):
+        parser.parse_price("https://down.example/item", "//b")
+
+
+def test_breaker_state_survives_restart(tmp_path, monkeypatch):
+    from db import database
+
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "zuzu_bot.db"))
+    database.init_db()
+    try:
+        layer = Reliability(threshold=1, cooldown=3600)
+        for seconds in range(1, 11):
+            layer.observe_latency("shop.example", seconds / 10)
+        layer.record_failure("shop.example")
+
+        restarted = Reliability(min_timeout=1)
+        assert restarted.open_domains() == ["shop.example"]
+        assert restarted.timeout_for("shop.example") == pytest.approx(2.0)  # Stored p95 (1.0) times the factor
+    finally:
+        database.close_connections()
+
+
+def test_bot_imports_without_heavy_modules():
+    code = ("import sys, bot.handlers.basic, parser.parser, parser.pool; "
+            "print(sorted(m for m in ('selenium', 'webdriver_manager', 'pandas', 'openpyxl') if m in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
+
+
+def test_driver_path_is_resolved_once_and_cached(tmp_path, monkeypatch):
+    from parser import pool
+
+    driver = tmp_path / "chromedriver"
+    driver.write_text("")
+    cache_file = str(tmp_path / "chromedriver_path")
+    installs = []
+    monkeypatch.delenv("CHROMEDRIVER_PATH", raising=False)
+    monkeypatch.setattr(pool, "_install_driver", lambda: installs.append(1) or str(driver))
+    monkeypatch.setattr(pool, "_driver_paths", {})
+    assert pool.resolve_driver_path(cache_file) == str(driver)
+    pool._driver_paths.clear()  # A restart
+    assert pool.resolve_driver_path(cache_file) == str(driver)
+    assert len(installs) == 1  # The second start used the cached path
+
+    driver.unlink()  # The cached driver is gone: resolve again
+    pool._driver_paths.clear()
+    pool.resolve_driver_path(cache_file)
+    assert len(installs) == 2
+
+
+def test_concurrent_first_calls_install_driver_once(tmp_path, monkeypatch):
+    from parser import pool
+
+    installs = []
+
+    def slow_install():
+        installs.append(1)
+        time.sleep(0.1)  # Downloading
+        return "/opt/chromedriver"
+
+    monkeypatch.delenv("CHROMEDRIVER_PATH", raising=False)
+    monkeypatch.setattr(pool, "_install_driver", slow_install)
+    monkeypatch.setattr(pool, "_driver_paths", {})
+    cache_file = str(tmp_path / "chromedriver_path")
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(pool.resolve_driver_path(cache_file))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert installs == [1] and paths == ["/opt/chromedriver"] * 4
+
+
+def test_warm_up_after_shutdown_quits_browsers(monkeypatch):
+    from parser.pool import BrowserPool
+
+    class Browser:
+        def __init__(self):
+            self.driver = self
+            self.quit_called = False
+
+        def quit(self):
+            self.quit_called = True
+
+    browsers = []
+    pool = BrowserPool(size=2)
+
+    def start_browser():
+        pool.shutdown()  # The bot stopped while Chrome was starting
+        browsers.append(Browser())
+        return browsers[-1]
+
+    monkeypatch.setattr(pool, "_start_browser", start_browser)
+    pool.warm_up()
+    assert browsers and all(browser.quit_called for browser in browsers)
+    assert pool.browsers == 0
+
+
+class QuittableDriver:
+    def __init__(self):
+        self.quit_called = False
+
+    def quit(self):
+        self.quit_called = True
+
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    from parser.pool import BrowserPool, PooledBrowser
+
+    def make(size, max_pages=50):
+        pool = BrowserPool(size=size, max_pages=max_pages)
+        pool.started = []
+        monkeypatch.setattr(pool, "_start_browser", lambda: pool.started.append(PooledBrowser(QuittableDriver())) or pool.started[-1])
+        monkeypatch.setattr(pool, "_reset", lambda browser: True)
+        return pool
+
+    return make
+
+
+def test_pool_reuses_released_browser(fake_pool):
+    pool = fake_pool(size=2)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    second = pool.acquire()
+    assert second is not first and pool.browsers == 2 and len(pool.started) == 2
+
+
+def test_pool_recycles_worn_out_and_crashed_browsers(fake_pool):
+    pool = fake_pool(size=1, max_pages=2)
+    browser = pool.acquire()
+    pool.release(browser)
+    assert pool.acquire() is browser
+    pool.release(browser)  # Second page: worn out
+    assert browser.driver.quit_called and pool.browsers == 0
+
+    replacement = pool.acquire()
+    assert replacement is not browser
+    pool._reset = lambda browser: False  # Chrome crashed during the job
+    pool.release(replacement)
+    assert replacement.driver.quit_called and pool.browsers == 0
+
+
+def test_pool_wakes_waiter_when_browser_is_recycled(fake_pool):
+    pool = fake_pool(size=1, max_pages=1)
+    browser = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire(timeout=5)))
+    waiter.start()
+    time.sleep(0.1)  # The waiter blocks on the full pool
+    start = time.monotonic()
+    pool.release(browser)  # Worn out, so it is quit instead of handed over
+    waiter.join(5)
+    assert acquired and acquired[0] is not browser
+    assert time.monotonic() - start < 1
+    assert pool.browsers == 1
+
+
+def test_pool_acquire_times_out_and_fails_after_shutdown(fake_pool):
+    pool = fake_pool(size=1)
+    browser = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.05)
+    pool.shutdown()
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+    pool.release(browser)
+    assert browser.driver.quit_called and pool.browsers == 0
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock
+
+import pytest
+
+from bot.scheduler import CatalogScheduler
+from db.database import get_price_history, record_prices, save_website_data, subscribe
+from parser.engine import ParseEngine
+
+
+@pytest.mark.asyncio
+async def test_run_cycle_records_changes_and_notifies_subscribers(db_path):
+    ids = save_website_data([
+        {'title': 'Changed', 'url': 'https://a.example/1', 'xpath': '//b'},
+        {'title': 'Same', 'url': 'https://a.example/2', 'xpath': '//b'},
+        {'title': 'New', 'url': 'https://b.example/', 'xpath': '//b'},
+    ])
+    now = int(time.time())
+    record_prices([(ids[0], 100.0), (ids[1], 50.0)], observed_at=now - 60)
+    subscribe(7, [ids[0], ids[1]])
+
+    new_prices = {'https://a.example/1': 120.0, 'https://a.example/2': 50.0, 'https://b.example/': 10.0}
+    bot = AsyncMock()
+    scheduler = CatalogScheduler(bot, jitter=0, domain_gap=0, concurrency=2,
+                                 parse_func=lambda url, xpath: new_prices[url])
+
+    changes = await scheduler.run_cycle()
+    await scheduler.stop()
+
+    assert [(website['title'], old, new) for website, old, new in changes] == [('Changed', 100.0, 120.0)]
+    assert len(get_price_history(ids[0])) == 2
+    assert len(get_price_history(ids[1])) == 1  # Unchanged price recorded earlier today is skipped
+    assert len(get_price_history(ids[2])) == 1
+    bot.send_message.assert_called_once()
+    assert bot.send_message.call_args[0][0] == 7
+    assert "<b>Changed</b>: 100.00 → 120.00" in bot.send_message.call_args[0][1]
+
+
+@pytest.mark.asyncio
+async def test_domain_requests_are_spaced(db_path):
+    save_website_data([{'title': f"Site {i}", 'url': f"https://same.example/{i}", 'xpath': '//b'} for i in range(3)])
+    starts = []
+
+    def parse(url, xpath):
+        starts.append(time.monotonic())
+        return 1.0
+
+    scheduler = CatalogScheduler(AsyncMock(), jitter=0, domain_gap=0.1, concurrency=3, parse_func=parse)
+    await scheduler.run_cycle()
+    await scheduler.stop()
+
+    starts.sort()
+    assert all(later - earlier >= 0.09 for earlier, later in zip(starts, starts[1:]))
+
+
+@pytest.mark.asyncio
+async def test_scheduled_parses_share_engine_domain_limit(db_path):
+    save_website_data([{'title': f"Site {i}", 'url': f"https://busy.example/{i}", 'xpath': '//b'} for i in range(2)])
+    engine = ParseEngine(lambda url, xpath, pool, deadline_at: None, per_domain_limit=1)
+    parsed = []
+
+    def parse(url, xpath):
+        parsed.append(url)
+        return 1.0
+
+    scheduler = CatalogScheduler(AsyncMock(), jitter=0, domain_gap=0, concurrency=2, parse_func=parse, engine=engine)
+    with engine.domain_slot("busy.example"):  # A user's upload is parsing the shop
+        cycle = asyncio.create_task(scheduler.run_cycle())
+        await asyncio.sleep(0.2)
+        assert parsed == []
+    await cycle
+    await scheduler.stop()
+    engine.shutdown()
+
+    assert len(parsed) == 2
+    assert scheduler._domain_next_start == {}  # Domains past their gap are forgotten
+
+
+@pytest.mark.asyncio
+async def test_cycle_spreads_sites_over_jitter_once(db_path):
+    save_website_data([{'title': f"Site {i}", 'url': f"https://shop{i}.example/", 'xpath': '//b'} for i in range(250)])
+    starts = []
+
+    def parse(url, xpath):
+        starts.append(time.monotonic())
+        return 1.0
+
+    scheduler = CatalogScheduler(AsyncMock(), jitter=0.6, domain_gap=0, concurrency=8, parse_func=parse)
+    start = time.monotonic()
+    await scheduler.run_cycle()
+    elapsed = time.monotonic() - start
+    await scheduler.stop()
+
+    assert len(starts) == 250
+    assert 0.5 <= elapsed < 1.2  # One jitter window for the whole catalog, not one per page of 100
+    assert max(starts) - min(starts) >= 0.4  # The sites are spread over the window, not bunched up
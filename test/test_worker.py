@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+from db import database
+from db.database import count_parse_tasks, create_parse_job
+from parser import tasks
+from parser.cache import PriceCache
+from parser.tasks import queued_parse_price, stream_queued_prices
+from worker.worker import Worker
+
+
+@pytest.fixture
+def db_path(db_path, monkeypatch):
+    """The shared scratch database, polled quickly and with a fresh price cache per test."""
+    monkeypatch.setattr(tasks, "TASK_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(tasks, "get_cache", lambda: PriceCache())
+    return db_path
+
+
+@pytest.fixture
+def worker(db_path):
+    """A worker running in the background that prices every page at its number, failing on 'broken' domains."""
+    def parse(url, xpath, profile=None):
+        if "broken" in url:
+            raise RuntimeError("Page failed to load")
+        return float(url.rsplit("/", 1)[1])
+
+    worker = Worker(threads=3, parse_func=parse, poll_interval=0.01)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    yield worker
+    worker.stop()
+    thread.join()
+
+
+@pytest.mark.asyncio
+async def test_stream_queued_prices_collects_worker_results(worker):
+    sites = [{'title': f"Site {i}", 'url': f"https://shop{i % 3}.example/{i}", 'xpath': '//b'} for i in range(10)]
+    sites.append({'title': 'Broken', 'url': 'https://broken.example/1', 'xpath': '//b'})
+
+    prices = {website['title']: price async for website, price in stream_queued_prices(sites, user_id=1)}
+    assert prices == {**{f"Site {i}": float(i) for i in range(10)}, 'Broken': None}
+    assert worker.processed == 11
+    assert count_parse_tasks() == {}  # Results are taken off the queue
+
+
+@pytest.mark.asyncio
+async def test_stream_queued_prices_gives_up_at_deadline(db_path):
+    sites = [{'title': 'Slow', 'url': 'https://slow.example/1', 'xpath': '//b'}]  # No worker is running
+    assert [item async for item in stream_queued_prices(sites, deadline=0.05)] == [(sites[0], None)]
+    assert count_parse_tasks() == {}  # The unfinished task is withdrawn
+
+
+def test_queued_parse_price_for_scheduler(worker):
+    assert queued_parse_price("https://shop.example/42", "//b") == 42.0
+    assert queued_parse_price("https://broken.example/1", "//b") is None
+
+
+def test_worker_drops_result_of_withdrawn_task(db_path):
+    create_parse_job([{'domain': "shop.example", 'url': "https://shop.example/1", 'xpath': '//b'}])
+
+    def parse(url, xpath):
+        database.delete_parse_job(1)  # The bot gave up on the job meanwhile
+        return 1.0
+
+    worker = Worker(parse_func=parse)
+    assert worker.run_once()
+    assert not worker.run_once()
+    assert count_parse_tasks() == {}
+
+
+def test_worker_threads_hold_separate_leases(db_path):
+    create_parse_job([{'domain': "shop.example", 'url': "https://shop.example/1", 'xpath': '//b'}])
+    worker = Worker()
+    leases = []
+
+    def lease_again():  # Another thread of the same worker, still parsing when the first one finishes
+        leases.append((worker.lease_id(), database.lease_parse_tasks(worker.lease_id())))
+
+    def parse(url, xpath):
+        with database.transaction() as conn:  # The lease expires while the page is still loading
+            conn.execute("UPDATE parse_tasks SET lease_until = 0")
+        other = threading.Thread(target=lease_again)
+        other.start()
+        other.join()
+        return 1.0
+
+    worker.parse_func = parse
+    assert worker.run_once()
+    [(lease_id, [task])] = leases
+    assert count_parse_tasks() == {'leased': 1}  # The first thread's stale result was dropped
+    assert database.complete_parse_task(task['id'], lease_id, 2.0)
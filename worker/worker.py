@@ -0,0 +1,134 @@
+"""
+Parse worker of the distributed mode (PARSER_MODE=distributed).
+
+Leases the parse tasks the bot publishes to the database, parses each site
+with the usual tiers (static HTTP first, then the browser pool) and writes the
+price back. Run as many workers as the hosts allow; every worker needs the
+same database file (DATABASE_PATH):
+
+    python -m worker.worker --threads 4
+
+A worker that dies leaves its tasks leased; once their lease expires
+(TASK_LEASE_SECONDS) they are handed to another worker.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sqlite3
+import threading
+
+from db.database import close_connections, complete_parse_task, init_db, lease_parse_tasks
+from parser.engine import MAX_WORKERS
+from parser.fetch import shutdown_fetcher
+from parser.parser import parse_price
+from parser.pool import prewarm_pool, shutdown_pool
+from parser.tasks import TASK_LEASE_SECONDS, TASK_MAX_ATTEMPTS, TASK_PER_DOMAIN_LIMIT
+
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", str(MAX_WORKERS)))  # Sites one worker parses at the same time
+IDLE_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1.0"))  # Seconds between checks of an empty queue
+LEASE_BATCH = int(os.getenv("WORKER_LEASE_BATCH", "2"))  # Tasks a thread leases per trip to the database
+
+
+class Worker:
+    """
+    Pulls parse tasks from the database queue on `threads` threads until stopped.
+
+    Each thread leases a small batch of tasks (`lease_batch`) per trip to the
+    queue and parses them in turn, so the database is asked less often while a
+    slow site holds up at most `lease_batch - 1` tasks behind it. The per-domain
+    limit is enforced by the lease query across all workers.
+    """
+
+    def __init__(self, threads=WORKER_THREADS, parse_func=parse_price, worker_id=None,
+                 lease_seconds=TASK_LEASE_SECONDS, max_attempts=TASK_MAX_ATTEMPTS,
+                 per_domain_limit=TASK_PER_DOMAIN_LIMIT, poll_interval=IDLE_POLL_INTERVAL, lease_batch=LEASE_BATCH):
+        self.threads = threads
+        self.parse_func = parse_func  # Called as parse_func(url, xpath[, profile=...]) -> price or None
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.per_domain_limit = per_domain_limit
+        self.poll_interval = poll_interval
+        self.lease_batch = lease_batch
+        self.processed = 0  # Tasks finished by this worker
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def lease_id(self):
+        """
+        Lease owner of the calling thread.
+
+        Every thread holds its leases under its own id, so a thread whose lease
+        expired cannot complete a task another thread of this worker leased since.
+        """
+        return f"{self.worker_id}:{threading.get_ident()}"
+
+    def run_once(self):
+        """Leases and parses a batch of tasks. Returns False if the queue had nothing to lease."""
+        lease_id = self.lease_id()
+        tasks = lease_parse_tasks(lease_id, self.lease_batch, self.lease_seconds, self.per_domain_limit,
+                                  self.max_attempts)
+        for task in tasks:
+            self._process(task, lease_id)
+        return bool(tasks)
+
+    def _process(self, task, lease_id):
+        options = {'profile': task['profile']} if task['profile'] else {}
+        price, error = None, None
+        try:
+            price = self.parse_func(task['url'], task['xpath'], **options)
+        except Exception as e:
+            logging.error(f"An error occurred while parsing {task['url']}: {e}")
+            error = str(e) or type(e).__name__
+        if not complete_parse_task(task['id'], lease_id, price, error):
+            logging.warning(f"Lease on task {task['id']} was lost, dropping its result")
+        with self._lock:
+            self.processed += 1
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if not self.run_once():
+                    self._stop.wait(self.poll_interval)
+            except sqlite3.Error as e:
+                logging.error(f"Task queue unavailable: {e}")
+                self._stop.wait(self.poll_interval)
+
+    def run(self):
+        """Processes tasks until `stop` is called. Blocks."""
+        logging.info(f"Worker {self.worker_id} started with {self.threads} threads")
+        threads = [threading.Thread(target=self._loop, name=f"worker-{i}") for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logging.info(f"Worker {self.worker_id} stopped after {self.processed} tasks")
+
+    def stop(self):
+        """Lets every thread finish its current batch and exit."""
+        self._stop.set()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--threads", type=int, default=WORKER_THREADS, help="Sites parsed at the same time")
+    args = argparser.parse_args()
+
+    init_db()
+    worker = Worker(threads=args.threads)
+    prewarm_pool()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: worker.stop())
+    try:
+        worker.run()
+    finally:
+        shutdown_fetcher()
+        shutdown_pool()
+        close_connections()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()